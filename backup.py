@@ -0,0 +1,287 @@
+"""Online backups of the patients database, and restoring them.
+
+A backup is copied with SQLite's online backup API, BACKUP_PAGES_PER_STEP
+pages at a time, over a connection of its own: the program, or the clinic
+server, keeps reading and writing the database meanwhile. In WAL mode the
+copy reads one snapshot from a read transaction held throughout, which does
+not hold up writers. In other journal modes a write from another connection
+makes SQLite start the copy over; after MAX_RESTARTS of those the rest is
+copied in a single step, which keeps writers waiting until it is done.
+
+The copy is written under a temporary name, checked with PRAGMA
+integrity_check, given a .sha256 file and only then renamed into place; the
+oldest backups beyond the number to keep are deleted.
+
+    python backup.py                    take a backup now
+    python backup.py --list             list the backups and check each one
+    python backup.py --restore FILE     check FILE and copy it over the database
+
+Close the program and stop the clinic server before restoring. The database
+as it was is backed up first, so a restore can itself be undone.
+
+Nothing in here depends on Qt; backups are meant to run off the GUI thread.
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from storage import register_sql_functions
+
+BACKUP_PAGES_PER_STEP = 1024  # 4 MiB with the default page size
+BUSY_RETRY_SECONDS = 0.01       # wait before retrying a step the database was locked for
+MAX_RESTARTS = 3
+CHECK_OPS_PER_CANCEL_POLL = 10000  # SQLite VM instructions between checks for cancellation
+CHECKSUM_SUFFIX = '.sha256'
+
+
+class BackupError(Exception):
+    """A backup or a restore could not be made, or did not check out."""
+
+
+class BackupCancelled(Exception):
+    pass
+
+
+def backup_directory(config):
+    """The backup directory of config; a relative one is taken from the database's directory."""
+    database_path = config['database']['path']
+    return os.path.join(os.path.dirname(os.path.abspath(database_path)), config['backup']['directory'])
+
+
+def _backup_prefix(database_path):
+    return os.path.splitext(os.path.basename(database_path))[0] + '-'
+
+
+def list_backups(database_path, directory):
+    """Paths of the finished backups of database_path in directory, newest first."""
+    if not os.path.isdir(directory):
+        return []
+    prefix = _backup_prefix(database_path)
+    paths = [os.path.join(directory, name) for name in os.listdir(directory)
+             if name.startswith(prefix) and name.endswith('.db')]
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def _new_backup_path(database_path, directory):
+    name = _backup_prefix(database_path) + datetime.now().strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(directory, name + '.db')
+    number = 2
+    while os.path.exists(path):
+        path = os.path.join(directory, '%s-%d.db' % (name, number))
+        number += 1
+    return path
+
+
+def _connect(path, **options):
+    conn = sqlite3.connect(path, **options)
+    # integrity_check evaluates the expression index on normalize_name()
+    register_sql_functions(conn)
+    return conn
+
+
+def file_checksum(path, is_cancelled=lambda: False):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as data:
+        for chunk in iter(lambda: data.read(1024 * 1024), b''):
+            if is_cancelled():
+                raise BackupCancelled()
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def integrity_problems(path, is_cancelled=lambda: False):
+    """What PRAGMA integrity_check finds wrong with the database at path; empty if nothing."""
+    if not os.path.exists(path):
+        return ["%s does not exist" % path]
+    conn = _connect(path)
+    # A non-zero return interrupts the check, which takes minutes on a large database
+    conn.set_progress_handler(is_cancelled, CHECK_OPS_PER_CANCEL_POLL)
+    try:
+        rows = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patients'").fetchone():
+            rows.append("no patients table")
+    except sqlite3.DatabaseError as exc:
+        if is_cancelled():
+            raise BackupCancelled()
+        return [str(exc)]
+    finally:
+        conn.close()
+    return [] if rows == ['ok'] else rows
+
+
+def verify_backup(path):
+    """Problems with the backup at path: a checksum that does not match, or integrity_check failures."""
+    try:
+        with open(path + CHECKSUM_SUFFIX, encoding='ascii') as checksum_file:
+            expected = checksum_file.read().split()[0]
+    except (OSError, IndexError):
+        return ["no checksum file"]
+    if file_checksum(path) != expected:
+        return ["checksum does not match: the file changed after the backup was made"]
+    return integrity_problems(path)
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _copy(source, target, pages, progress, is_cancelled, notice):
+    wal = source.execute("PRAGMA journal_mode").fetchone()[0].lower() == 'wal'
+    if wal:
+        # Pin one snapshot for the whole copy, so writes made meanwhile never restart it
+        source.execute("BEGIN")
+        source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+    restarts = [0]
+    last_remaining = [None]
+
+    def step(status, remaining, total):
+        # Raising here makes sqlite3 abandon the copy
+        if is_cancelled():
+            raise BackupCancelled()
+        if last_remaining[0] is not None and remaining > last_remaining[0]:
+            restarts[0] += 1
+            if restarts[0] > MAX_RESTARTS:
+                raise _TooManyRestarts()
+        last_remaining[0] = remaining
+        progress(total - remaining, total)
+
+    try:
+        source.backup(target, pages=pages, progress=step, sleep=BUSY_RETRY_SECONDS)
+    except _TooManyRestarts:
+        notice("the database kept changing during the backup (%d restarts); "
+               "copied in one step instead, holding up writes meanwhile" % MAX_RESTARTS)
+        source.backup(target, pages=-1, sleep=BUSY_RETRY_SECONDS)
+    finally:
+        if wal:
+            source.execute("COMMIT")
+
+
+def _discard(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def create_backup(database_path, directory, keep=None, pages=BACKUP_PAGES_PER_STEP,
+                  progress=lambda copied, total: None, is_cancelled=lambda: False, notice=lambda message: None):
+    """Back database_path up into directory and return the new backup's path.
+
+    progress receives the pages copied so far and the total; BackupCancelled is
+    raised once is_cancelled() is true, at any stage. notice receives anything
+    worth telling about the way the backup was made. With keep, only that many
+    backups are left.
+    """
+    if not os.path.exists(database_path):
+        raise BackupError("%s does not exist" % database_path)
+    os.makedirs(directory, exist_ok=True)
+    path = _new_backup_path(database_path, directory)
+    partial_path = path + '.part'
+    try:
+        # Autocommit, so _copy decides when the read transaction starts and ends
+        source = _connect(database_path, isolation_level=None)
+        try:
+            target = _connect(partial_path)
+            try:
+                _copy(source, target, pages, progress, is_cancelled, notice)
+                # A single self-contained file, whatever the journal mode of the database
+                target.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                target.close()
+        finally:
+            source.close()
+        problems = integrity_problems(partial_path, is_cancelled)
+        if problems:
+            raise BackupError("the backup failed integrity_check: " + "; ".join(problems[:5]))
+        checksum = file_checksum(partial_path, is_cancelled)
+        with open(path + CHECKSUM_SUFFIX, 'w', encoding='ascii') as checksum_file:
+            checksum_file.write("%s  %s\n" % (checksum, os.path.basename(path)))
+        os.replace(partial_path, path)
+    except BaseException:
+        _discard(partial_path)
+        raise
+    if keep:
+        rotate_backups(database_path, directory, keep)
+    return path
+
+
+def rotate_backups(database_path, directory, keep):
+    """Delete all but the newest keep backups of database_path."""
+    for path in list_backups(database_path, directory)[keep:]:
+        _discard(path + CHECKSUM_SUFFIX)
+        _discard(path)
+
+
+def _row_counts(conn):
+    tables = [name for name, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'")
+              if not sql.upper().startswith('CREATE VIRTUAL')]
+    return {name: conn.execute('SELECT count(*) FROM "%s"' % name).fetchone()[0] for name in tables}
+
+
+def restore_backup(path, database_path, directory):
+    """Copy the backup at path over database_path, checking both, and return the backup of what was replaced.
+
+    Nothing else may have the database open meanwhile.
+    """
+    problems = verify_backup(path)
+    if problems:
+        raise BackupError("%s is not a usable backup: %s" % (path, "; ".join(problems[:5])))
+    previous = create_backup(database_path, directory) if os.path.exists(database_path) else None
+    source = _connect(path)
+    try:
+        target = _connect(database_path)
+        try:
+            source.backup(target)
+            expected, restored = _row_counts(source), _row_counts(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+    problems = integrity_problems(database_path)
+    if not problems and restored != expected:
+        problems = ["row counts differ from the backup's"]
+    if problems:
+        raise BackupError("the restored database did not check out (%s); the previous one is in %s"
+                          % ("; ".join(problems[:5]), previous))
+    return previous
+
+
+def main():
+    from storage import config
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--list", action="store_true", help="list the backups and check each one")
+    parser.add_argument("--restore", metavar="FILE", help="restore the database from FILE")
+    args = parser.parse_args()
+
+    database_path = config["database"]["path"]
+    directory = backup_directory(config)
+    try:
+        if args.list:
+            for path in reversed(list_backups(database_path, directory)):
+                problems = verify_backup(path)
+                print("%s  %8.1f MiB  %s" % (os.path.basename(path), os.path.getsize(path) / 1024 / 1024,
+                                             "ok" if not problems else "; ".join(problems[:3])))
+        elif args.restore:
+            previous = restore_backup(args.restore, database_path, directory)
+            print("%s restored from %s" % (database_path, args.restore))
+            if previous:
+                print("the database it replaced is backed up in %s" % previous)
+        else:
+            started = time.perf_counter()
+
+            def progress(copied, total):
+                sys.stdout.write("\r%d of %d pages" % (copied, total))
+                sys.stdout.flush()
+
+            path = create_backup(database_path, directory, config["backup"]["keep"], progress=progress,
+                                 notice=lambda message: print("\n" + message))
+            print("\n%s in %.1f s" % (path, time.perf_counter() - started))
+    except BackupError as exc:
+        sys.exit(str(exc))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Measure page navigation in the GUI: latency per navigation, live widgets and memory.
+
+Fills a temporary database, opens the main window (offscreen unless a display
+is asked for) and goes round home -> profile -> home -> form -> home again and
+again, as a user moving through patients does. With pages reused, the
+latency, the number of widgets and the process size stay flat however many
+rounds are made.
+
+    python bench_navigation.py [--patients 500] [--rounds 300] [--every 50]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+
+NOTE = "المريض يعاني من قلق مستمر واضطرابات في النوم منذ عدة أشهر. " * 40
+
+
+def patient_values(i):
+    return {
+        "firstname_familyname": "مريض %d" % i,
+        "age": i % 90,
+        "sex": "ذكر" if i % 2 else "أنثى",
+        "address": "العنوان %d" % (i % 500),
+        "reason_visit": "قلق",
+        "information": NOTE,
+        "history_illness": NOTE,
+        "clinic_follow": NOTE,
+        "diagnosis": NOTE[:200],
+    }
+
+
+def rss_mib():
+    """Resident size of this process, from /proc (Linux only)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        return float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=300)
+    parser.add_argument("--every", type=int, default=50, help="report every this many rounds")
+    parser.add_argument("--display", action="store_true", help="use the real display instead of offscreen")
+    args = parser.parse_args()
+    if not args.display:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    with tempfile.TemporaryDirectory() as directory:
+        # storage reads its configuration on import
+        config_path = os.path.join(directory, "config.json")
+        with open(config_path, "w") as config_file:
+            json.dump({"database": {"path": os.path.join(directory, "patients.db")}}, config_file)
+        os.environ["CLINIC_CONFIG"] = config_path
+
+        from PyQt5.QtWidgets import QApplication
+        app = QApplication(sys.argv)
+        import oussama04
+        from storage import Patient, engine, init_database
+
+        init_database(engine)
+        with engine.begin() as conn:
+            conn.execute(Patient.__table__.insert(), [patient_values(i) for i in range(args.patients)])
+
+        app.setStyleSheet(oussama04.APP_STYLESHEET)
+        window = oussama04.MainWindow()
+        window.show()
+        window.show_home()
+        home = window.home_page
+        home.model.fetchMore()
+        app.processEvents()
+
+        timings = []
+
+        def navigate(go):
+            started = time.perf_counter()
+            go()
+            app.processEvents()  # includes laying out and painting the new page
+            timings.append(time.perf_counter() - started)
+
+        print("%8s %12s %12s %9s %9s" % ("rounds", "median ms", "max ms", "widgets", "RSS MiB"))
+        for round_number in range(1, args.rounds + 1):
+            row = round_number % home.model.rowCount()
+            home.table.setCurrentIndex(home.model.index(row, 0))
+            navigate(home.open_profile)
+            navigate(window.show_home)
+            navigate(home.modify_patient)
+            navigate(window.show_home)
+            if round_number % args.every == 0 or round_number == 1:
+                recent = timings[-4 * args.every:]
+                print("%8d %12.2f %12.2f %9d %9.1f" % (
+                    round_number, statistics.median(recent) * 1000, max(recent) * 1000,
+                    len(QApplication.allWidgets()), rss_mib()))
+        window.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Compare SQLite's default settings with the tuned settings of storage.DEFAULT_CONFIG,
+without and with compressed notes.
+
+Builds a large patients database for each profile in a temporary directory and
+measures the app's typical operations: single-patient saves (one commit each),
+paging through the list in id order and in sorted orders, opening full records
+(as stored, and through the repository, which decompresses them), and editing one field of a patient, writing back either the whole record as the
+form used to or only the changed field.
+
+    python bench_storage.py [--patients 100000] [--saves 500] [--opens 2000] [--edits 500]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from storage import DEFAULT_CONFIG, PATIENT_SORT_KEYS, LocalPatientRepository, Patient, create_sqlite_engine, init_database
+
+
+# Notes are sentences drawn at random from these, so they repeat themselves
+# the way clinical prose does without being one phrase over and over
+SENTENCES = [
+    "المريض يعاني من قلق مستمر واضطرابات في النوم منذ عدة أشهر.",
+    "يذكر المريض صعوبة في التركيز في العمل وتراجعا في الشهية.",
+    "لا توجد سوابق مرضية عضوية مهمة حسب ما صرح به المريض.",
+    "تم الاتفاق على جلسات أسبوعية للمتابعة مع تمارين الاسترخاء.",
+    "لوحظ تحسن طفيف في المزاج مقارنة بالجلسة السابقة.",
+    "تعيش الأسرة ظروفا اجتماعية صعبة أثرت على الحالة النفسية.",
+    "ينصح بتقليل استعمال الهاتف قبل النوم وتنظيم أوقات الراحة.",
+    "أبدى المريض تعاونا جيدا وتقبلا للخطة العلاجية المقترحة.",
+    "ظهرت أفكار سلبية متكررة حول المستقبل والعلاقات مع الآخرين.",
+    "تم شرح طبيعة الاضطراب للمريض وأهمية الالتزام بالمواعيد.",
+]
+
+def note_text(i, sentences=40):
+    rng = random.Random(i)
+    return " ".join(rng.choice(SENTENCES) for _ in range(sentences))
+
+PROFILES = {
+    # Only the path: every pragma left at SQLite's default
+    "default": {"path": None},
+    "tuned": dict(DEFAULT_CONFIG["database"]),
+    "compressed": dict(DEFAULT_CONFIG["database"], compress_notes=True),
+}
+
+
+def patient_values(i):
+    note = note_text(i)
+    return {
+        "firstname_familyname": "مريض %d" % i,
+        "age": i % 90,
+        "sex": "ذكر" if i % 2 else "أنثى",
+        "address": "العنوان %d" % (i % 500),
+        "reason_visit": "قلق",
+        "information": note,
+        "history_illness": note,
+        "clinic_follow": note,
+        "diagnosis": note[:200],
+    }
+
+
+def timed(label, count, fn):
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print("  %-28s %9.0f ops/s  (%.2f s)" % (label, count / elapsed, elapsed))
+
+
+def page_latency(label, repository, sort, descending=False, filters=None):
+    """Page through the whole list as the GUI does; compare the first and the deepest page."""
+    column = list(PATIENT_SORT_KEYS).index(sort)
+    after = None
+    timings = []
+    while True:
+        started = time.perf_counter()
+        rows = repository.list_page(200, sort, descending, filters, after)
+        timings.append(time.perf_counter() - started)
+        if not rows:
+            break
+        after = (rows[-1][column], rows[-1][0])
+    print("  %-28s first page %.2f ms, last page %.2f ms, %d pages"
+          % (label, timings[0] * 1000, timings[-2 if len(timings) > 1 else -1] * 1000, len(timings) - 1))
+
+
+def run(profile, settings, args, directory):
+    settings = dict(settings, path=os.path.join(directory, profile + ".db"))
+    engine = create_sqlite_engine(settings)
+    init_database(engine)
+    Session = sessionmaker(bind=engine)
+    pragmas = ", ".join("%s=%s" % item for item in sorted(settings.items()) if item[0] != "path")
+    print("%s: %s" % (profile, pragmas or "SQLite defaults"))
+
+    # The bulk of the table is loaded in one transaction; it is not what is measured
+    with engine.begin() as conn:
+        conn.execute(Patient.__table__.insert(), [patient_values(i) for i in range(args.patients)])
+
+    def saves():
+        session = Session()
+        for i in range(args.saves):
+            session.add(Patient(**patient_values(args.patients + i)))
+            session.commit()
+        session.close()
+
+    def list_pages():
+        repository = LocalPatientRepository(Session)
+        after = None
+        while True:
+            rows = repository.list_page(200, after=after)
+            if not rows:
+                break
+            after = (rows[-1][0], rows[-1][0])
+
+    def opens():
+        session = Session()
+        rng = random.Random(1)
+        for _ in range(args.opens):
+            session.execute(text("SELECT * FROM patients WHERE id = :id"), {"id": rng.randint(1, args.patients)}).first()
+        session.close()
+
+    def gets():
+        repository = LocalPatientRepository(Session)
+        rng = random.Random(1)
+        for _ in range(args.opens):
+            repository.get(rng.randint(1, args.patients))
+
+    def edits(field, whole_record):
+        repository = LocalPatientRepository(Session)
+        rng = random.Random(2)
+        for i in range(args.edits):
+            patient_id = rng.randint(1, args.patients)
+            values = patient_values(patient_id - 1) if whole_record else {}
+            values[field] = i % 90 if field == "age" else "تعديل %d" % i
+            repository.update(patient_id, values)
+
+    timed("save (commit per patient)", args.saves, saves)
+    timed("list (rows paged)", args.patients + args.saves, list_pages)
+    timed("open full record", args.opens, opens)
+    timed("get patient (repository)", args.opens, gets)
+    timed("edit age, whole record", args.edits, lambda: edits("age", True))
+    timed("edit age, changed field", args.edits, lambda: edits("age", False))
+    timed("edit a note, whole record", args.edits, lambda: edits("evaluation", True))
+    timed("edit a note, changed field", args.edits, lambda: edits("evaluation", False))
+    repository = LocalPatientRepository(Session)
+    page_latency("list sorted by name", repository, "name")
+    page_latency("list by age, descending", repository, "age", descending=True)
+    page_latency("list by age, women only", repository, "age", filters={"sex": "أنثى"})
+    engine.dispose()
+    print("  database size: %.1f MiB" % (os.path.getsize(settings["path"]) / 1024 / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--saves", type=int, default=500)
+    parser.add_argument("--opens", type=int, default=2000)
+    parser.add_argument("--edits", type=int, default=500)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        for profile, settings in PROFILES.items():
+            run(profile, settings, args, directory)
+
+
+if __name__ == "__main__":
+    main()
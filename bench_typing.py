@@ -0,0 +1,105 @@
+"""Measure keystroke latency in the add-patient form, with and without draft autosave.
+
+Types continuously into one of the form's notes, already holding a long text,
+at a fixed rate, pausing now and then as a typist does, and times how long
+each keystroke keeps the GUI thread busy: with no drafts at all, with the
+draft written on every keystroke on the GUI thread, and with the form's
+debounced background autosave, which should match the first.
+
+    python bench_typing.py [--keys 2000] [--interval 15] [--note-kib 64]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--keys", type=int, default=2000, help="keystrokes per run")
+    parser.add_argument("--interval", type=float, default=15, help="ms between keystrokes")
+    parser.add_argument("--burst", type=int, default=200, help="keystrokes between pauses")
+    parser.add_argument("--note-kib", type=int, default=64, help="text already in the note")
+    parser.add_argument("--display", action="store_true", help="use the real display instead of offscreen")
+    args = parser.parse_args()
+    if not args.display:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    with tempfile.TemporaryDirectory() as directory:
+        # storage reads its configuration on import
+        config_path = os.path.join(directory, "config.json")
+        drafts_path = os.path.join(directory, "drafts.jsonl")
+        with open(config_path, "w") as config_file:
+            json.dump({"database": {"path": os.path.join(directory, "patients.db")},
+                       "drafts": {"path": drafts_path}}, config_file)
+        os.environ["CLINIC_CONFIG"] = config_path
+
+        from PyQt5.QtCore import Qt
+        from PyQt5.QtTest import QTest
+        from PyQt5.QtWidgets import QApplication
+        app = QApplication(sys.argv)
+        import oussama04
+
+        app.setStyleSheet(oussama04.APP_STYLESHEET)
+        window = oussama04.MainWindow()
+        window.show()
+        window.show_form()
+        form = window.form_page
+        note = form.inputs["information"]
+        text = "المريض يعاني من قلق مستمر واضطرابات في النوم منذ عدة أشهر. "
+        initial = (text * (args.note_kib * 1024 // len(text.encode("utf-8")) + 1))
+        app.processEvents()
+
+        # Count the journal writes; the file itself gets compacted along the way
+        draft_writes = []
+        save = form.drafts.save
+        form.drafts.save = lambda key, fields: (draft_writes.append(key), save(key, fields))
+
+        def pause(seconds):
+            until = time.perf_counter() + seconds
+            while time.perf_counter() < until:
+                app.processEvents()
+                time.sleep(0.001)
+
+        def run(mode):
+            form.discard_draft()
+            del draft_writes[:]
+            if mode == "no drafts":
+                form.field_edited = lambda field: None
+            elif mode == "every key":
+                form.field_edited = lambda field: form.drafts.save(form.DRAFT_KEY, {field: form.field_text(field)})
+            note.setPlainText(initial)
+            note.setFocus()
+            note.moveCursor(note.textCursor().End)
+            latencies = []
+            for key in range(args.keys):
+                started = time.perf_counter()
+                QTest.keyClick(note, Qt.Key_Space if key % 6 == 5 else Qt.Key_A)
+                latencies.append(time.perf_counter() - started)
+                pause(args.interval / 1000)
+                if key % args.burst == args.burst - 1:
+                    pause(form.AUTOSAVE_DELAY_MS / 1000 + 0.2)
+            pause(form.AUTOSAVE_DELAY_MS / 1000 + 0.2)
+            oussama04.draft_pool.waitForDone()
+            form.__dict__.pop("field_edited", None)
+            print("%-10s median %.2f ms, p99 %.2f ms, max %.2f ms, %d draft writes, journal %.0f KiB" % (
+                mode, statistics.median(latencies) * 1000,
+                percentile(latencies, 0.99) * 1000, max(latencies) * 1000, len(draft_writes),
+                os.path.getsize(drafts_path) / 1024 if os.path.exists(drafts_path) else 0))
+
+        print("%d keystrokes every %g ms into a %d KiB note" % (args.keys, args.interval, args.note_kib))
+        for mode in ("no drafts", "every key", "autosave"):
+            run(mode)
+        window.close()
+
+
+if __name__ == "__main__":
+    main()
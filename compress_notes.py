@@ -0,0 +1,59 @@
+"""Convert the clinical notes already in the database to or from compressed storage.
+
+Set "compress_notes": true in the "database" section of config.json, so notes
+saved from now on are compressed too, then run:
+
+    python compress_notes.py [--decompress] [--batch 500] [--no-vacuum]
+
+Notes are readable in either form, so the conversion can be interrupted and
+run again. Close the program and stop the clinic server first: VACUUM, which
+gives the freed space back to the file system at the end, needs the database
+to itself.
+"""
+import argparse
+import os
+import sys
+import time
+
+from sqlalchemy import text
+
+from storage import config, convert_notes, engine, init_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--decompress", action="store_true", help="store every note as plain text again")
+    parser.add_argument("--batch", type=int, default=500, help="patients per transaction")
+    parser.add_argument("--no-vacuum", action="store_true", help="leave the freed pages in the file")
+    args = parser.parse_args()
+
+    compress = not args.decompress
+    if compress != bool(config["database"]["compress_notes"]):
+        print("Note: config.json has \"compress_notes\": %s, so notes saved from now on will be stored %s."
+              % (str(bool(config["database"]["compress_notes"])).lower(),
+                 "compressed" if config["database"]["compress_notes"] else "as plain text"))
+
+    path = config["database"]["path"]
+    init_database(engine)
+    with engine.connect() as conn:
+        # Move everything from the WAL into the file, so its size says it all
+        conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+    size_before = os.path.getsize(path)
+    started = time.perf_counter()
+
+    def progress(last_id):
+        sys.stdout.write("\rpatients up to id %d" % last_id)
+        sys.stdout.flush()
+
+    rewritten = convert_notes(engine, compress, args.batch, progress)
+    print("\n%d notes %s in %.1f s" % (rewritten, "compressed" if compress else "decompressed",
+                                       time.perf_counter() - started))
+    if not args.no_vacuum:
+        with engine.connect() as conn:
+            conn.execute(text("VACUUM"))
+    engine.dispose()
+    print("%s: %.1f MiB -> %.1f MiB" % (path, size_before / 1024 / 1024, os.path.getsize(path) / 1024 / 1024))
+
+
+if __name__ == "__main__":
+    main()
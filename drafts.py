@@ -0,0 +1,99 @@
+"""Draft journal: unsaved form input kept on disk so a crash does not lose it.
+
+The journal is a file of JSON lines, appended to as the user types. Each line
+holds only the fields changed since the previous line for the same draft:
+
+    {"key": "new", "fields": {"firstname_familyname": "...", "information": "..."}}
+    {"key": "new", "discard": true}
+
+Replaying the lines in order gives the drafts. A line cut short by a crash is
+ignored. Once the file is mostly superseded lines it is rewritten with one
+line per live draft.
+
+Nothing in here depends on Qt; writes are meant to run off the GUI thread.
+"""
+import json
+import os
+import tempfile
+import threading
+
+
+class DraftJournal:
+    """Drafts, by key, of dicts of field name to value, persisted to path."""
+
+    # Rewrite the file once it is this many times the size of the live drafts
+    COMPACT_RATIO = 4
+    COMPACT_MIN_BYTES = 64 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()  # one writer at a time, whichever thread it is on
+        self._drafts = {}
+        self._size = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as journal:
+                data = journal.read()
+        except FileNotFoundError:
+            return
+        self._size = len(data)
+        for line in data.splitlines():
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except ValueError:
+                continue  # the last line of a journal interrupted mid-write
+            self._apply(record)
+
+    def _apply(self, record):
+        if record.get('discard'):
+            self._drafts.pop(record['key'], None)
+        else:
+            self._drafts.setdefault(record['key'], {}).update(record['fields'])
+
+    def get(self, key):
+        """A copy of the draft saved under key, or None."""
+        with self._lock:
+            draft = self._drafts.get(key)
+            return dict(draft) if draft else None
+
+    def save(self, key, fields):
+        """Record changed fields of the draft under key and flush them to disk."""
+        self._append({'key': key, 'fields': fields})
+
+    def discard(self, key):
+        """Forget the draft under key, e.g. once the form it belongs to is saved."""
+        self._append({'key': key, 'discard': True})
+
+    def _append(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            if record.get('discard') and record['key'] not in self._drafts:
+                return
+            self._apply(record)
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'ab') as journal:
+                journal.write(line)
+                journal.flush()
+                os.fsync(journal.fileno())
+            self._size += len(line)
+            if self._size > self.COMPACT_MIN_BYTES:
+                self._compact_if_wasteful()
+
+    def _compact_if_wasteful(self):
+        lines = [(json.dumps({'key': key, 'fields': fields}, ensure_ascii=False) + '\n').encode('utf-8')
+                 for key, fields in self._drafts.items()]
+        live_size = sum(len(line) for line in lines)
+        if self._size < self.COMPACT_RATIO * live_size:
+            return
+        # Written under a temporary name and then renamed, so the journal is never half-written
+        fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', suffix='.part')
+        with os.fdopen(fd, 'wb') as journal:
+            journal.writelines(lines)
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(partial_path, self.path)
+        self._size = live_size
@@ -1,1079 +1,1883 @@
-import sys
-import bcrypt
-from PyQt5 import QtWidgets, QtCore
-from PyQt5.QtWidgets import (
-    QMainWindow, QApplication, QVBoxLayout, QLabel, QLineEdit, QPushButton, 
-    QMessageBox, QTableWidget, QTableWidgetItem, QTextEdit, QFileDialog, QWidget
-)
-from sqlalchemy import create_engine, Column, Integer, String, Text
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from PyQt5.QtWidgets import QScrollArea
-from PyQt5.QtGui import QIcon
-
-# SQLAlchemy setup
-Base = declarative_base()
-
-class Patient(Base):
-    __tablename__ = 'patients'
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    firstname_familyname = Column(String)
-    age = Column(Integer)
-    sex = Column(String)
-    education_level = Column(String)
-    address = Column(String)
-    information = Column(Text)
-    character = Column(Text)
-    reason_visit = Column(String)
-    from_whom = Column(String)
-    history_illness = Column(Text)
-    psychiatric_history = Column(Text)
-    clinic_follow = Column(Text)
-    diagnosis_history = Column(Text)
-    propositions_directing = Column(Text)
-    diagnosis = Column(Text)
-    curing_program = Column(Text)
-    evaluation = Column(Text)
-    reporting = Column(Text)
-    photo = Column(String)  # path to the patient's photo
-
-class User(Base):
-    __tablename__ = 'users'
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    username = Column(String, unique=True, nullable=False)
-    password_hash = Column(String, nullable=False)
-
-# SQLite database setup
-engine = create_engine('sqlite:///patients.db')
-Base.metadata.create_all(engine)
-
-Session = sessionmaker(bind=engine)
-session = Session()
-
-# Home Page
-from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import QVBoxLayout, QHBoxLayout, QMainWindow, QTableWidget, QTableWidgetItem, QPushButton, QMessageBox
-
-# Home Page
-class HomePage(QMainWindow):
-    def __init__(self):
-        super(HomePage, self).__init__()
-        self.setWindowTitle("الصفحة الرئيسية")
-        self.setGeometry(100, 300, 1000, 900)
-        self.setWindowIcon(QIcon('static/logo.ico'))  # Set your application icon
-
-        center(self)
-
-        self.layout = QVBoxLayout()
-
-        # Simplify the table to show only the main information
-        self.table = QTableWidget(self)
-        self.table.setColumnCount(5)
-        self.table.setHorizontalHeaderLabels([
-            "الرقم", "الاسم واللقب", "السن", "العنوان", "سبب الزيارة"
-        ])
-        self.table.horizontalHeader().setStretchLastSection(True)  # Adjusts column to fit the width
-        self.table.setStyleSheet("""
-            QTableWidget {
-                background-color: #f5f5f5;
-                font-size: 14px;
-                border: 1px solid #ddd;
-            }
-            QHeaderView::section {
-                background-color: #3a86ff;
-                color: white;
-                font-weight: bold;
-                height: 30px;
-            }
-        """)
-
-        # Enable double-click on the table to open patient profile
-        self.table.cellDoubleClicked.connect(self.open_profile_on_double_click)
-
-        self.layout.addWidget(self.table)
-
-        self.load_patients()
-
-        # Add buttons with modern styles
-        button_layout = QHBoxLayout()
-
-        self.add_button = QPushButton("إضافة")
-        self.add_button.setStyleSheet(self.get_button_style())
-        self.add_button.clicked.connect(self.add_patient)
-        button_layout.addWidget(self.add_button)
-
-        self.modify_button = QPushButton("تعديل")
-        self.modify_button.setStyleSheet(self.get_button_style())
-        self.modify_button.clicked.connect(self.modify_patient)
-        button_layout.addWidget(self.modify_button)
-
-        self.delete_button = QPushButton("حذف")
-        self.delete_button.setStyleSheet(self.get_button_style())
-        self.delete_button.clicked.connect(self.delete_patient)
-        button_layout.addWidget(self.delete_button)
-
-        self.profile_button = QPushButton("ملف المريض")
-        self.profile_button.setStyleSheet(self.get_button_style())
-        self.profile_button.clicked.connect(self.open_profile)
-        button_layout.addWidget(self.profile_button)
-
-        self.layout.addLayout(button_layout)
-
-        widget = QtWidgets.QWidget()
-        widget.setLayout(self.layout)
-        self.setCentralWidget(widget)
-
-    def get_button_style(self):
-        return """
-            QPushButton {
-                background-color: #3a86ff;
-                color: white;
-                font-size: 14px;
-                padding: 10px;
-                border-radius: 5px;
-            }
-            QPushButton:hover {
-                background-color: #0056b3;
-            }
-        """
-
-    def load_patients(self):
-        self.table.setRowCount(0)  # Clear table
-        patients = session.query(Patient).all()
-        for patient in patients:
-            row_position = self.table.rowCount()
-            self.table.insertRow(row_position)
-            self.table.setItem(row_position, 0, QTableWidgetItem(str(patient.id)))
-            self.table.setItem(row_position, 1, QTableWidgetItem(patient.firstname_familyname))
-            self.table.setItem(row_position, 2, QTableWidgetItem(str(patient.age)))
-            self.table.setItem(row_position, 3, QTableWidgetItem(patient.address))
-            self.table.setItem(row_position, 4, QTableWidgetItem(patient.reason_visit))
-
-    def open_profile_on_double_click(self, row, column):
-        """Opens the profile page when the user double-clicks a row."""
-        selected_patient = self.get_selected_patient()
-        if selected_patient:
-            self.open_profile(selected_patient)
-
-    def add_patient(self):
-        self.modify_page = AddPage()
-        self.modify_page.show()
-        self.close()
-
-    def modify_patient(self):
-        selected_patient = self.get_selected_patient()
-        if selected_patient:
-            self.modify_page = ModifyPage(selected_patient)
-            self.modify_page.show()
-            self.close()
-
-    def delete_patient(self):
-        selected_patient = self.get_selected_patient()
-        if selected_patient:
-            confirm = QMessageBox.question(self, "تأكيد الحذف", "هل أنت متأكد أنك تريد حذف هذا المريض؟", QMessageBox.Yes | QMessageBox.No)
-            if confirm == QMessageBox.Yes:
-                session.delete(selected_patient)
-                session.commit()
-                self.load_patients()
-                #QMessageBox.information(self, "تم الحذف", "تم حذف المريض بنجاح")
-
-    def open_profile(self, patient=None):
-        """Open the profile of the selected patient."""
-        if not patient:
-            patient = self.get_selected_patient()
-        
-        if patient:
-            self.profile_page = ProfilePage(patient)
-            self.profile_page.show()
-
-    def get_selected_patient(self):
-        """Get the currently selected patient in the table."""
-        selected_row = self.table.currentRow()
-        if selected_row != -1:
-            patient_id = self.table.item(selected_row, 0).text()
-            return session.query(Patient).filter_by(id=patient_id).first()
-        else:
-            QMessageBox.warning(self, "خطأ", "يرجى اختيار مريض")
-            return None
-
-from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import QVBoxLayout, QHBoxLayout, QMainWindow, QLabel, QLineEdit, QTextEdit, QPushButton, QScrollArea, QWidget, QFileDialog, QMessageBox
-
-class AddPage(QMainWindow):
-    def __init__(self):
-        super(AddPage, self).__init__()
-        self.setWindowTitle("متابعة المرضى")
-        self.setGeometry(100, 300, 400, 1000)
-        center(self)
-
-        # Create a scroll area
-        self.scroll_area = QScrollArea(self)
-        self.scroll_area.setWidgetResizable(True)
-
-        self.layout = QVBoxLayout()
-
-        # Create form fields in Arabic and apply styles
-        self.firstname_familyname = self.create_styled_lineedit("الاسم واللقب", "form-control")
-        self.age = self.create_styled_lineedit("السن", "form-control")
-        self.sex = self.create_styled_lineedit("الجنس", "form-control")
-        self.education_level = self.create_styled_lineedit("المستوى الدراسي", "form-control")
-        self.address = self.create_styled_lineedit("العنوان", "form-control")
-
-        self.information = self.create_styled_textedit("معلومات", "text-area")
-        self.character = self.create_styled_textedit("الرمز", "text-area")
-        self.reason_visit = self.create_styled_lineedit("سبب الزيارة", "form-control")
-        self.from_whom = self.create_styled_lineedit("جهة الإحالة", "form-control")
-
-        self.history_illness = self.create_styled_textedit("التاريخ المرضي", "text-area")
-        self.psychiatric_history = self.create_styled_textedit("التاريخ النفسي والعقلي والعصبي", "text-area")
-        self.clinic_follow = self.create_styled_textedit("المتابعات الإكلينيكية", "text-area")
-        self.diagnosis_history = self.create_styled_textedit("مجريات الفحص + التاريخ", "text-area")
-
-        self.propositions_directing = self.create_styled_textedit("التوجيهات والإحالات", "text-area")
-        self.diagnosis = self.create_styled_textedit("التشخيص", "text-area")
-        self.curing_program = self.create_styled_textedit("البرنامج العلاجي", "text-area")
-        self.evaluation = self.create_styled_textedit("التقييم", "text-area")
-        self.reporting = self.create_styled_textedit("التقرير", "text-area")
-
-        # File dialog to upload a photo
-        self.photo_button = QPushButton("تحميل صورة")
-        self.photo_button.setStyleSheet(self.get_button_style())
-        self.photo_button.clicked.connect(self.upload_photo)
-        self.layout.addWidget(self.photo_button)
-
-        # Submit button
-        self.submit_button = QPushButton("إضافة")
-        self.submit_button.setStyleSheet(self.get_button_style())
-        self.submit_button.clicked.connect(self.submit_data)
-        self.layout.addWidget(self.submit_button)
-
-        # Back to Home button
-        self.back_button = QPushButton("العودة إلى الصفحة الرئيسية")
-        self.back_button.setStyleSheet(self.get_button_style())
-        self.back_button.clicked.connect(self.go_back_home)
-        self.layout.addWidget(self.back_button)
-
-        # Widget to hold layout and scroll area
-        content_widget = QWidget()
-        content_widget.setLayout(self.layout)
-        self.scroll_area.setWidget(content_widget)
-        self.setCentralWidget(self.scroll_area)
-
-        # Apply global styles
-        self.set_global_styles()
-
-    def create_styled_lineedit(self, placeholder, class_name):
-        """Helper function to create and style QLineEdit."""
-        lineedit = QLineEdit(self)
-        lineedit.setPlaceholderText(placeholder)
-        lineedit.setObjectName(class_name)
-        self.layout.addWidget(QLabel(placeholder))
-        self.layout.addWidget(lineedit)
-        return lineedit
-
-    def create_styled_textedit(self, label_text, class_name):
-        """Helper function to create and style QTextEdit."""
-        textedit = QTextEdit(self)
-        textedit.setObjectName(class_name)
-        self.layout.addWidget(QLabel(label_text))
-        self.layout.addWidget(textedit)
-        return textedit
-
-    def set_global_styles(self):
-        """Set global stylesheet for the entire form."""
-        self.setStyleSheet("""
-            .form-control {
-                padding: 10px;
-                border: 1px solid #ccc;
-                border-radius: 4px;
-                font-size: 14px;
-                margin-bottom: 10px;
-            }
-            QLabel {
-               
-                font-size: 18px;
-                font-weight: bold;
-                color: #2E7D32;
-                margin-bottom: 5px;
-            
-            }
-            .text-area {
-                padding: 10px;
-                border: 1px solid #ccc;
-                border-radius: 4px;
-                font-size: 16px;
-                height: 80px;
-                margin-bottom: 10px;
-            }
-            QPushButton {
-                background-color: #3a86ff;
-                color: white;
-                padding: 10px 20px;
-                border: none;
-                border-radius: 5px;
-                font-size: 16px;
-                width:50px;
-            }
-            QPushButton:hover {
-                background-color: #0056b3;
-            }
-        """)
-
-    def get_button_style(self):
-        """Button style consistent with the home page."""
-        return """
-            QPushButton {
-                background-color: #3a86ff;
-                color: white;
-                font-size: 14px;
-                padding: 10px;
-                border-radius: 5px;
-            }
-            QPushButton:hover {
-                background-color: #0056b3;
-            }
-        """
-
-    def go_back_home(self):
-        # Navigate back to the home page
-        self.home_page = HomePage()
-        self.home_page.show()
-        self.close()
-    
-    def upload_photo(self):
-        file_name, _ = QFileDialog.getOpenFileName(self, "اختر الصورة", "", "Image Files (*.png *.jpg *.bmp)")
-        #print('----------------filename = ------------------------', file_name)
-        if file_name:
-            self.photo_path = file_name
-            save_picture(file_name)
-
-    def submit_data(self):
-        # Save patient data to the database
-
-        
-        patient_data = {
-            "firstname_familyname": self.firstname_familyname.text(),
-            "age": self.age.text(),
-            "sex": self.sex.text(),
-            "education_level": self.education_level.text(),
-            "address": self.address.text(),
-            "information": self.information.toPlainText(),
-            "character": self.character.toPlainText(),
-            "reason_visit": self.reason_visit.text(),
-            "from_whom": self.from_whom.text(),
-            "history_illness": self.history_illness.toPlainText(),
-            "psychiatric_history": self.psychiatric_history.toPlainText(),
-            "clinic_follow": self.clinic_follow.toPlainText(),
-            "diagnosis_history": self.diagnosis_history.toPlainText(),
-            "propositions_directing": self.propositions_directing.toPlainText(),
-            "diagnosis": self.diagnosis.toPlainText(),
-            "curing_program": self.curing_program.toPlainText(),
-            "evaluation": self.evaluation.toPlainText(),
-            "reporting": self.reporting.toPlainText(),
-            "photo": self.photo_path if hasattr(self, 'photo_path') else None,
-        }
-
-        # Save patient data to the database
-        add_patient(patient_data)
-        QMessageBox.information(self, "تم الحفظ", "تم حفظ بيانات المريض بنجاح")
-        self.home_page = HomePage()
-        self.home_page.show()
-        self.close()
-
-# The add_patient function remains unchanged.self.sex = Column(String)
-def add_patient(patient_data):
-    new_patient = Patient(
-        firstname_familyname=patient_data["firstname_familyname"],
-        age=patient_data["age"],
-        sex=patient_data["sex"],
-        education_level=patient_data["education_level"],
-        address=patient_data["address"],
-        information=patient_data["information"],
-        character=patient_data["character"],
-        reason_visit=patient_data["reason_visit"],
-        from_whom=patient_data["from_whom"],
-        history_illness=patient_data["history_illness"],
-        psychiatric_history=patient_data["psychiatric_history"],
-        clinic_follow=patient_data["clinic_follow"],
-        diagnosis_history=patient_data["diagnosis_history"],
-        propositions_directing=patient_data["propositions_directing"],
-        diagnosis=patient_data["diagnosis"],
-        curing_program=patient_data["curing_program"],
-        evaluation=patient_data["evaluation"],
-        reporting=patient_data["reporting"],
-        photo=patient_data["photo"]
-    )
-    session.add(new_patient)
-    session.commit()
-
-def center(window):
-    """Centers the given window on the screen."""
-    screen = QDesktopWidget().screenGeometry()
-    window_size = window.geometry()
-    x = (screen.width() - window_size.width()) // 2
-    y = (screen.height() - window_size.height()) // 2
-    window.move(x, y)
-
-
-from PyQt5.QtWidgets import QLabel, QVBoxLayout, QWidget, QMainWindow, QLineEdit, QPushButton, QTextEdit, QScrollArea, QFileDialog, QMessageBox
-from PyQt5.QtCore import Qt
-class ModifyPage(QMainWindow):
-    def __init__(self, patient):
-        super(ModifyPage, self).__init__()
-        self.patient = patient
-        self.photo_path = patient.photo
-        self.setWindowTitle("تعديل المريض")
-        self.setGeometry(100, 300, 400, 1000)
-        center(self)
-
-        # Create a scroll area
-        self.scroll_area = QScrollArea(self)
-        self.scroll_area.setWidgetResizable(True)
-
-        self.layout = QVBoxLayout()
-
-        # Helper functions for input and label styling
-        def create_styled_input(text=""):
-            input_field = QLineEdit(self)
-            input_field.setText(text)
-            input_field.setStyleSheet("""
-                padding: 10px; 
-                border: 1px solid #388E3C; 
-                border-radius: 5px;
-                font-size: 14px;
-            """)
-            return input_field
-
-        def create_styled_textarea(text=""):
-            textarea = QTextEdit(self)
-            textarea.setText(text)
-            textarea.setStyleSheet("""
-                padding: 10px;
-                border: 1px solid #388E3C;
-                border-radius: 5px;
-                font-size: 16px;
-            """)
-            return textarea
-
-        def create_styled_label(text):
-            label = QLabel(text, self)
-            label.setStyleSheet("""
-                font-size: 18px;
-                font-weight: bold;
-                color: #2E7D32;
-                margin-bottom: 5px;
-            """)
-            return label
-       
-        # Using the helper functions for creating fields and labels
-        self.firstname_familyname = create_styled_input(self.patient.firstname_familyname)
-        self.layout.addWidget(create_styled_label("الاسم واللقب"))
-        self.layout.addWidget(self.firstname_familyname)
-
-        self.age = create_styled_input(str(self.patient.age))
-        self.layout.addWidget(create_styled_label("السن"))
-        self.layout.addWidget(self.age)
-
-        self.sex = create_styled_input(str(self.patient.sex))
-        self.layout.addWidget(create_styled_label("الجنس"))
-        self.layout.addWidget(self.sex)
-
-        self.education_level = create_styled_input(self.patient.education_level)
-        self.layout.addWidget(create_styled_label("المستوى الدراسي"))
-        self.layout.addWidget(self.education_level)
-
-        self.address = create_styled_input(self.patient.address)
-        self.layout.addWidget(create_styled_label("العنوان"))
-        self.layout.addWidget(self.address)
-
-        self.information = create_styled_textarea(self.patient.information)
-        self.layout.addWidget(create_styled_label("معلومات"))
-        self.layout.addWidget(self.information)
-
-        self.character = create_styled_textarea(self.patient.character)
-        self.layout.addWidget(create_styled_label("الرمز"))
-        self.layout.addWidget(self.character)
-
-        self.reason_visit = create_styled_input(self.patient.reason_visit)
-        self.layout.addWidget(create_styled_label("سبب الزيارة"))
-        self.layout.addWidget(self.reason_visit)
-
-        self.from_whom = create_styled_input(self.patient.from_whom)
-        self.layout.addWidget(create_styled_label("جهة الإحالة"))
-        self.layout.addWidget(self.from_whom)
-
-        self.history_illness = create_styled_textarea(self.patient.history_illness)
-        self.layout.addWidget(create_styled_label("التاريخ المرضي"))
-        self.layout.addWidget(self.history_illness)
-
-        self.psychiatric_history = create_styled_textarea(self.patient.psychiatric_history)
-        self.layout.addWidget(create_styled_label("التاريخ النفسي والعقلي"))
-        self.layout.addWidget(self.psychiatric_history)
-
-        self.clinic_follow = create_styled_textarea(self.patient.clinic_follow)
-        self.layout.addWidget(create_styled_label("المتابعات الاكلينيكية"))
-        self.layout.addWidget(self.clinic_follow)
-
-        self.diagnosis_history = create_styled_textarea(self.patient.diagnosis_history)
-        self.layout.addWidget(create_styled_label("مجريات الفحص"))
-        self.layout.addWidget(self.diagnosis_history)
-
-        self.propositions_directing = create_styled_textarea(self.patient.propositions_directing)
-        self.layout.addWidget(create_styled_label("التوجيهات والاحالات"))
-        self.layout.addWidget(self.propositions_directing)
-
-        self.diagnosis = create_styled_textarea(self.patient.diagnosis)
-        self.layout.addWidget(create_styled_label("التشخيص"))
-        self.layout.addWidget(self.diagnosis)
-
-        self.curing_program = create_styled_textarea(self.patient.curing_program)
-        self.layout.addWidget(create_styled_label("البرنامج العلاجي"))
-        self.layout.addWidget(self.curing_program)
-
-        self.evaluation = create_styled_textarea(self.patient.evaluation)
-        self.layout.addWidget(create_styled_label("التقييم"))
-        self.layout.addWidget(self.evaluation)
-
-        self.reporting = create_styled_textarea(self.patient.reporting)
-        self.layout.addWidget(create_styled_label("التقرير"))
-        self.layout.addWidget(self.reporting)
-
-        # File dialog to upload a photo
-        self.photo_button = QPushButton("تحميل صورة")
-        self.photo_button.setStyleSheet(self.get_button_style())
-        self.photo_button.clicked.connect(self.upload_photo)
-        self.layout.addWidget(self.photo_button)
-        
-
-        # Save button
-        self.save_button = QPushButton("حفظ")
-        self.save_button.setStyleSheet(self.get_button_style())
-        self.layout.addWidget(self.save_button)
-        self.save_button.clicked.connect(self.save_changes)
-
-        widget = QtWidgets.QWidget()
-        widget.setLayout(self.layout)
-        self.setCentralWidget(widget)
-
-        # Create a QWidget to hold the layout, and set it as the scroll area's widget
-        content_widget = QWidget()
-        content_widget.setLayout(self.layout)
-
-         # Back to Home button
-        self.back_button = QPushButton("العودة إلى الصفحة الرئيسية")
-        
-        self.back_button.setStyleSheet(self.get_button_style())
-        self.back_button.clicked.connect(self.go_back_home)
-        self.layout.addWidget(self.back_button)
-
-        # Set the content widget to the scroll area
-        self.scroll_area.setWidget(content_widget)
-
-        # Set the scroll area as the central widget of the window
-        self.setCentralWidget(self.scroll_area)
-
-    def upload_photo(self):
-        file_name, _ = QFileDialog.getOpenFileName(self, "اختر الصورة", "", "Image Files (*.png *.jpg *.bmp)")
-        #print("-----------filename=---------------",file_name)
-        if file_name:
-            self.photo_path = file_name
-            save_picture(file_name)
-            
-
-    def go_back_home(self):
-            # Navigate back to the home page
-            self.home_page = HomePage()
-            self.home_page.show()
-            self.close()
-
-    def get_button_style(self):
-            """Button style consistent with the home page."""
-            return """
-                QPushButton {
-                    background-color: #3a86ff;
-                    color: white;
-                    font-size: 14px;
-                    padding: 10px;
-                    border-radius: 5px;
-                }
-                QPushButton:hover {
-                    background-color: #0056b3;
-                }
-            """
-    def save_changes(self):
-        self.patient.firstname_familyname = self.firstname_familyname.text()
-        self.patient.age = self.age.text()
-        self.patient.sex = self.sex.text()
-        self.patient.education_level = self.education_level.text()
-        self.patient.address = self.address.text()
-        self.patient.information = self.information.toPlainText()
-        self.patient.character = self.character.toPlainText()
-        self.patient.reason_visit = self.reason_visit.text()
-        self.patient.from_whom = self.from_whom.text()
-        self.patient.history_illness = self.history_illness.toPlainText()
-        self.patient.psychiatric_history = self.psychiatric_history.toPlainText()
-        self.patient.clinic_follow = self.clinic_follow.toPlainText()
-        self.patient.diagnosis_history = self.diagnosis_history.toPlainText()
-        self.patient.propositions_directing = self.propositions_directing.toPlainText()
-        self.patient.diagnosis = self.diagnosis.toPlainText()
-        self.patient.curing_program = self.curing_program.toPlainText()
-        self.patient.evaluation = self.evaluation.toPlainText()
-        self.patient.reporting = self.reporting.toPlainText()
-        self.patient.photo = self.photo_path
-        
-        session.commit()
-        QMessageBox.information(self, "تم الحفظ", "تم حفظ التعديلات بنجاح")
-        self.home_page = HomePage()
-        self.home_page.show()
-        self.close()
-
-
-from PyQt5.QtWidgets import QLabel, QVBoxLayout, QWidget, QMainWindow, QLineEdit, QPushButton, QMessageBox, QDesktopWidget
-from PyQt5 import QtWidgets
-from PyQt5.QtCore import Qt
-
-class LoginPage(QMainWindow):
-    def __init__(self):
-        super(LoginPage, self).__init__()
-        self.setWindowTitle("تسجيل الدخول")
-        self.setGeometry(300, 300, 400, 200)
-
-        # Set background color
-        self.setStyleSheet("background-color: #E0F7FA;")  # Light relaxing cyan color
-
-        # Center the window on the screen
-        center(self)
-
-
-        # Create the layout
-        self.layout = QVBoxLayout()
-        self.layout.setAlignment(Qt.AlignLeft)  # Align items to the right
-
-        # Username input
-        self.username_input = QLineEdit(self)
-        self.username_input.setPlaceholderText("اسم المستخدم")
-        self.username_input.setStyleSheet("padding: 10px; border: 1px solid #00897B; border-radius: 5px;")
-        self.layout.addWidget(QLabel("اسم المستخدم", alignment=Qt.AlignLeft))  # Align label to the right
-        self.layout.addWidget(self.username_input)
-
-        # Password input
-        self.password_input = QLineEdit(self)
-        self.password_input.setPlaceholderText("كلمة المرور")
-        self.password_input.setEchoMode(QLineEdit.Password)
-        self.password_input.setStyleSheet("padding: 10px; border: 1px solid #00897B; border-radius: 5px;")
-        self.layout.addWidget(QLabel("كلمة المرور", alignment=Qt.AlignLeft))  # Align label to the right
-        self.layout.addWidget(self.password_input)
-
-        # Login button
-        self.login_button = QPushButton("تسجيل الدخول")
-        self.login_button.setStyleSheet("""
-            background-color: #00897B; 
-            color: white; 
-            padding: 10px; 
-            border: none; 
-            border-radius: 5px; 
-            font-size: 16px; 
-            font-weight: bold;
-        """) 
-        # Styled button
-
-        # Connect the returnPressed signal for both fields to trigger login when Enter is pressed
-        self.username_input.returnPressed.connect(self.login)
-        self.password_input.returnPressed.connect(self.login)
-
-        self.login_button.clicked.connect(self.login)
-        self.layout.addWidget(self.login_button)
-
-        # Create a central widget and set the layout
-        widget = QWidget()
-        widget.setLayout(self.layout)
-        self.setCentralWidget(widget)
-
-    
-    def login(self):
-        username = self.username_input.text()
-        password = self.password_input.text()
-
-        if not username or not password:
-            QMessageBox.warning(self, "خطأ", "يرجى ملء جميع الحقول")
-            return
-
-        # Check if the username exists
-        user = session.query(User).filter_by(username=username).first()
-
-        if user is None:
-            QMessageBox.warning(self, "خطأ", "اسم المستخدم غير موجود")
-        else:
-            # Verify the password
-            if bcrypt.checkpw(password.encode('utf-8'), user.password_hash.encode('utf-8')):
-                #QMessageBox.information(self, "نجاح", "تم تسجيل الدخول بنجاح")
-                self.home_page = HomePage()
-                self.home_page.show()
-                self.close()  # Close the login page
-            else:
-                QMessageBox.warning(self, "خطأ", "كلمة المرور غير صحيحة")
-
-
-from PyQt5.QtWidgets import QLabel, QVBoxLayout, QWidget, QMainWindow, QGridLayout, QFrame, QPushButton, QScrollArea
-from PyQt5.QtGui import QPixmap, QFont, QPalette, QColor
-from PyQt5.QtCore import Qt
-
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
-from reportlab.lib.units import inch
-from datetime import datetime
-
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase import pdfmetrics
-from bidi.algorithm import get_display
-import arabic_reshaper
-
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as ReportImage
-
-# Add the Arabic TTF font
-pdfmetrics.registerFont(TTFont('Arabic', 'static/Amiri-Regular.ttf'))  # Replace with the actual path to your Arabic font
-
-def reshape_text(text):
-    # Reshape and apply Bidi algorithm to make Arabic readable
-    reshaped_text = arabic_reshaper.reshape(text)
-    bidi_text = get_display(reshaped_text)
-    return bidi_text
-
-class ProfilePage(QMainWindow):
-    def __init__(self, patient):
-        super(ProfilePage, self).__init__()
-        self.setWindowTitle("ملف المريض")
-        self.setGeometry(100, 300, 1000, 900)
-        center(self)
-        #print("-------------------------------",)
-
-        # Create the central widget and layout
-        central_widget = QWidget()
-        self.setCentralWidget(central_widget)
-
-        # Scrollable area
-        scroll_area = QScrollArea()
-        scroll_area.setWidgetResizable(True)
-        
-        # Container for scroll area content
-        content_widget = QWidget()
-        self.layout = QGridLayout(content_widget)
-        
-        # Set relaxing background color
-        palette = QPalette()
-        palette.setColor(QPalette.Background, QColor("#E6F7F5"))  # Light pastel color for relaxation
-        content_widget.setAutoFillBackground(True)
-        content_widget.setPalette(palette)
-        
-        # Apply modern font styles
-        header_font = QFont("Arial", 12, QFont.Bold)
-        info_font = QFont("Arial", 10)
-        
-        # Add patient photo with rounded corners and shadow on the left side
-        if patient.photo:
-            photo_label = QLabel()
-            pixmap = QPixmap(patient.photo).scaled(250, 150, Qt.KeepAspectRatio)
-            photo_label.setPixmap(pixmap)
-            photo_label.setAlignment(Qt.AlignCenter)
-            photo_label.setFrameStyle(QFrame.Panel | QFrame.Sunken)
-            photo_label.setStyleSheet("border-radius: 10px; padding: 10px; background-color: #f0f0f0;")
-            self.layout.addWidget(photo_label, 0, 0, 4, 1)  # Span across 4 rows for the photo
-        
-        # Add all patient information with labels aligned right-to-left
-        self.add_grid_item("الاسم واللقب:", patient.firstname_familyname, 0, 1, header_font, info_font)
-        self.add_grid_item("السن:", patient.age, 1, 1, header_font, info_font,align_value=True)
-        
-        self.add_grid_item("الجنس:", patient.sex, 1, 1, header_font, info_font,align_value=True)
-
-        self.add_grid_item("المستوى الدراسي:", patient.education_level, 2, 1, header_font, info_font)
-        self.add_grid_item("العنوان:", patient.address, 3, 1, header_font, info_font)
-        self.add_grid_item_with_show_more("معلومات:", patient.information, 4, 1, header_font, info_font)
-        self.add_grid_item("الطبع:", patient.character, 6, 1, header_font, info_font)
-        self.add_grid_item("سبب الزيارة:", patient.reason_visit, 8, 1, header_font, info_font)
-        self.add_grid_item("من طرف:", patient.from_whom, 10, 1, header_font, info_font)
-        self.add_grid_item_with_show_more("التاريخ المرضي:", patient.history_illness, 12, 1, header_font, info_font)
-        self.add_grid_item_with_show_more("التاريخ النفسي:", patient.psychiatric_history, 14, 1, header_font, info_font)
-        self.add_grid_item_with_show_more("المتابعة السريرية:", patient.clinic_follow, 16, 1, header_font, info_font)
-        self.add_grid_item_with_show_more("التشخيص:", patient.diagnosis, 18, 1, header_font, info_font)
-        self.add_grid_item_with_show_more("تاريخ التشخيص:", patient.diagnosis_history, 20, 1, header_font, info_font)
-        self.add_grid_item("التوجيهات والاقتراحات:", patient.propositions_directing, 22, 1, header_font, info_font)
-        self.add_grid_item_with_show_more("الخطة العلاجية:", patient.curing_program, 24, 1, header_font, info_font)
-        self.add_grid_item("التقييم:", patient.evaluation, 26, 1, header_font, info_font)
-        self.add_grid_item_with_show_more("التقرير:", patient.reporting, 28, 1, header_font, info_font)
-
-       
-        # Add border to the layout (optional padding for inner content)
-        content_widget.setStyleSheet("""
-            background-color: #f0f0f0; /* Light background for the content */
-            border: 2px solid #2E7D32; /* Green border color for photo and middle column */
-            border-radius: 10px; /* Rounded corners */
-            padding: 15px; /* Padding for inner content */
-        """)
-
-        # Add the content widget to the scroll area
-        scroll_area.setWidget(content_widget)
-
-         # Set column stretch factors
-        self.layout.setColumnStretch(3, 0)  # First column (labels) will take 1 part
-        self.layout.setColumnStretch(2, 1)  # Second column (values) will take 2 parts
-        #self.layout.setColumnStretch(2, 1)  # Third column (if any, otherwise this can be omitted)
-
-
-        # Main layout of the central widget
-        main_layout = QVBoxLayout(central_widget)
-        main_layout.addWidget(scroll_area)
-    
-
-    
-        # Add buttons for generating report and returning to home
-        button_layout = QVBoxLayout()
-
-        generate_report_btn = QPushButton("PDF التقرير")
-        generate_report_btn.setStyleSheet(self.get_button_style())
-        generate_report_btn.clicked.connect(lambda: self.create_patient_report(patient))
-        button_layout.addWidget(generate_report_btn)
-
-        return_home_btn = QPushButton("العودة إلى الصفحة الرئيسية")
-        
-        return_home_btn.setStyleSheet(self.get_button_style())
-        return_home_btn.clicked.connect(self.return_to_home)
-        button_layout.addWidget(return_home_btn)
-
-        main_layout.addLayout(button_layout)
-
-    # Utility function to add grid items with styled headers and values (RTL alignment)
-    def get_button_style(self):
-            """Button style consistent with the home page."""
-            return """
-                QPushButton {
-                    background-color: #3a86ff;
-                    color: white;
-                    font-size: 14px;
-                    padding: 10px;
-                    border-radius: 5px;
-                }
-                QPushButton:hover {
-                    background-color: #0056b3;
-                }
-            """
-    def add_grid_item(self, label_text, value, row, col, header_font, info_font, align_value=False):
-        label = QLabel(label_text)
-        label.setFont(header_font)
-        label.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
-        
-        value_label = QLabel(str(value))
-        value_label.setFont(info_font)
-        value_label.setWordWrap(True)
-        
-        # Set alignment for the value label if specified
-        if align_value:
-            value_label.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
-        else:
-            value_label.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)  # Default alignment
-
-        self.layout.addWidget(label, row, col * 2 + 1)
-        self.layout.addWidget(value_label, row, col * 2)
-
-    # Utility function to add grid items with "Show more" functionality (RTL alignment)
-    def add_grid_item_with_show_more(self, label_text, value, row, col, header_font, info_font):
-        label = QLabel(label_text)
-        label.setFont(header_font)
-        label.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
-
-        # Short version of the text (displayed initially)
-        short_text = QLabel(value[:100] + '...' if len(value) > 100 else value)
-        short_text.setFont(info_font)
-        short_text.setWordWrap(True)
-        short_text.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
-
-        # Full version of the text (hidden initially)
-        full_text = QLabel(value)
-        full_text.setFont(info_font)
-        full_text.setWordWrap(True)
-        full_text.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
-        full_text.setVisible(False)  # Initially hidden
-
-        # Button to show more text
-        show_more_btn = QPushButton("المزيد")
-        show_more_btn.setStyleSheet("color: blue; text-decoration: underline; border: none; background: none;")
-        show_more_btn.clicked.connect(lambda: self.toggle_text_visibility(full_text, show_more_btn, short_text))
-
-        self.layout.addWidget(label, row, col * 2 + 1)
-        self.layout.addWidget(short_text, row, col * 2)
-        self.layout.addWidget(full_text, row, col * 2)  # Hidden initially
-        self.layout.addWidget(show_more_btn, row + 1, col * 2)
-
-    # Function to toggle between showing the short and full text
-    def toggle_text_visibility(self, full_text, btn, short_text):
-        if full_text.isVisible():
-            full_text.setVisible(False)
-            short_text.setVisible(True)
-            btn.setText("المزيد")
-        else:
-            full_text.setVisible(True)
-            short_text.setVisible(False)
-            btn.setText("إخفاء")
-
-
-    # Generate a PDF report
-    def create_patient_report(self, patient):
-        file_path = f"{patient.firstname_familyname}_report.pdf"
-
-        # Create the PDF document
-        doc = SimpleDocTemplate(file_path, pagesize=letter)
-        styles = getSampleStyleSheet()
-
-        # Custom style for Arabic text
-        arabic_style = ParagraphStyle(name='Arabic', fontName='Arabic', fontSize=12, alignment=2)  # Right align
-
-        arabic_style_header = ParagraphStyle(name='Arabic', fontName='Arabic', fontSize=14, alignment=2)  # Right align
-
-
-        arabic_style_header_top = ParagraphStyle(
-                name='ArabicHeader',
-                fontName='Arabic',             # Arabic font
-                fontSize=22,                   # Larger font size for headers
-                alignment=1,           # Center align the text
-                textColor=colors.HexColor("#006699"),  # Custom color (dark blue)
-                spaceAfter=24,                 # Add space after the header
-                spaceBefore=12,                # Add space before the header
-                leading=22,                    # Increase line height/leading for better readability
-                borderPadding=(10, 5, 10, 5),  # Padding (top, left, bottom, right)
-                borderColor=colors.HexColor("#006699"),  # Border color matching the text
-                borderWidth=1,                 # Border width
-                borderRadius=5,                # Rounded corners for the border
-                backColor=colors.HexColor("#E6F7F5"),  # Light background color to make the header stand out
-                bold=True                      # Make the text bold
-            )
-
-        # Report content
-        report_content = []
-
-
-        # Clinic Name and Date
-        pdfmetrics.registerFont(TTFont('Arabic', 'static/Amiri-Bold.ttf'))
-        report_content.append(Paragraph(reshape_text("عيادة بارود"), arabic_style_header_top))
-        report_content.append(Spacer(1, 24))
-        pdfmetrics.registerFont(TTFont('Arabic', 'static/Amiri-Regular.ttf'))
-        report_content.append(Paragraph(reshape_text(f"تاريخ التقرير: {datetime.now().strftime('%Y-%m-%d')}"), arabic_style))
-        report_content.append(Spacer(1, 24))
-
-        
-         # Add patient's photo at the top-left corner
-        if patient.photo and os.path.exists(patient.photo):
-            patient_image = ReportImage(patient.photo, 1.5 * inch, 1.5 * inch)  # Adjust size as needed
-            patient_image.hAlign = 'LEFT'
-            report_content.append(patient_image)
-
-        # Patient Details
-        report_content.append(Paragraph(reshape_text(f"الاسم واللقب: {patient.firstname_familyname}"), arabic_style_header))
-        report_content.append(Spacer(1, 12))
-        report_content.append(Paragraph(reshape_text(f"السن: {patient.age}"), arabic_style_header))
-        report_content.append(Spacer(1, 12))
-        report_content.append(Paragraph(reshape_text(f"الجنس: {patient.sex}"), arabic_style_header))
-        report_content.append(Spacer(1, 12))
-        report_content.append(Paragraph(reshape_text(f"المستوى الدراسي: {patient.education_level}"), arabic_style_header))
-        report_content.append(Spacer(1, 12))
-        report_content.append(Paragraph(reshape_text(f"العنوان: {patient.address}"), arabic_style_header))
-        report_content.append(Spacer(1, 12))
-        report_content.append(Paragraph(reshape_text(f"  معلومات : "), arabic_style_header))
-        report_content.append(Spacer(1, 12))
-        report_content.append(Paragraph(reshape_text(f"{patient.information}"), arabic_style))
-        report_content.append(Spacer(1, 12))
-        report_content.append(Paragraph(reshape_text(f"  التشخيص : "), arabic_style_header))
-        report_content.append(Spacer(1, 12))
-        report_content.append(Paragraph(reshape_text(f"{patient.diagnosis}"), arabic_style))
-        report_content.append(Spacer(1, 12))
-        report_content.append(Paragraph(reshape_text(f"  التوجيهات وااقتراحات : "), arabic_style_header))
-        report_content.append(Spacer(1, 12))
-        report_content.append(Paragraph(reshape_text(f"{patient.propositions_directing}"), arabic_style))
-        report_content.append(Spacer(1, 12))
-        report_content.append(Paragraph(reshape_text(f"  الخطةالعلاجية : "), arabic_style_header))
-        report_content.append(Spacer(1, 12))
-        report_content.append(Paragraph(reshape_text(f"{patient.curing_program}"), arabic_style))
-        report_content.append(Spacer(1, 12))
-        report_content.append(Paragraph(reshape_text(f"  التقييم :"), arabic_style_header))
-        report_content.append(Spacer(1, 12))
-        report_content.append(Paragraph(reshape_text(f"{patient.evaluation}"), arabic_style))
-        report_content.append(Spacer(1, 12))
-        report_content.append(Paragraph(reshape_text(f"  التقرير :"), arabic_style_header))
-        report_content.append(Spacer(1, 12))
-        report_content.append(Paragraph(reshape_text(f"{patient.reporting}"), arabic_style))
-
-        
-
-        
-
-        # Doctor's Signaturereport_content.append(Spacer(1, 24))
-        report_content.append(Spacer(1, 24))
-        report_content.append(Spacer(1, 24))
-        report_content.append(Paragraph(reshape_text("_____________________________________________________________________________"), arabic_style))
-        report_content.append(Spacer(1, 24))
-        report_content.append(Paragraph(reshape_text("<u> توقيع الطبيب </u>"), arabic_style_header))
-        report_content.append(Spacer(1, 24))
-      
-        # Add doctor's signature image at the bottom
-        if  os.path.exists(r'static/path_to_doctor_signature.png'):
-            signature_image = ReportImage(r'static/path_to_doctor_signature.png', 0.75 * inch, 0.75 * inch)  # Adjust size as needed
-            signature_image.hAlign = 'RIGHT'
-            report_content.append(signature_image)
-
-        # Build the PDF
-        doc.build(report_content)
-        
-        QMessageBox.information(self, "تم الحفظ", "تم اخراج التقرير للمريض بنجاح")
-        
-        self.close()
-
-    def return_to_home(self):
-        self.close()
-
-
-
-
-
-
-
-
-import secrets
-import os 
-from PIL import Image
-
-
-def save_picture(form_picture):
-    random_hex = secrets.token_hex(8)
-    _,f_ext= os.path.splitext(form_picture)
-    picture_fn = random_hex + f_ext
-    picture_path = os.path.join('.', 'static',picture_fn)
-    outpu_size = (125,125)
-    i = Image.open(form_picture)
-    i.thumbnail(outpu_size)
-    i.save(picture_path)
-
-    #form_picture.save(picture_path)
-    return picture_fn
-
-if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    # Set application icon globally (optional)
-    app.setWindowIcon(QIcon('static/logo.ico'))
-    
-    # Uncomment to create a new user (only needs to be done once for initial setup)
-
-    hashed_password = bcrypt.hashpw("xxxxxxxxxxxxxxxx".encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-    admin = User(id=1,username= "xxxxxxxxxxxxx", password_hash=hashed_password)
-    admin_in_database = session.query(User).filter_by(id=admin.id).first()
-    if admin_in_database == None:
-        new_user = User(username="admin", password_hash=hashed_password)
-        session.add(new_user)
-        session.commit()
-
-    login_page = LoginPage()
-    #login_page = HomePage()
-    login_page.show()
-
-    sys.exit(app.exec_())
+import time
+_startup_started = time.perf_counter()
+
+import math
+import os
+import sys
+import threading
+from collections import OrderedDict
+from PyQt5 import QtCore
+from PyQt5.QtWidgets import (
+    QMainWindow, QApplication, QVBoxLayout, QLabel, QLineEdit, QPushButton, 
+    QMessageBox, QTextEdit, QFileDialog, QWidget, QStackedWidget
+)
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from PyQt5.QtWidgets import QScrollArea
+from PyQt5.QtGui import QIcon
+# The report and imaging libraries (ReportLab, bidi, arabic_reshaper, PIL) are
+# imported on first use, see patient_report.py and make_thumbnails.
+
+class StartupTimer:
+    """Milliseconds spent in each startup phase, printed when run with --startup-timing."""
+
+    def __init__(self, started):
+        self.started = started
+        self.last = started
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, (now - self.last) * 1000))
+        self.last = now
+
+    def report(self, out=sys.stderr):
+        for phase, ms in self.phases:
+            out.write("%-24s %8.1f ms\n" % (phase, ms))
+        out.write("%-24s %8.1f ms\n" % ("total", (self.last - self.started) * 1000))
+
+startup_timer = StartupTimer(_startup_started)
+startup_timer.mark("imports")
+
+# Database
+from storage import (
+    Patient, PatientConflict, LOGIN_OK, LOGIN_TOO_MANY_ATTEMPTS, LOGIN_UNKNOWN_USER, LOGIN_WRONG_PASSWORD, LoginThrottle, PATIENT_SORT_KEYS, config, engine, Session, init_database,
+    ensure_admin_user, make_repository, export_patients, import_patients, NotAuthenticated, ServerUnavailable, coerce_age,
+)
+
+init_database(engine)
+# Local database, or the clinic server (server.py) when config.json names one
+repository = make_repository(config)
+startup_timer.mark("database")
+
+# Change notifications
+from PyQt5.QtCore import QObject, pyqtSignal
+
+class PatientEvents(QObject):
+    """Announces committed patient changes so open views can patch just the affected row."""
+    inserted = pyqtSignal(int)
+    updated = pyqtSignal(int)
+    deleted = pyqtSignal(int)
+
+patient_events = PatientEvents()
+
+def _record_patient_change(signal_name):
+    def record(mapper, connection, target):
+        # Flushed changes are only announced once the transaction commits
+        object_session(target).info.setdefault('patient_changes', []).append((signal_name, target.id))
+    return record
+
+event.listen(Patient, 'after_insert', _record_patient_change('inserted'))
+event.listen(Patient, 'after_update', _record_patient_change('updated'))
+event.listen(Patient, 'after_delete', _record_patient_change('deleted'))
+
+@event.listens_for(Session, 'after_commit')
+def _emit_patient_changes(session):
+    for signal_name, patient_id in session.info.pop('patient_changes', []):
+        getattr(patient_events, signal_name).emit(patient_id)
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_patient_changes(session):
+    session.info.pop('patient_changes', None)
+
+class SessionEvents(QObject):
+    """Announces that the clinic server wants a new login, or could not be
+    reached, whichever thread found out."""
+    expired = pyqtSignal()
+    server_unavailable = pyqtSignal(str)
+
+session_events = SessionEvents()
+
+if not repository.is_local:
+    repository.on_change = lambda signal_name, patient_id: getattr(patient_events, signal_name).emit(patient_id)
+    repository.on_unauthorized = session_events.expired.emit
+
+def excepthook(exc_type, exc, tb):
+    """Like PyQt's own handling of exceptions escaping a slot (print, then abort), but
+    NotAuthenticated and ServerUnavailable only end the action that made the request,
+    leaving the window as it was: on_unauthorized has already sent it back to the
+    login page, and an unreachable server is reported to the user."""
+    if issubclass(exc_type, NotAuthenticated):
+        return
+    if issubclass(exc_type, ServerUnavailable):
+        session_events.server_unavailable.emit(str(exc))
+        return
+    sys.__excepthook__(exc_type, exc, tb)
+    QtCore.qFatal("Unhandled Python exception")
+
+# Background tasks
+from PyQt5.QtCore import QRunnable, QThreadPool
+
+class TaskSignals(QObject):
+    finished = pyqtSignal(object)  # the task's return value
+    failed = pyqtSignal(str)
+
+class Task(QRunnable):
+    """Runs fn(*args) on a QThreadPool and reports the outcome through signals.
+
+    fn must not touch the GUI; database work goes through the repository or a session_scope of its own.
+    """
+
+    def __init__(self, fn, *args):
+        super(Task, self).__init__()
+        self.fn = fn
+        self.args = args
+        self.signals = TaskSignals()
+
+    def run(self):
+        try:
+            result = self.fn(*self.args)
+        except Exception as exc:
+            self.signals.failed.emit(str(exc))
+        else:
+            self.signals.finished.emit(result)
+
+# Profile cache
+from PyQt5.QtCore import Qt
+
+class ProfileCache(QObject):
+    """Full records (PatientSnapshots) of the patients recently selected in the list.
+
+    The list prefetches the selected row and its neighbours in the background,
+    so opening a profile rarely waits for the database. An entry is dropped as
+    soon as its patient is updated or deleted, and refetched after MAX_AGE
+    seconds in case another workstation changed it.
+    """
+
+    MAX_ENTRIES = 32
+    MAX_AGE = 60  # seconds
+
+    def __init__(self):
+        super(ProfileCache, self).__init__()
+        self._entries = OrderedDict()  # id -> (monotonic time loaded, snapshot), least recent first
+        self._versions = {}  # id -> number of invalidations, to discard fetches that started before one
+        self._pending = {}  # id -> running Task
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(2)
+        patient_events.updated.connect(self.invalidate, Qt.QueuedConnection)
+        patient_events.deleted.connect(self.invalidate, Qt.QueuedConnection)
+
+    def get(self, patient_id):
+        """The cached snapshot of patient_id, or None."""
+        entry = self._entries.get(patient_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.MAX_AGE:
+            del self._entries[patient_id]
+            return None
+        self._entries.move_to_end(patient_id)
+        return entry[1]
+
+    def load(self, patient_id):
+        """The snapshot of patient_id, from the cache or else read now."""
+        snapshot = self.get(patient_id)
+        if snapshot is None:
+            snapshot = repository.get(patient_id)
+            if snapshot is not None:
+                self._store(patient_id, snapshot)
+        return snapshot
+
+    def prefetch(self, patient_ids):
+        """Start loading, in the background, the patients that are not cached yet."""
+        for patient_id in patient_ids:
+            if patient_id in self._pending or self.get(patient_id) is not None:
+                continue
+            task = Task(self._fetch, patient_id, self._versions.get(patient_id, 0))
+            task.signals.finished.connect(self._fetched)
+            task.signals.failed.connect(lambda message, patient_id=patient_id: self._pending.pop(patient_id, None))
+            self._pending[patient_id] = task
+            self.pool.start(task)
+
+    def invalidate(self, patient_id):
+        self._entries.pop(patient_id, None)
+        self._versions[patient_id] = self._versions.get(patient_id, 0) + 1
+
+    @staticmethod
+    def _fetch(patient_id, version):
+        # Runs on the pool
+        return patient_id, version, repository.get(patient_id)
+
+    def _fetched(self, result):
+        patient_id, version, snapshot = result
+        self._pending.pop(patient_id, None)
+        if snapshot is not None and version == self._versions.get(patient_id, 0):
+            self._store(patient_id, snapshot)
+
+    def _store(self, patient_id, snapshot):
+        self._entries[patient_id] = (time.monotonic(), snapshot)
+        self._entries.move_to_end(patient_id)
+        while len(self._entries) > self.MAX_ENTRIES:
+            self._entries.popitem(last=False)
+
+profile_cache = ProfileCache()
+
+# Backups of the local database; the clinic server backs up its own
+from PyQt5.QtCore import QTimer
+from backup import BackupCancelled, backup_directory, create_backup, list_backups
+
+class BackupSignals(QObject):
+    progress = pyqtSignal(int)  # percent
+    finished = pyqtSignal(str)  # path of the new backup
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class BackupWorker(QRunnable):
+    """Copies the database into a new backup on backup_pool; see backup.py."""
+
+    def __init__(self):
+        super(BackupWorker, self).__init__()
+        self.signals = BackupSignals()
+        self._cancelled = threading.Event()
+        self._percent = -1
+        self.notices = []  # see create_backup
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _progress(self, copied, total):
+        # Held at 99 while the copy is checked: 100 would close the progress dialog
+        percent = copied * 99 // total if total else 99
+        if percent != self._percent:  # not once per step: a large database takes thousands
+            self._percent = percent
+            self.signals.progress.emit(percent)
+
+    def run(self):
+        try:
+            path = create_backup(config['database']['path'], backup_directory(config), config['backup']['keep'],
+                                 progress=self._progress, is_cancelled=self._cancelled.is_set,
+                                 notice=self.notices.append)
+        except BackupCancelled:
+            self.signals.cancelled.emit()
+        except Exception as exc:
+            self.signals.failed.emit(str(exc))
+        else:
+            self.signals.finished.emit(path)
+
+
+backup_pool = QThreadPool()
+backup_pool.setMaxThreadCount(1)
+
+
+class BackupScheduler(QObject):
+    """Takes a backup whenever the newest one is more than interval_hours old, and on request."""
+
+    CHECK_INTERVAL_MS = 10 * 60 * 1000
+    FIRST_CHECK_MS = 60 * 1000  # leave the start of the program alone
+
+    def __init__(self):
+        super(BackupScheduler, self).__init__()
+        self.worker = None
+        self.timer = QTimer(self)
+        self.timer.setInterval(self.CHECK_INTERVAL_MS)
+        self.timer.timeout.connect(self.check)
+
+    def start(self):
+        if config['backup']['interval_hours'] > 0:
+            QTimer.singleShot(self.FIRST_CHECK_MS, self.check)
+            self.timer.start()
+        QApplication.instance().aboutToQuit.connect(self.stop)
+
+    def check(self):
+        backups = list_backups(config['database']['path'], backup_directory(config))
+        if backups and time.time() - os.path.getmtime(backups[0]) < config['backup']['interval_hours'] * 3600:
+            return
+        if self.worker is None:
+            self.backup_now().signals.failed.connect(self.scheduled_backup_failed)
+
+    def backup_now(self):
+        """The running backup, or a new one: there is never more than one at a time."""
+        if self.worker is None:
+            self.worker = BackupWorker()
+            signals = self.worker.signals
+            for signal in (signals.finished, signals.failed, signals.cancelled):
+                signal.connect(self.backup_done)
+            backup_pool.start(self.worker)
+        return self.worker
+
+    def backup_done(self, *_):
+        self.worker = None
+
+    def scheduled_backup_failed(self, message):
+        QMessageBox.warning(QApplication.activeWindow(), "خطأ", "تعذر إنشاء النسخة الاحتياطية: " + message)
+
+    def stop(self):
+        # A cancelled backup stops within one copy step, checksum chunk or
+        # batch of integrity_check work, and removes its partial file
+        self.timer.stop()
+        if self.worker is not None:
+            self.worker.cancel()
+        backup_pool.waitForDone()
+
+backup_scheduler = BackupScheduler()
+
+# Home Page
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+from PyQt5.QtWidgets import QVBoxLayout, QHBoxLayout, QMainWindow, QTableView, QAbstractItemView, QPushButton, QMessageBox
+from PyQt5.QtWidgets import QComboBox, QSpinBox, QProgressDialog
+
+
+class PatientTableModel(QAbstractTableModel):
+    """Table model for the patients list that loads rows page by page.
+
+    Qt calls canFetchMore/fetchMore when the view scrolls near the end of the
+    loaded rows, so only the pages the user actually reaches are queried.
+    Sorting and filtering are done by the database, never on the loaded rows.
+    """
+
+    PAGE_SIZE = 200
+    HEADERS = ["الرقم", "الاسم واللقب", "السن", "العنوان", "سبب الزيارة"]
+    SORT_KEYS = list(PATIENT_SORT_KEYS)  # one per column
+
+    def __init__(self, parent=None):
+        super(PatientTableModel, self).__init__(parent)
+        self._rows = []  # one tuple of display values per loaded patient
+        self._exhausted = False
+        self._after = None  # (sort value, id) of the last fetched row
+        self._search = ''
+        self._sort = 'id'
+        self._descending = False
+        self._filters = {}
+
+        # Queued, so the slots run after the commit has finished and may query again
+        patient_events.inserted.connect(self.patient_inserted, Qt.QueuedConnection)
+        patient_events.updated.connect(self.patient_updated, Qt.QueuedConnection)
+        patient_events.deleted.connect(self.patient_deleted, Qt.QueuedConnection)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        value = self._rows[index.row()][index.column()]
+        return "" if value is None else str(value)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._exhausted:
+            return
+        page = self._query_page()
+        if len(page) < self.PAGE_SIZE:
+            self._exhausted = True
+        if not page:
+            return
+        # Kept apart from the rows, which change when patients are edited or deleted
+        self._after = (page[-1][self.SORT_KEYS.index(self._sort)], page[-1][0])
+        first = len(self._rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(page) - 1)
+        self._rows.extend(page)
+        self.endInsertRows()
+
+    def _query_page(self):
+        """Load the next page of patient summaries after the last fetched row."""
+        if self._search:
+            return repository.search(self._search, limit=self.PAGE_SIZE, offset=len(self._rows),
+                                     filters=self._filters)
+        return repository.list_page(self.PAGE_SIZE, self._sort, self._descending, self._filters, self._after)
+
+    def reload(self):
+        """Forget every loaded page; the view will fetch the first one again."""
+        self.beginResetModel()
+        self._rows = []
+        self._exhausted = False
+        self._after = None
+        self.endResetModel()
+
+    def set_search(self, terms):
+        """Show only the patients matching terms, ranked; an empty string shows everyone."""
+        self._search = terms.strip()
+        self.reload()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Called by the view when a header is clicked. Search results stay ranked by relevance."""
+        self._sort = self.SORT_KEYS[column]
+        self._descending = order == Qt.DescendingOrder
+        self.reload()
+
+    def set_filters(self, filters):
+        """Show only the patients matching filters, a dict of storage.PATIENT_FILTERS values."""
+        self._filters = {name: value for name, value in filters.items() if value is not None}
+        self.reload()
+
+    def patient_id(self, row):
+        return self._rows[row][0]
+
+    def find_row(self, patient_id):
+        """Return the row showing patient_id, or -1 if it is not loaded."""
+        for row, values in enumerate(self._rows):
+            if values[0] == patient_id:
+                return row
+        return -1
+
+    def patient_inserted(self, patient_id):
+        # New patients have the highest id, so in the default order they belong after
+        # the last page. While pages remain to be fetched they will come in with
+        # fetchMore; in any other view the new row shows on the next reload.
+        if self._search or self._filters or self._sort != 'id' or self._descending or not self._exhausted:
+            return
+        summary = repository.get_summary(patient_id)
+        if summary:
+            first = len(self._rows)
+            self.beginInsertRows(QModelIndex(), first, first)
+            self._rows.append(summary)
+            self.endInsertRows()
+
+    def patient_updated(self, patient_id):
+        row = self.find_row(patient_id)
+        if row == -1:
+            return
+        summary = repository.get_summary(patient_id)
+        if summary is None:
+            self.patient_deleted(patient_id)
+            return
+        self._rows[row] = summary
+        self.dataChanged.emit(self.index(row, 0), self.index(row, self.columnCount() - 1))
+
+    def patient_deleted(self, patient_id):
+        row = self.find_row(patient_id)
+        if row == -1:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._rows[row]
+        self.endRemoveRows()
+
+class ChoiceFilter(QComboBox):
+    """A filter list of the values of one of PATIENT_CHOICE_FILTERS, read from
+    the database when the list is opened rather than whenever patients change."""
+
+    def __init__(self, field, parent=None):
+        super(ChoiceFilter, self).__init__(parent)
+        self.field = field
+        self.addItem("الكل", None)
+
+    def showPopup(self):
+        selected = self.currentData()
+        values = repository.distinct_values(self.field)
+        if selected is not None and selected not in values:
+            values.append(selected)  # no patient has it any more, but it is still the filter
+        self.blockSignals(True)
+        self.clear()
+        self.addItem("الكل", None)
+        for value in values:
+            self.addItem(value, value)
+        self.setCurrentIndex(max(self.findData(selected), 0))
+        self.blockSignals(False)
+        super(ChoiceFilter, self).showPopup()
+
+
+class HomePage(QWidget):
+    def __init__(self, main_window):
+        super(HomePage, self).__init__()
+        self.main_window = main_window
+        self.setWindowTitle("الصفحة الرئيسية")
+
+        self.layout = QVBoxLayout()
+
+        # Search box; the query runs once typing pauses instead of on every key
+        self.search_input = QLineEdit(self)
+        self.search_input.setPlaceholderText("بحث")
+        self.search_input.setObjectName("search")
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(250)
+        self.search_timer.timeout.connect(lambda: self.model.set_search(self.search_input.text()))
+        self.search_input.textChanged.connect(lambda _: self.search_timer.start())
+        self.layout.addWidget(self.search_input)
+
+        # Filters, applied by the database like the header sort
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(250)
+        self.filter_timer.timeout.connect(self.apply_filters)
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel("السن من"))
+        self.age_min_filter = self.create_age_filter()
+        filter_layout.addWidget(self.age_min_filter)
+        filter_layout.addWidget(QLabel("إلى"))
+        self.age_max_filter = self.create_age_filter()
+        filter_layout.addWidget(self.age_max_filter)
+        filter_layout.addWidget(QLabel("الجنس"))
+        self.sex_filter = ChoiceFilter("sex", self)
+        self.sex_filter.currentIndexChanged.connect(lambda _: self.filter_timer.start())
+        filter_layout.addWidget(self.sex_filter, 1)
+        # Free text with a value per patient or so: matched by how it starts
+        self.text_filters = {}
+        for field, label in (("from_whom", "جهة الإحالة"), ("reason_visit", "سبب الزيارة")):
+            line_edit = QLineEdit(self)
+            line_edit.setPlaceholderText("يبدأ بـ")
+            line_edit.textChanged.connect(lambda _: self.filter_timer.start())
+            filter_layout.addWidget(QLabel(label))
+            filter_layout.addWidget(line_edit, 1)
+            self.text_filters[field] = line_edit
+        self.layout.addLayout(filter_layout)
+
+        # Simplify the table to show only the main information.
+        # The rows come from a paging model so only what is scrolled into view is loaded.
+        self.model = PatientTableModel(self)
+        self.table = QTableView(self)
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setStretchLastSection(True)  # Adjusts column to fit the width
+        # Clicking a header sorts through PatientTableModel.sort, in the database
+        self.table.horizontalHeader().setSortIndicator(0, Qt.AscendingOrder)
+        self.table.setSortingEnabled(True)
+
+        # Enable double-click on the table to open patient profile
+        self.table.doubleClicked.connect(self.open_profile_on_double_click)
+
+        # Load the selected patient and its neighbours in the background once the
+        # selection stops moving, so the buttons below open them without waiting
+        self.prefetch_timer = QTimer(self)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(100)
+        self.prefetch_timer.timeout.connect(self.prefetch_selection)
+        self.table.selectionModel().currentRowChanged.connect(lambda *_: self.prefetch_timer.start())
+
+        self.layout.addWidget(self.table)
+
+        self.load_patients()
+
+        # Add buttons with modern styles
+        button_layout = QHBoxLayout()
+
+        self.add_button = QPushButton("إضافة")
+        self.add_button.clicked.connect(self.add_patient)
+        button_layout.addWidget(self.add_button)
+
+        self.modify_button = QPushButton("تعديل")
+        self.modify_button.clicked.connect(self.modify_patient)
+        button_layout.addWidget(self.modify_button)
+
+        self.delete_button = QPushButton("حذف")
+        self.delete_button.clicked.connect(self.delete_patient)
+        button_layout.addWidget(self.delete_button)
+
+        self.profile_button = QPushButton("ملف المريض")
+        self.profile_button.clicked.connect(self.open_profile)
+        button_layout.addWidget(self.profile_button)
+
+        self.export_button = QPushButton("تصدير")
+        self.export_button.clicked.connect(self.export_patients)
+        button_layout.addWidget(self.export_button)
+
+        self.import_button = QPushButton("استيراد")
+        self.import_button.clicked.connect(self.import_patients)
+        button_layout.addWidget(self.import_button)
+
+        self.backup_button = QPushButton("نسخة احتياطية")
+        self.backup_button.clicked.connect(self.backup_database)
+        button_layout.addWidget(self.backup_button)
+
+        # Bulk export and import, and backups, work on the database file, which only the server has
+        self.export_button.setVisible(repository.is_local)
+        self.import_button.setVisible(repository.is_local)
+        self.backup_button.setVisible(repository.is_local)
+
+        self.layout.addLayout(button_layout)
+        self.setLayout(self.layout)
+
+    def load_patients(self):
+        """Drop the loaded rows and start paging again from the first patient."""
+        self.model.reload()
+
+    def create_age_filter(self):
+        spin_box = QSpinBox(self)
+        spin_box.setRange(-1, 150)
+        spin_box.setSpecialValueText("الكل")  # shown for -1, no limit
+        spin_box.setValue(-1)
+        spin_box.valueChanged.connect(lambda _: self.filter_timer.start())
+        return spin_box
+
+    def apply_filters(self):
+        filters = {field: line_edit.text().strip() or None for field, line_edit in self.text_filters.items()}
+        filters['sex'] = self.sex_filter.currentData()
+        filters['age_min'] = self.age_min_filter.value() if self.age_min_filter.value() >= 0 else None
+        filters['age_max'] = self.age_max_filter.value() if self.age_max_filter.value() >= 0 else None
+        self.model.set_filters(filters)
+
+    def open_profile_on_double_click(self, index):
+        """Opens the profile page when the user double-clicks a row."""
+        selected_patient = self.get_selected_patient()
+        if selected_patient:
+            self.open_profile(selected_patient)
+
+    def add_patient(self):
+        self.main_window.show_form()
+
+    def modify_patient(self):
+        selected_patient = self.get_selected_patient()
+        if selected_patient:
+            self.main_window.show_form(selected_patient)
+
+    def delete_patient(self):
+        selected_patient = self.get_selected_patient()
+        if selected_patient:
+            confirm = QMessageBox.question(self, "تأكيد الحذف", "هل أنت متأكد أنك تريد حذف هذا المريض؟", QMessageBox.Yes | QMessageBox.No)
+            if confirm == QMessageBox.Yes:
+                repository.delete(selected_patient.id)  # the model drops the row when the deletion is announced
+                #QMessageBox.information(self, "تم الحذف", "تم حذف المريض بنجاح")
+
+    def export_patients(self):
+        """Export every patient to a CSV or JSON Lines file in the background."""
+        file_path, _ = QFileDialog.getSaveFileName(self, "تصدير المرضى", "patients.csv", "CSV (*.csv);;JSON Lines (*.jsonl)")
+        if not file_path:
+            return
+        self.export_task = Task(export_patients, file_path)
+        self.export_task.signals.finished.connect(self.export_finished)
+        self.export_task.signals.failed.connect(self.export_failed)
+        self.export_button.setEnabled(False)
+        QThreadPool.globalInstance().start(self.export_task)
+
+    def export_finished(self, count):
+        self.export_button.setEnabled(True)
+        QMessageBox.information(self, "تم التصدير", "تم تصدير %d مريض بنجاح" % count)
+
+    def export_failed(self, message):
+        self.export_button.setEnabled(True)
+        QMessageBox.warning(self, "خطأ", "تعذر التصدير: " + message)
+
+    def import_patients(self):
+        """Import patients from a CSV or JSON Lines file in the background."""
+        file_path, _ = QFileDialog.getOpenFileName(self, "استيراد المرضى", "", "CSV (*.csv);;JSON Lines (*.jsonl)")
+        if not file_path:
+            return
+        self.import_task = Task(import_patients, file_path)
+        self.import_task.signals.finished.connect(self.import_finished)
+        self.import_task.signals.failed.connect(self.import_failed)
+        self.import_button.setEnabled(False)
+        QThreadPool.globalInstance().start(self.import_task)
+
+    def import_finished(self, result):
+        self.import_button.setEnabled(True)
+        # Bulk inserts bypass the ORM change events, so reload the list once
+        self.load_patients()
+        message = "تم استيراد %d مريض و%d زيارة" % (result.imported, result.visits)
+        if result.errors:
+            message += "\n\nأسطر لم يتم استيرادها (%d):\n" % len(result.errors)
+            message += "\n".join("%d: %s" % error for error in result.errors[:20])
+        QMessageBox.information(self, "تم الاستيراد", message)
+
+    def import_failed(self, message):
+        self.import_button.setEnabled(True)
+        QMessageBox.warning(self, "خطأ", "تعذر الاستيراد: " + message)
+
+    def backup_database(self):
+        """Back the database up now, in the background, or follow the backup already running."""
+        worker = self.backup_worker = backup_scheduler.backup_now()
+        self.backup_progress = QProgressDialog("جاري إنشاء النسخة الاحتياطية...", "إلغاء", 0, 100, self)
+        self.backup_progress.setWindowTitle("نسخة احتياطية")
+        self.backup_progress.setWindowModality(Qt.NonModal)
+        self.backup_progress.setMinimumDuration(0)
+        self.backup_progress.canceled.connect(worker.cancel)
+
+        signals = worker.signals
+        signals.progress.connect(self.backup_progress.setValue)
+        signals.finished.connect(self.backup_finished)
+        signals.failed.connect(self.backup_failed)
+        signals.cancelled.connect(self.backup_cancelled)
+        self.backup_button.setEnabled(False)
+
+    def backup_finished(self, path):
+        self.backup_progress.reset()
+        self.backup_button.setEnabled(True)
+        message = "تم إنشاء النسخة الاحتياطية:\n" + path
+        if self.backup_worker.notices:
+            message += "\n\n" + "\n".join(self.backup_worker.notices)
+        QMessageBox.information(self, "تم الحفظ", message)
+
+    def backup_cancelled(self):
+        self.backup_progress.reset()
+        self.backup_button.setEnabled(True)
+
+    def backup_failed(self, message):
+        self.backup_progress.reset()
+        self.backup_button.setEnabled(True)
+        QMessageBox.warning(self, "خطأ", "تعذر إنشاء النسخة الاحتياطية: " + message)
+
+    def open_profile(self, patient=None):
+        """Open the profile of the selected patient."""
+        if not patient:
+            patient = self.get_selected_patient()
+        
+        if patient:
+            self.main_window.show_profile(patient)
+
+    PREFETCH_NEIGHBOURS = 2  # rows on each side of the selection
+
+    def prefetch_selection(self):
+        row = self.table.currentIndex().row()
+        if row == -1:
+            return
+        rows = range(max(row - self.PREFETCH_NEIGHBOURS, 0),
+                     min(row + self.PREFETCH_NEIGHBOURS + 1, self.model.rowCount()))
+        # The selected row first, then its neighbours outwards
+        profile_cache.prefetch(self.model.patient_id(r) for r in sorted(rows, key=lambda r: abs(r - row)))
+
+    def get_selected_patient(self):
+        """Get the currently selected patient in the table."""
+        selected_row = self.table.currentIndex().row()
+        if selected_row != -1:
+            return profile_cache.load(self.model.patient_id(selected_row))
+        else:
+            QMessageBox.warning(self, "خطأ", "يرجى اختيار مريض")
+            return None
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QVBoxLayout, QHBoxLayout, QMainWindow, QLabel, QLineEdit, QTextEdit, QPushButton, QScrollArea, QWidget, QFileDialog, QMessageBox
+from PyQt5.QtGui import QIntValidator
+from drafts import DraftJournal
+
+# Draft writes, in the order they were made, away from the GUI thread
+draft_pool = QThreadPool()
+draft_pool.setMaxThreadCount(1)
+
+
+class PatientFormPage(QWidget):
+    """The add and modify form. It is built once; edit() fills it for a new or an existing patient."""
+
+    # (field, label, multi-line)
+    FIELDS = [
+        ("firstname_familyname", "الاسم واللقب", False),
+        ("age", "السن", False),
+        ("sex", "الجنس", False),
+        ("education_level", "المستوى الدراسي", False),
+        ("address", "العنوان", False),
+        ("information", "معلومات", True),
+        ("character", "الرمز", True),
+        ("reason_visit", "سبب الزيارة", False),
+        ("from_whom", "جهة الإحالة", False),
+        ("history_illness", "التاريخ المرضي", True),
+        ("psychiatric_history", "التاريخ النفسي والعقلي والعصبي", True),
+        ("clinic_follow", "المتابعات الإكلينيكية", True),
+        ("diagnosis_history", "مجريات الفحص + التاريخ", True),
+        ("propositions_directing", "التوجيهات والإحالات", True),
+        ("diagnosis", "التشخيص", True),
+        ("curing_program", "البرنامج العلاجي", True),
+        ("evaluation", "التقييم", True),
+        ("reporting", "التقرير", True),
+    ]
+
+    # What is typed into the add form is saved as a draft once typing pauses,
+    # or at the latest every AUTOSAVE_MAX_DELAY_MS while it goes on
+    AUTOSAVE_DELAY_MS = 1000
+    AUTOSAVE_MAX_DELAY_MS = 5000
+    DRAFT_KEY = "new"
+
+    def __init__(self, main_window):
+        super(PatientFormPage, self).__init__()
+        self.main_window = main_window
+        self.patient = None  # the PatientSnapshot being modified, None when adding
+        self.photo_path = None
+        self.setObjectName("patientForm")  # styled by APP_STYLESHEET
+
+        # The draft of the add form, as last saved; the journal on disk follows it
+        self.drafts = DraftJournal(config['drafts']['path'])
+        self.draft = self.drafts.get(self.DRAFT_KEY) or {}
+        self.unsaved_fields = set()
+        self.first_unsaved = None  # time.monotonic() of the oldest edit not saved yet
+        self.loading = False  # set while edit() fills the fields, which is not typing
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.setSingleShot(True)
+        self.autosave_timer.timeout.connect(self.autosave)
+        QApplication.instance().aboutToQuit.connect(self.flush_draft)
+        QApplication.instance().aboutToQuit.connect(lambda: draft_pool.waitForDone())
+
+        # Create a scroll area
+        self.scroll_area = QScrollArea(self)
+        self.scroll_area.setWidgetResizable(True)
+
+        self.layout = QVBoxLayout()
+
+        # Shown when the form opens with a draft left from before
+        self.draft_notice = QWidget()
+        notice_layout = QHBoxLayout(self.draft_notice)
+        notice_layout.addWidget(QLabel("تمت استعادة بيانات لم تُحفظ"))
+        discard_button = QPushButton("تجاهل")
+        discard_button.clicked.connect(self.discard_draft)
+        notice_layout.addWidget(discard_button)
+        self.layout.addWidget(self.draft_notice)
+
+        # Create form fields in Arabic
+        self.inputs = {}
+        for field, label, multiline in self.FIELDS:
+            if multiline:
+                widget = QTextEdit(self)
+                widget.setAcceptRichText(False)
+                widget.textChanged.connect(lambda field=field: self.field_edited(field))
+            else:
+                widget = QLineEdit(self)
+                widget.setPlaceholderText(label)
+                widget.textChanged.connect(lambda text, field=field: self.field_edited(field))
+            self.layout.addWidget(QLabel(label))
+            self.layout.addWidget(widget)
+            self.inputs[field] = widget
+        self.inputs["age"].setValidator(QIntValidator(0, 150, self))
+
+        # File dialog to upload a photo
+        self.photo_button = QPushButton("تحميل صورة")
+        self.photo_button.clicked.connect(self.upload_photo)
+        self.layout.addWidget(self.photo_button)
+
+        # Submit button, "إضافة" or "حفظ" depending on what edit() was given
+        self.submit_button = QPushButton("إضافة")
+        self.submit_button.clicked.connect(self.submit_data)
+        self.layout.addWidget(self.submit_button)
+
+        # Back to Home button
+        self.back_button = QPushButton("العودة إلى الصفحة الرئيسية")
+        self.back_button.clicked.connect(self.go_back_home)
+        self.layout.addWidget(self.back_button)
+
+        # Widget to hold layout and scroll area
+        content_widget = QWidget()
+        content_widget.setLayout(self.layout)
+        self.scroll_area.setWidget(content_widget)
+        page_layout = QVBoxLayout(self)
+        page_layout.setContentsMargins(0, 0, 0, 0)
+        page_layout.addWidget(self.scroll_area)
+
+    @staticmethod
+    def as_text(value):
+        return "" if value is None else str(value)
+
+    def edit(self, patient=None):
+        """Show the form to add a patient, with the draft if there is one, or
+        filled with a PatientSnapshot to modify it."""
+        self.flush_draft()  # edits still pending belong to the form as it was
+        self.patient = patient
+        if patient is None:
+            self.fill(self.draft)
+        else:
+            self.fill(patient._asdict())
+        self.draft_notice.setVisible(patient is None and bool(self.draft))
+        self.setWindowTitle("تعديل المريض" if patient else "متابعة المرضى")
+        self.submit_button.setText("حفظ" if patient else "إضافة")
+        self.scroll_area.verticalScrollBar().setValue(0)
+
+    def fill(self, values):
+        self.loading = True
+        self.photo_path = values.get("photo")
+        for field, widget in self.inputs.items():
+            text = self.as_text(values.get(field))
+            if isinstance(widget, QTextEdit):
+                widget.setPlainText(text)
+                widget.document().setModified(False)
+            else:
+                widget.setText(text)  # also clears isModified()
+        self.loading = False
+
+    def field_text(self, field):
+        if field == "photo":
+            return self.photo_path
+        widget = self.inputs[field]
+        return widget.toPlainText() if isinstance(widget, QTextEdit) else widget.text()
+
+    def field_edited(self, field):
+        """Called on every keystroke: only note the field and (re)start the timer."""
+        if self.loading or self.patient is not None:
+            return
+        self.unsaved_fields.add(field)
+        now = time.monotonic()
+        if self.first_unsaved is None:
+            self.first_unsaved = now
+        deadline = self.AUTOSAVE_MAX_DELAY_MS - (now - self.first_unsaved) * 1000
+        self.autosave_timer.start(int(max(0, min(self.AUTOSAVE_DELAY_MS, deadline))))
+
+    def autosave(self):
+        """Save the fields edited since the last autosave to the draft journal, in the background."""
+        if not self.unsaved_fields:
+            return
+        changes = {field: self.field_text(field) for field in self.unsaved_fields}
+        self.unsaved_fields = set()
+        self.first_unsaved = None
+        self.draft.update(changes)
+        draft_pool.start(Task(self.drafts.save, self.DRAFT_KEY, changes))
+
+    def flush_draft(self):
+        self.autosave_timer.stop()
+        self.autosave()
+
+    def discard_draft(self):
+        self.autosave_timer.stop()
+        self.unsaved_fields = set()
+        self.first_unsaved = None
+        self.draft = {}
+        draft_pool.start(Task(self.drafts.discard, self.DRAFT_KEY))
+        self.fill(self.draft)
+        self.draft_notice.hide()
+
+    def values(self):
+        values = {}
+        for field, widget in self.inputs.items():
+            values[field] = widget.toPlainText() if isinstance(widget, QTextEdit) else widget.text()
+        values["photo"] = self.photo_path
+        return values
+
+    def changed_values(self):
+        """The fields of the patient being modified that the user actually changed.
+
+        Only the widgets Qt marks as modified are read back, and a field edited
+        back to its old text is not a change.
+        """
+        changes = {}
+        for field, widget in self.inputs.items():
+            if isinstance(widget, QTextEdit):
+                if not widget.document().isModified():
+                    continue
+                value = widget.toPlainText()
+            else:
+                if not widget.isModified():
+                    continue
+                value = widget.text()
+            if value != self.as_text(getattr(self.patient, field)):
+                changes[field] = value
+        if self.photo_path != self.patient.photo:
+            changes["photo"] = self.photo_path
+        return changes
+
+    def go_back_home(self):
+        # Navigate back to the home page; its list is already up to date
+        self.main_window.show_home()
+
+    def upload_photo(self):
+        file_name, _ = QFileDialog.getOpenFileName(self, "اختر الصورة", "", "Image Files (*.png *.jpg *.bmp)")
+        if file_name:
+            self.photo_path = save_picture(file_name)
+            self.field_edited("photo")
+
+    def submit_data(self):
+        # Save patient data to the database
+        try:
+            coerce_age(self.inputs["age"].text())  # the validator still lets 151 to 999 through
+        except ValueError:
+            QMessageBox.warning(self, "خطأ", "السن يجب أن يكون عددا بين 0 و150")
+            return
+        if self.patient is None:
+            repository.add(self.values())
+            self.discard_draft()
+            QMessageBox.information(self, "تم الحفظ", "تم حفظ بيانات المريض بنجاح")
+        else:
+            changes = self.changed_values()
+            message = self.save_changes(changes) if changes else "تم حفظ التعديلات بنجاح"
+            if message is None:
+                return  # cancelled at a conflict prompt, keep editing
+            if message:
+                QMessageBox.information(self, "تم الحفظ", message)
+        self.main_window.show_home()
+
+    def save_changes(self, changes):
+        """Write changes over the version of the patient that was edited, merging
+        with whatever was saved meanwhile elsewhere. Return what to tell the user
+        once done ("" for nothing), or None if the user cancels."""
+        while True:
+            try:
+                repository.update(self.patient.id, changes, self.patient.version)
+                return "تم حفظ التعديلات بنجاح"
+            except PatientConflict as conflict:
+                changes = self.merge(changes, conflict.current)
+                if changes is None:
+                    return None
+            except KeyError:
+                return self.save_deleted()
+
+    def save_deleted(self):
+        """The patient was deleted elsewhere while being edited: the user may save
+        the form as a new patient or drop it. Return as save_changes does."""
+        box = QMessageBox(QMessageBox.Question, "تعارض في التعديلات",
+                          "قام مستخدم آخر بحذف هذا المريض أثناء تعديلك.", parent=self)
+        save_new = box.addButton("حفظه كمريض جديد", QMessageBox.AcceptRole)
+        discard = box.addButton("تجاهل التعديلات", QMessageBox.DestructiveRole)
+        box.addButton("إلغاء", QMessageBox.RejectRole)
+        box.exec_()
+        if box.clickedButton() is save_new:
+            repository.add(self.values())
+            return "تم حفظ بيانات المريض كمريض جديد"
+        if box.clickedButton() is discard:
+            return ""
+        return None
+
+    def merge(self, changes, current):
+        """Rebase changes onto current, the patient as saved by someone else.
+
+        Fields only one side changed are kept from that side without asking;
+        if both changed the same field differently, the user chooses. Return
+        the changes to write over current, or None to cancel.
+        """
+        clashes = [
+            field for field, value in changes.items()
+            if self.as_text(getattr(current, field)) not in (self.as_text(getattr(self.patient, field)), value)
+        ]
+        if clashes:
+            labels = dict((field, label) for field, label, _ in self.FIELDS)
+            labels["photo"] = "الصورة"
+            box = QMessageBox(QMessageBox.Question, "تعارض في التعديلات",
+                              "قام مستخدم آخر بتعديل هذا المريض أثناء تعديلك.\n"
+                              "الحقول التي تغيرت عند الطرفين: " + "، ".join(labels[field] for field in clashes),
+                              parent=self)
+            keep_mine = box.addButton("الاحتفاظ بتعديلاتي", QMessageBox.AcceptRole)
+            keep_theirs = box.addButton("اعتماد التعديلات الأخرى", QMessageBox.DestructiveRole)
+            box.addButton("إلغاء", QMessageBox.RejectRole)
+            box.exec_()
+            if box.clickedButton() is keep_theirs:
+                changes = {field: value for field, value in changes.items() if field not in clashes}
+            elif box.clickedButton() is not keep_mine:
+                return None
+        self.patient = current
+        return changes
+
+def center(window):
+    """Centers the given window on the screen."""
+    screen = QDesktopWidget().screenGeometry()
+    window_size = window.geometry()
+    x = (screen.width() - window_size.width()) // 2
+    y = (screen.height() - window_size.height()) // 2
+    window.move(x, y)
+
+
+from PyQt5.QtWidgets import QLabel, QVBoxLayout, QWidget, QMainWindow, QLineEdit, QPushButton, QMessageBox, QDesktopWidget, QProgressBar
+from PyQt5.QtCore import Qt
+
+login_throttle = LoginThrottle()
+
+class LoginPage(QWidget):
+    def __init__(self, main_window):
+        super(LoginPage, self).__init__()
+        self.main_window = main_window
+        self.setWindowTitle("تسجيل الدخول")
+
+        # Light relaxing cyan background, see APP_STYLESHEET
+        self.setObjectName("loginPage")
+        self.setAttribute(Qt.WA_StyledBackground, True)
+
+        # Create the layout
+        self.layout = QVBoxLayout()
+        self.layout.setAlignment(Qt.AlignLeft)  # Align items to the right
+
+        # Username input
+        self.username_input = QLineEdit(self)
+        self.username_input.setPlaceholderText("اسم المستخدم")
+        self.layout.addWidget(QLabel("اسم المستخدم", alignment=Qt.AlignLeft))  # Align label to the right
+        self.layout.addWidget(self.username_input)
+
+        # Password input
+        self.password_input = QLineEdit(self)
+        self.password_input.setPlaceholderText("كلمة المرور")
+        self.password_input.setEchoMode(QLineEdit.Password)
+        self.layout.addWidget(QLabel("كلمة المرور", alignment=Qt.AlignLeft))  # Align label to the right
+        self.layout.addWidget(self.password_input)
+
+        # Login button
+        self.login_button = QPushButton("تسجيل الدخول")
+        self.login_button.setObjectName("loginButton")
+
+        # Connect the returnPressed signal for both fields to trigger login when Enter is pressed
+        self.username_input.returnPressed.connect(self.login)
+        self.password_input.returnPressed.connect(self.login)
+
+        self.login_button.clicked.connect(self.login)
+        self.layout.addWidget(self.login_button)
+
+        # Busy indicator shown while the password is being checked
+        self.spinner = QProgressBar(self)
+        self.spinner.setRange(0, 0)
+        self.spinner.setTextVisible(False)
+        self.spinner.setVisible(False)
+        self.layout.addWidget(self.spinner)
+
+        self.login_task = None
+        self.login_username = None
+
+        self.setLayout(self.layout)
+
+    
+    def login(self):
+        username = self.username_input.text()
+        password = self.password_input.text()
+
+        if not username or not password:
+            QMessageBox.warning(self, "خطأ", "يرجى ملء جميع الحقول")
+            return
+        if self.login_task is not None:
+            return  # a check is already running
+
+        wait = login_throttle.retry_after(username)
+        if wait:
+            QMessageBox.warning(self, "خطأ", "محاولات كثيرة، يرجى الانتظار %d ثانية" % math.ceil(wait))
+            return
+
+        # Verify the password in the background; bcrypt is deliberately slow
+        self.login_username = username
+        self.login_task = Task(repository.verify_login, username, password)
+        self.login_task.signals.finished.connect(self.login_checked)
+        self.login_task.signals.failed.connect(self.login_error)
+        self.set_busy(True)
+        QThreadPool.globalInstance().start(self.login_task)
+
+    def set_busy(self, busy):
+        self.login_button.setEnabled(not busy)
+        self.username_input.setEnabled(not busy)
+        self.password_input.setEnabled(not busy)
+        self.spinner.setVisible(busy)
+
+    def login_checked(self, status):
+        self.login_task = None
+        self.set_busy(False)
+        if status == LOGIN_TOO_MANY_ATTEMPTS:
+            QMessageBox.warning(self, "خطأ", "محاولات كثيرة، يرجى الانتظار قليلا")
+            return
+        if status != LOGIN_OK:
+            login_throttle.failed(self.login_username)
+            if status == LOGIN_UNKNOWN_USER:
+                QMessageBox.warning(self, "خطأ", "اسم المستخدم غير موجود")
+            elif status == LOGIN_WRONG_PASSWORD:
+                QMessageBox.warning(self, "خطأ", "كلمة المرور غير صحيحة")
+            else:  # the clinic server does not say which
+                QMessageBox.warning(self, "خطأ", "اسم المستخدم أو كلمة المرور غير صحيحة")
+            return
+
+        login_throttle.succeeded(self.login_username)
+        #QMessageBox.information(self, "نجاح", "تم تسجيل الدخول بنجاح")
+        self.password_input.clear()
+        self.main_window.show_home()
+
+    def login_error(self, message):
+        self.login_task = None
+        self.set_busy(False)
+        QMessageBox.warning(self, "خطأ", message)
+
+
+from PyQt5.QtWidgets import QLabel, QVBoxLayout, QWidget, QMainWindow, QGridLayout, QFrame, QPushButton, QScrollArea
+from PyQt5.QtGui import QPixmap, QFont, QPalette, QColor
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QProgressDialog, QPlainTextEdit, QDialog, QDialogButtonBox, QHBoxLayout, QTextEdit
+
+class ReportSignals(QObject):
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(str)  # path of the written report
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class ReportWorker(QRunnable):
+    """Builds one patient report on report_pool."""
+
+    VISITS = 10  # most recent visits included in the report
+
+    def __init__(self, patient, file_path):
+        super(ReportWorker, self).__init__()
+        self.patient = patient
+        self.file_path = file_path
+        self.signals = ReportSignals()
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self):
+        # Imported here: ReportLab is only loaded once a report is actually requested
+        from patient_report import build_patient_report, ReportCancelled
+
+        # Write next to the target and rename at the end so a cancelled or failed
+        # build never leaves a truncated report behind.
+        partial_path = self.file_path + '.part'
+        try:
+            visits = repository.visits(self.patient.id, self.VISITS)
+            build_patient_report(self.patient, partial_path, self.signals.progress.emit, self._cancelled.is_set, visits)
+            os.replace(partial_path, self.file_path)
+        except ReportCancelled:
+            self._discard(partial_path)
+            self.signals.cancelled.emit()
+        except Exception as exc:
+            self._discard(partial_path)
+            self.signals.failed.emit(str(exc))
+        else:
+            self.signals.finished.emit(self.file_path)
+
+    @staticmethod
+    def _discard(path):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# ReportLab keeps global state (registered fonts), so reports are built one at a time
+report_pool = QThreadPool()
+report_pool.setMaxThreadCount(1)
+
+
+class VisitDialog(QDialog):
+    """Notes and evaluation of a new session with the patient."""
+
+    def __init__(self, parent=None):
+        super(VisitDialog, self).__init__(parent)
+        self.setWindowTitle("إضافة زيارة")
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel("ملاحظات الجلسة"))
+        self.notes_input = QTextEdit()
+        self.notes_input.setAcceptRichText(False)
+        layout.addWidget(self.notes_input)
+        layout.addWidget(QLabel("التقييم"))
+        self.evaluation_input = QTextEdit()
+        self.evaluation_input.setAcceptRichText(False)
+        layout.addWidget(self.evaluation_input)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.button(QDialogButtonBox.Ok).setText("حفظ")
+        buttons.button(QDialogButtonBox.Cancel).setText("إلغاء")
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+        self.resize(500, 400)
+
+    def values(self):
+        return self.notes_input.toPlainText().strip(), self.evaluation_input.toPlainText().strip()
+
+
+class ProfilePage(QWidget):
+    """A patient's profile. It is built once; show_patient() fills it for a patient."""
+
+    # (label, field, long note shown shortened with "المزيد")
+    FIELDS = [
+        ("الاسم واللقب:", "firstname_familyname", False),
+        ("السن:", "age", False),
+        ("الجنس:", "sex", False),
+        ("المستوى الدراسي:", "education_level", False),
+        ("العنوان:", "address", False),
+        ("معلومات:", "information", True),
+        ("الطبع:", "character", True),
+        ("سبب الزيارة:", "reason_visit", False),
+        ("من طرف:", "from_whom", False),
+        ("التاريخ المرضي:", "history_illness", True),
+        ("التاريخ النفسي:", "psychiatric_history", True),
+        ("المتابعة السريرية:", "clinic_follow", True),
+        ("التشخيص:", "diagnosis", True),
+        ("تاريخ التشخيص:", "diagnosis_history", True),
+        ("التوجيهات والاقتراحات:", "propositions_directing", True),
+        ("الخطة العلاجية:", "curing_program", True),
+        ("التقييم:", "evaluation", True),
+        ("التقرير:", "reporting", True),
+    ]
+    RIGHT_ALIGNED = ("age", "sex")
+
+    SHORT_TEXT_CHARS = 100
+    # Longer notes open in a scrolling viewer instead of a label sized to the whole text
+    LONG_NOTE_CHARS = 5000
+    NOTE_VIEWER_HEIGHT = 400
+    VISITS_PAGE = 5  # visits shown per click, most recent first
+
+    def __init__(self, main_window):
+        super(ProfilePage, self).__init__()
+        self.main_window = main_window
+        self.patient = None
+        self.setWindowTitle("ملف المريض")
+
+        # Scrollable area
+        self.scroll_area = QScrollArea()
+        self.scroll_area.setWidgetResizable(True)
+        
+        # Container for scroll area content, bordered by APP_STYLESHEET
+        content_widget = QWidget()
+        content_widget.setObjectName("profileContent")
+        self.layout = QGridLayout(content_widget)
+        
+        # Set relaxing background color
+        palette = QPalette()
+        palette.setColor(QPalette.Background, QColor("#E6F7F5"))  # Light pastel color for relaxation
+        content_widget.setAutoFillBackground(True)
+        content_widget.setPalette(palette)
+        
+        # Apply modern font styles
+        self.header_font = QFont("Arial", 12, QFont.Bold)
+        self.info_font = QFont("Arial", 10)
+        
+        # Patient photo with rounded corners on the left side
+        self.photo_label = QLabel()
+        self.photo_label.setObjectName("profilePhoto")
+        self.photo_label.setAlignment(Qt.AlignCenter)
+        self.photo_label.setFrameStyle(QFrame.Panel | QFrame.Sunken)
+        self.layout.addWidget(self.photo_label, 0, 0, 4, 1)  # Span across 4 rows for the photo
+        
+        # All patient information with labels aligned right-to-left; two grid
+        # rows per field, the second for the "المزيد" button of long notes
+        self.value_labels = {}
+        self.show_more_buttons = {}
+        self.full_texts = {}  # field -> full text widget, made on first "المزيد"
+        for index, (label_text, field, long_note) in enumerate(self.FIELDS):
+            self.add_grid_item(label_text, field, long_note, index * 2, 1)
+
+        # Visits, read from the database only when asked for, a page at a time
+        visits_row = len(self.FIELDS) * 2
+        visits_label = QLabel("الزيارات:")
+        visits_label.setFont(self.header_font)
+        self.layout.addWidget(visits_label, visits_row, 3)
+        visits_container = QWidget()
+        self.visits_layout = QVBoxLayout(visits_container)
+        self.visits_layout.setContentsMargins(0, 0, 0, 0)
+        self.layout.addWidget(visits_container, visits_row, 2)
+        self.visit_widgets = []
+        self.oldest_visit = None  # (visited_at, id) of the last visit shown
+        visit_buttons = QWidget()
+        visit_buttons_layout = QHBoxLayout(visit_buttons)
+        self.more_visits_btn = QPushButton("عرض الزيارات")
+        self.more_visits_btn.setObjectName("showMore")
+        self.more_visits_btn.clicked.connect(self.load_visits)
+        visit_buttons_layout.addWidget(self.more_visits_btn)
+        add_visit_btn = QPushButton("إضافة زيارة")
+        add_visit_btn.clicked.connect(self.add_visit)
+        visit_buttons_layout.addWidget(add_visit_btn)
+        self.layout.addWidget(visit_buttons, visits_row + 1, 2)
+
+        # Add the content widget to the scroll area
+        self.scroll_area.setWidget(content_widget)
+
+         # Set column stretch factors
+        self.layout.setColumnStretch(3, 0)  # First column (labels) will take 1 part
+        self.layout.setColumnStretch(2, 1)  # Second column (values) will take 2 parts
+
+        # Main layout of the page
+        main_layout = QVBoxLayout(self)
+        main_layout.addWidget(self.scroll_area)
+
+        # Add buttons for generating report and returning to home
+        button_layout = QVBoxLayout()
+
+        self.generate_report_btn = QPushButton("PDF التقرير")
+        self.generate_report_btn.clicked.connect(lambda: self.create_patient_report(self.patient))
+        button_layout.addWidget(self.generate_report_btn)
+
+        return_home_btn = QPushButton("العودة إلى الصفحة الرئيسية")
+        return_home_btn.clicked.connect(self.return_to_home)
+        button_layout.addWidget(return_home_btn)
+
+        main_layout.addLayout(button_layout)
+
+    # Utility function to add grid items with styled headers and values (RTL alignment)
+    def add_grid_item(self, label_text, field, long_note, row, col):
+        label = QLabel(label_text)
+        label.setFont(self.header_font)
+        label.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
+
+        # For long notes this only ever shows the first SHORT_TEXT_CHARS characters;
+        # the full text widget is made when asked for, so the page costs the same
+        # however long the notes are.
+        value_label = QLabel()
+        value_label.setFont(self.info_font)
+        value_label.setWordWrap(True)
+        if field in self.RIGHT_ALIGNED:
+            value_label.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
+        else:
+            value_label.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)  # Default alignment
+
+        self.layout.addWidget(label, row, col * 2 + 1)
+        self.layout.addWidget(value_label, row, col * 2)
+        self.value_labels[field] = value_label
+
+        if long_note:
+            # Button to show more text
+            show_more_btn = QPushButton("المزيد")
+            show_more_btn.setObjectName("showMore")
+            show_more_btn.clicked.connect(lambda: self.toggle_text_visibility(field, (row, col * 2)))
+            self.layout.addWidget(show_more_btn, row + 1, col * 2)
+            self.show_more_buttons[field] = show_more_btn
+
+    def show_patient(self, patient):
+        """Fill the page with a PatientSnapshot."""
+        self.patient = patient
+        if patient.photo:
+            self.photo_label.setPixmap(profile_pixmaps.get(photo_for_size(patient.photo, 250), 250, 150))
+        else:
+            self.photo_label.clear()
+        self.photo_label.setVisible(bool(patient.photo))
+
+        # Full texts belong to the previous patient
+        for full_text in self.full_texts.values():
+            full_text.hide()
+            full_text.deleteLater()
+        self.full_texts = {}
+
+        for _, field, long_note in self.FIELDS:
+            value = getattr(patient, field)
+            value = "" if value is None else str(value)
+            value_label = self.value_labels[field]
+            value_label.setVisible(True)
+            if not long_note:
+                value_label.setText(value)
+                continue
+            truncated = len(value) > self.SHORT_TEXT_CHARS
+            value_label.setText(value[:self.SHORT_TEXT_CHARS] + '...' if truncated else value)
+            self.show_more_buttons[field].setText("المزيد")
+            self.show_more_buttons[field].setVisible(truncated)
+        self.clear_visits()
+        self.scroll_area.verticalScrollBar().setValue(0)
+
+    def clear_visits(self):
+        for widget in self.visit_widgets:
+            widget.hide()
+            widget.deleteLater()
+        self.visit_widgets = []
+        self.oldest_visit = None
+        self.more_visits_btn.setText("عرض الزيارات")
+        self.more_visits_btn.setVisible(True)
+
+    def load_visits(self):
+        """Show the next VISITS_PAGE visits, going back in time."""
+        visits = repository.visits(self.patient.id, self.VISITS_PAGE, self.oldest_visit)
+        for visit in visits:
+            text = visit.visited_at.strftime("%Y-%m-%d %H:%M")
+            if visit.notes:
+                text += "\n" + visit.notes
+            if visit.evaluation:
+                text += "\nالتقييم: " + visit.evaluation
+            self.add_visit_widget(self.create_full_text(text))
+        if visits:
+            self.oldest_visit = (visits[-1].visited_at, visits[-1].id)
+        elif not self.visit_widgets:
+            self.add_visit_widget(QLabel("لا توجد زيارات"))
+        self.more_visits_btn.setText("زيارات أقدم")
+        self.more_visits_btn.setVisible(len(visits) == self.VISITS_PAGE)
+
+    def add_visit_widget(self, widget):
+        self.visits_layout.addWidget(widget)
+        self.visit_widgets.append(widget)
+
+    def add_visit(self):
+        dialog = VisitDialog(self)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        notes, evaluation = dialog.values()
+        if notes or evaluation:
+            try:
+                repository.add_visit(self.patient.id, notes or None, evaluation or None)
+            except KeyError:
+                self.add_visit_to_deleted(notes or None, evaluation or None)
+                return
+            # Start again from the newest, which is the one just added
+            self.clear_visits()
+            self.load_visits()
+
+    def add_visit_to_deleted(self, notes, evaluation):
+        """The patient was deleted elsewhere meanwhile: the user may save it again,
+        as shown here, as a new patient with this visit, or drop the visit."""
+        box = QMessageBox(QMessageBox.Question, "تعارض في التعديلات",
+                          "قام مستخدم آخر بحذف هذا المريض، ولم تحفظ الزيارة.", parent=self)
+        save_new = box.addButton("حفظه كمريض جديد مع الزيارة", QMessageBox.AcceptRole)
+        box.addButton("تجاهل الزيارة", QMessageBox.RejectRole)
+        box.exec_()
+        if box.clickedButton() is not save_new:
+            self.main_window.show_home()
+            return
+        values = {field: value for field, value in self.patient._asdict().items() if field not in ("id", "version")}
+        patient_id = repository.add(values)
+        repository.add_visit(patient_id, notes, evaluation)
+        self.main_window.show_profile(repository.get(patient_id))
+
+    def create_full_text(self, value):
+        if len(value) <= self.LONG_NOTE_CHARS:
+            full_text = QLabel(value)
+            full_text.setWordWrap(True)
+            full_text.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
+        else:
+            # QPlainTextEdit lays out only the paragraphs scrolled into view
+            full_text = QPlainTextEdit()
+            full_text.setReadOnly(True)
+            full_text.setPlainText(value)
+            full_text.setFixedHeight(self.NOTE_VIEWER_HEIGHT)
+        full_text.setFont(self.info_font)
+        return full_text
+
+    # Function to toggle between showing the short and full text
+    def toggle_text_visibility(self, field, cell):
+        btn = self.show_more_buttons[field]
+        short_text = self.value_labels[field]
+        full_text = self.full_texts.get(field)
+        if full_text is None:
+            full_text = self.full_texts[field] = self.create_full_text(getattr(self.patient, field))
+            self.layout.addWidget(full_text, *cell)
+            full_text.setVisible(False)
+        if full_text.isVisible():
+            full_text.setVisible(False)
+            short_text.setVisible(True)
+            btn.setText("المزيد")
+        else:
+            full_text.setVisible(True)
+            short_text.setVisible(False)
+            btn.setText("إخفاء")
+
+    # Generate a PDF report in the background
+    def create_patient_report(self, patient):
+        file_path = f"{patient.firstname_familyname}_report.pdf"
+
+        snapshot = patient  # already an immutable PatientSnapshot
+        if snapshot.photo:
+            snapshot = snapshot._replace(photo=photo_for_size(snapshot.photo, 512))
+        self.report_worker = ReportWorker(snapshot, file_path)
+        self.report_progress = QProgressDialog("جاري إعداد التقرير...", "إلغاء", 0, 100, self)
+        self.report_progress.setWindowTitle("PDF التقرير")
+        self.report_progress.setWindowModality(Qt.NonModal)
+        self.report_progress.setMinimumDuration(0)
+        self.report_progress.canceled.connect(self.report_worker.cancel)
+
+        signals = self.report_worker.signals
+        signals.progress.connect(self.report_progress.setValue)
+        signals.finished.connect(self.report_finished)
+        signals.failed.connect(self.report_failed)
+        signals.cancelled.connect(self.report_cancelled)
+        self.generate_report_btn.setEnabled(False)
+        report_pool.start(self.report_worker)
+
+    def report_finished(self, file_path):
+        self.report_progress.reset()
+        self.generate_report_btn.setEnabled(True)
+        QMessageBox.information(self, "تم الحفظ", "تم اخراج التقرير للمريض بنجاح")
+        if self.main_window.stack.currentWidget() is self:
+            self.return_to_home()
+
+    def report_cancelled(self):
+        self.report_progress.reset()
+        self.generate_report_btn.setEnabled(True)
+
+    def report_failed(self, message):
+        self.report_progress.reset()
+        self.generate_report_btn.setEnabled(True)
+        QMessageBox.warning(self, "خطأ", "تعذر إنشاء التقرير: " + message)
+
+    def return_to_home(self):
+        self.main_window.show_home()
+
+
+
+
+
+
+
+
+import hashlib
+import shutil
+import tempfile
+
+
+# Photo store: every photo is copied once into PHOTO_DIR under the SHA-256 of
+# its content, so uploading the same picture again reuses the stored file.
+# Pre-scaled JPEG copies named <hash>_<size>.jpg are made in the background.
+PHOTO_DIR = os.path.join('static', 'photos')
+THUMBNAIL_SIZES = (128, 256, 512)
+
+# Decoding and scaling photos runs here, away from the GUI thread
+photo_pool = QThreadPool()
+photo_pool.setMaxThreadCount(2)
+
+
+def store_photo(source_path):
+    """Copy source_path into the photo store and return the stored path."""
+    digest = hashlib.sha256()
+    with open(source_path, 'rb') as source:
+        for block in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(block)
+    _, f_ext = os.path.splitext(source_path)
+    stored_path = os.path.join(PHOTO_DIR, digest.hexdigest() + f_ext.lower())
+    if not os.path.exists(stored_path):
+        os.makedirs(PHOTO_DIR, exist_ok=True)
+        # Copy under a temporary name first so a stored path is always complete
+        fd, partial_path = tempfile.mkstemp(dir=PHOTO_DIR)
+        os.close(fd)
+        shutil.copyfile(source_path, partial_path)
+        os.replace(partial_path, stored_path)
+    return stored_path
+
+
+def thumbnail_path(photo_path, size):
+    base, _ = os.path.splitext(photo_path)
+    return '%s_%d.jpg' % (base, size)
+
+
+def make_thumbnails(photo_path):
+    """Write every missing THUMBNAIL_SIZES copy of a stored photo, decoding it once."""
+    missing = [size for size in sorted(THUMBNAIL_SIZES, reverse=True)
+               if not os.path.exists(thumbnail_path(photo_path, size))]
+    if not missing:
+        return
+    from PIL import Image  # only needed once a photo is uploaded
+
+    image = Image.open(photo_path)
+    image = image.convert('RGB')
+    # Largest first, so every step scales down the previous, smaller image
+    for size in missing:
+        image.thumbnail((size, size))
+        fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(photo_path), suffix='.jpg')
+        os.close(fd)
+        image.save(partial_path, 'JPEG', quality=85)
+        os.replace(partial_path, thumbnail_path(photo_path, size))
+
+
+def photo_for_size(photo_path, size):
+    """Return the smallest ready copy of photo_path at least size pixels wide, or the photo itself."""
+    for thumbnail_size in sorted(THUMBNAIL_SIZES):
+        if thumbnail_size >= size:
+            candidate = thumbnail_path(photo_path, thumbnail_size)
+            if os.path.exists(candidate):
+                return candidate
+    return photo_path
+
+
+class PixmapCache:
+    """Scaled photos for the profile pages, cached in memory and on disk.
+
+    The memory level is an LRU bounded by the total size of the pixmaps. The
+    disk level keeps the scaled image as PNG under a key made of the source
+    path, its mtime and the target size, so a replaced photo is never served stale.
+    Pixmaps are GUI objects: only use this from the GUI thread.
+    """
+
+    def __init__(self, cache_dir, max_bytes=32 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._pixmaps = OrderedDict()  # key -> QPixmap, least recently used first
+        self._bytes = 0
+
+    def get(self, path, width, height):
+        """Return path scaled to fit width x height, or a null QPixmap if it cannot be read."""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return QPixmap()
+        key = hashlib.sha1(('%s|%d|%dx%d' % (os.path.abspath(path), mtime, width, height)).encode('utf-8')).hexdigest()
+
+        pixmap = self._pixmaps.get(key)
+        if pixmap is not None:
+            self._pixmaps.move_to_end(key)
+            return pixmap
+
+        disk_path = os.path.join(self.cache_dir, key + '.png')
+        pixmap = QPixmap(disk_path)
+        if pixmap.isNull():
+            pixmap = QPixmap(path)
+            if pixmap.isNull():
+                return pixmap
+            pixmap = pixmap.scaled(width, height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            self._save(pixmap, disk_path)
+        self._remember(key, pixmap)
+        return pixmap
+
+    def _save(self, pixmap, disk_path):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        partial_path = disk_path + '.part'
+        if pixmap.save(partial_path, 'PNG'):
+            os.replace(partial_path, disk_path)
+
+    def _remember(self, key, pixmap):
+        size = pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+        if size > self.max_bytes:
+            return
+        self._pixmaps[key] = pixmap
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._pixmaps.popitem(last=False)
+            self._bytes -= evicted.width() * evicted.height() * max(evicted.depth(), 8) // 8
+
+
+profile_pixmaps = PixmapCache(os.path.join('static', 'cache'))
+
+
+def save_picture(form_picture):
+    """Store an uploaded picture and start making its thumbnails; return the stored path."""
+    picture_path = store_photo(form_picture)
+    photo_pool.start(Task(make_thumbnails, picture_path))
+    return picture_path
+
+
+# One stylesheet for the whole application, parsed once when it is set on the
+# QApplication, instead of a sheet per widget parsed again for every new page.
+APP_STYLESHEET = """
+QPushButton {
+    background-color: #3a86ff;
+    color: white;
+    font-size: 14px;
+    padding: 10px;
+    border-radius: 5px;
+}
+QPushButton:hover {
+    background-color: #0056b3;
+}
+QPushButton#showMore {
+    color: blue;
+    text-decoration: underline;
+    border: none;
+    background: none;
+}
+QLineEdit#search {
+    padding: 8px;
+    border: 1px solid #3a86ff;
+    border-radius: 5px;
+    font-size: 14px;
+}
+QTableView {
+    background-color: #f9f9f9;
+    alternate-background-color: #e9f5ff;
+    border: 1px solid #ddd;
+    font-size: 14px;
+}
+QHeaderView::section {
+    background-color: #3a86ff;
+    color: white;
+    font-weight: bold;
+    padding: 5px;
+    border: 1px solid #ddd;
+}
+#patientForm QLabel {
+    font-size: 18px;
+    font-weight: bold;
+    color: #2E7D32;
+    margin-bottom: 5px;
+}
+#patientForm QLineEdit {
+    padding: 10px;
+    border: 1px solid #388E3C;
+    border-radius: 5px;
+    font-size: 14px;
+}
+#patientForm QTextEdit {
+    padding: 10px;
+    border: 1px solid #388E3C;
+    border-radius: 5px;
+    font-size: 16px;
+}
+#loginPage {
+    background-color: #E0F7FA;
+}
+#loginPage QLineEdit {
+    padding: 10px;
+    border: 1px solid #00897B;
+    border-radius: 5px;
+}
+QPushButton#loginButton {
+    background-color: #00897B;
+    color: white;
+    padding: 10px;
+    border: none;
+    border-radius: 5px;
+    font-size: 16px;
+    font-weight: bold;
+}
+QPushButton#loginButton:hover {
+    background-color: #00796B;
+}
+#profileContent, #profileContent QLabel {
+    background-color: #f0f0f0;
+    border: 2px solid #2E7D32;
+    border-radius: 10px;
+    padding: 15px;
+}
+QLabel#profilePhoto {
+    border-radius: 10px;
+    padding: 10px;
+    background-color: #f0f0f0;
+}
+"""
+
+
+class MainWindow(QMainWindow):
+    """The only top-level window; pages live in a stack and are reused.
+
+    Every page is made the first time it is needed and then rebound to new data
+    (PatientFormPage.edit, ProfilePage.show_patient) rather than built again.
+    """
+
+    def __init__(self):
+        super(MainWindow, self).__init__()
+        self.setWindowIcon(QIcon('static/logo.ico'))
+        self.stack = QStackedWidget()
+        self.setCentralWidget(self.stack)
+        self.home_page = None
+        self.form_page = None
+        self.profile_page = None
+
+        self.login_page = LoginPage(self)
+        self.show_page(self.login_page)
+        session_events.expired.connect(self.session_expired)
+        session_events.server_unavailable.connect(self.server_unavailable)
+        self.server_warning_shown = False
+        self.resize(400, 200)
+        center(self)
+
+    def show_page(self, page):
+        if self.stack.indexOf(page) < 0:
+            self.stack.addWidget(page)
+        self.stack.setCurrentWidget(page)
+        self.setWindowTitle(page.windowTitle())
+
+    def session_expired(self):
+        if self.stack.currentWidget() is self.login_page:
+            return
+        self.show_page(self.login_page)
+        QMessageBox.warning(self, "خطأ", "انتهت الجلسة، يرجى تسجيل الدخول مجددا")
+
+    def server_unavailable(self, message):
+        # Every request made meanwhile fails the same way: one warning at a time
+        if self.server_warning_shown:
+            return
+        self.server_warning_shown = True
+        try:
+            QMessageBox.warning(self, "خطأ", "تعذر الاتصال بالخادم، حاول مرة أخرى بعد قليل\n\n" + message)
+        finally:
+            self.server_warning_shown = False
+
+    def show_home(self):
+        first_time = self.home_page is None
+        if first_time:
+            self.home_page = HomePage(self)
+        self.show_page(self.home_page)
+        if first_time:
+            self.resize(1000, 900)
+            center(self)
+
+    def show_form(self, patient=None):
+        if self.form_page is None:
+            self.form_page = PatientFormPage(self)
+        self.form_page.edit(patient)
+        self.show_page(self.form_page)
+
+    def show_profile(self, patient):
+        if self.profile_page is None:
+            self.profile_page = ProfilePage(self)
+        self.profile_page.show_patient(patient)
+        self.show_page(self.profile_page)
+
+
+startup_timer.mark("definitions")
+
+if __name__ == '__main__':
+    show_startup_timing = '--startup-timing' in sys.argv
+    app = QApplication(sys.argv)
+    sys.excepthook = excepthook
+    # Set application icon globally (optional)
+    app.setWindowIcon(QIcon('static/logo.ico'))
+    startup_timer.mark("QApplication")
+
+    if repository.is_local:
+        ensure_admin_user()  # the clinic server does this for its own database
+        backup_scheduler.start()
+    startup_timer.mark("admin user")
+
+    app.setStyleSheet(APP_STYLESHEET)
+    main_window = MainWindow()
+    main_window.show()
+    startup_timer.mark("main window")
+
+    def first_event_loop_turn():
+        startup_timer.mark("event loop")
+        if show_startup_timing:
+            startup_timer.report()
+
+    QTimer.singleShot(0, first_event_loop_turn)
+    sys.exit(app.exec_())
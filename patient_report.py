@@ -0,0 +1,242 @@
+"""PDF reports of patients, built with ReportLab.
+
+Kept out of oussama04.py so that ReportLab, python-bidi and arabic_reshaper
+are only imported the first time a report is generated, not at startup.
+"""
+import os
+from datetime import datetime
+from functools import lru_cache
+
+import arabic_reshaper
+from bidi.algorithm import get_display
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Flowable, SimpleDocTemplate, Paragraph, Spacer, Image as ReportImage
+
+
+def reshape_text(text):
+    # Reshape and apply Bidi algorithm to make Arabic readable.
+    reshaped_text = arabic_reshaper.reshape(text)
+    bidi_text = get_display(reshaped_text)
+    return bidi_text
+
+
+@lru_cache(maxsize=64)
+def reshape_label(text):
+    # Cached: the report labels are the same for every patient. Patient text
+    # goes through reshape_text, so no note is kept alive after its report.
+    return reshape_text(text)
+
+
+class ReportCancelled(Exception):
+    """Raised inside a report build when the user cancels it."""
+
+
+class ReportDocTemplate(SimpleDocTemplate):
+    """SimpleDocTemplate that reports layout progress and stops when cancelled."""
+
+    def __init__(self, filename, progress, is_cancelled, **kw):
+        SimpleDocTemplate.__init__(self, filename, **kw)
+        self._progress = progress
+        self._is_cancelled = is_cancelled
+        self._flowables_total = 1
+        self._flowables_done = 0
+
+    def build(self, flowables, **kw):
+        self._flowables_total = max(len(flowables), 1)
+        SimpleDocTemplate.build(self, flowables, **kw)
+
+    def afterFlowable(self, flowable):
+        if self._is_cancelled():
+            raise ReportCancelled()
+        self._flowables_done += 1
+        # Layout is the second half of the work; split flowables may be counted twice
+        self._progress(min(99, 50 + 50 * self._flowables_done // self._flowables_total))
+
+
+class SharedImage(Flowable):
+    """An image decoded once, as an ImageReader, drawn at a fixed size.
+
+    ReportLab's Image flowable reads its file again for each instance.
+    """
+
+    def __init__(self, image, width, height):
+        Flowable.__init__(self)
+        self.image = image
+        self.width = width
+        self.height = height
+
+    def wrap(self, availWidth, availHeight):
+        return self.width, self.height
+
+    def draw(self):
+        self.canv.drawImage(self.image, 0, 0, self.width, self.height, mask='auto')
+
+
+class ReportEngine:
+    """Fonts, paragraph styles and fixed flowables shared by every patient report.
+
+    Building these is most of the cost of a small report, so it is done once
+    (see get_report_engine) and each report only adds the patient's own content.
+    """
+
+    SIGNATURE_PATH = 'static/path_to_doctor_signature.png'
+
+    # (label, field) printed as one header line: "label: value"
+    DETAILS = [
+        ("الاسم واللقب", 'firstname_familyname'),
+        ("السن", 'age'),
+        ("الجنس", 'sex'),
+        ("المستوى الدراسي", 'education_level'),
+        ("العنوان", 'address'),
+    ]
+    # (label, field) printed as a header followed by the note text
+    SECTIONS = [
+        ("  معلومات : ", 'information'),
+        ("  التشخيص : ", 'diagnosis'),
+        ("  التوجيهات وااقتراحات : ", 'propositions_directing'),
+        ("  الخطةالعلاجية : ", 'curing_program'),
+        ("  التقييم :", 'evaluation'),
+        ("  التقرير :", 'reporting'),
+    ]
+
+    def __init__(self):
+        # Register the Amiri files once, as one family, instead of swapping
+        # regular and bold under the same font name for every report.
+        for name, file_name in [
+            ('Amiri', 'Amiri-Regular.ttf'),
+            ('Amiri-Bold', 'Amiri-Bold.ttf'),
+            ('Amiri-Italic', 'Amiri-Italic.ttf'),
+            ('Amiri-BoldItalic', 'Amiri-BoldItalic.ttf'),
+        ]:
+            pdfmetrics.registerFont(TTFont(name, os.path.join('static', file_name)))
+        pdfmetrics.registerFontFamily('Amiri', normal='Amiri', bold='Amiri-Bold', italic='Amiri-Italic', boldItalic='Amiri-BoldItalic')
+
+        # Custom style for Arabic text
+        self.arabic_style = ParagraphStyle(name='Arabic', fontName='Amiri', fontSize=12, alignment=2)  # Right align
+        self.arabic_style_header = ParagraphStyle(name='ArabicSection', fontName='Amiri', fontSize=14, alignment=2)  # Right align
+        self.arabic_style_header_top = ParagraphStyle(
+            name='ArabicHeader',
+            fontName='Amiri-Bold',         # Arabic font
+            fontSize=22,                   # Larger font size for headers
+            alignment=1,                   # Center align the text
+            textColor=colors.HexColor("#006699"),  # Custom color (dark blue)
+            spaceAfter=24,                 # Add space after the header
+            spaceBefore=12,                # Add space before the header
+            leading=22,                    # Increase line height/leading for better readability
+            borderPadding=(10, 5, 10, 5),  # Padding (top, left, bottom, right)
+            borderColor=colors.HexColor("#006699"),  # Border color matching the text
+            borderWidth=1,                 # Border width
+            borderRadius=5,                # Rounded corners for the border
+            backColor=colors.HexColor("#E6F7F5"),  # Light background color to make the header stand out
+        )
+
+        # Shaped once here. ReportLab marks flowables while laying them out, so
+        # every report still gets its own Paragraph objects around this text.
+        self.clinic_name = reshape_text("عيادة بارود")
+        self.signature_line = reshape_text("_____________________________________________________________________________")
+        self.signature_title = reshape_text("<u> توقيع الطبيب </u>")
+
+        # Decoded once and drawn by the SharedImage of every report
+        self.signature = ImageReader(self.SIGNATURE_PATH) if os.path.exists(self.SIGNATURE_PATH) else None
+
+    def header(self):
+        return [Paragraph(self.clinic_name, self.arabic_style_header_top), Spacer(1, 24)]
+
+    def signature_block(self):
+        block = [
+            Spacer(1, 24),
+            Spacer(1, 24),
+            Paragraph(self.signature_line, self.arabic_style),
+            Spacer(1, 24),
+            Paragraph(self.signature_title, self.arabic_style_header),
+            Spacer(1, 24),
+        ]
+        # Add doctor's signature image at the bottom
+        if self.signature is not None:
+            signature_image = SharedImage(self.signature, 0.75 * inch, 0.75 * inch)  # Adjust size as needed
+            signature_image.hAlign = 'RIGHT'
+            block.append(signature_image)
+        return block
+
+    def build(self, patient, file_path, progress=lambda percent: None, is_cancelled=lambda: False, visits=()):
+        """Write the PDF report of patient to file_path.
+
+        patient is a PatientSnapshot and visits the VisitSnapshots to include,
+        newest first, so this can run away from the GUI thread.
+        progress receives a percentage; ReportCancelled is raised once is_cancelled() is true.
+        """
+        def check_progress(percent):
+            if is_cancelled():
+                raise ReportCancelled()
+            progress(percent)
+
+        doc = ReportDocTemplate(file_path, progress, is_cancelled, pagesize=letter)
+
+        # Clinic Name and Date
+        report_content = self.header()
+        report_content.append(Paragraph(reshape_text(f"تاريخ التقرير: {datetime.now().strftime('%Y-%m-%d')}"), self.arabic_style))
+        report_content.append(Spacer(1, 24))
+
+        # Add patient's photo at the top-left corner
+        if patient.photo and os.path.exists(patient.photo):
+            patient_image = ReportImage(patient.photo, 1.5 * inch, 1.5 * inch)  # Adjust size as needed
+            patient_image.hAlign = 'LEFT'
+            report_content.append(patient_image)
+
+        check_progress(10)
+
+        # Patient Details
+        for label, field in self.DETAILS:
+            report_content.append(Paragraph(reshape_text(f"{label}: {getattr(patient, field)}"), self.arabic_style_header))
+            report_content.append(Spacer(1, 12))
+        for step, (label, field) in enumerate(self.SECTIONS):
+            if step:
+                report_content.append(Spacer(1, 12))
+            report_content.append(Paragraph(reshape_label(label), self.arabic_style_header))
+            report_content.append(Spacer(1, 12))
+            report_content.append(Paragraph(reshape_text(f"{getattr(patient, field)}"), self.arabic_style))
+            check_progress(10 + 30 * (step + 1) // len(self.SECTIONS))
+
+        # Most recent sessions
+        if visits:
+            report_content.append(Spacer(1, 12))
+            report_content.append(Paragraph(reshape_label("  الزيارات الأخيرة : "), self.arabic_style_header))
+        for visit in visits:
+            report_content.append(Spacer(1, 12))
+            report_content.append(Paragraph(reshape_text(visit.visited_at.strftime('%Y-%m-%d')), self.arabic_style_header))
+            if visit.notes:
+                report_content.append(Paragraph(reshape_text(visit.notes), self.arabic_style))
+            if visit.evaluation:
+                report_content.append(Paragraph(reshape_text(f"التقييم: {visit.evaluation}"), self.arabic_style))
+        check_progress(45)
+
+        # Doctor's Signature
+        report_content.extend(self.signature_block())
+
+        check_progress(50)
+
+        # Build the PDF
+        doc.build(report_content)
+        progress(100)
+
+
+_report_engine = None
+
+
+def get_report_engine():
+    """Return the shared ReportEngine, creating it on first use."""
+    global _report_engine
+    if _report_engine is None:
+        _report_engine = ReportEngine()
+    return _report_engine
+
+
+def build_patient_report(patient, file_path, progress=lambda percent: None, is_cancelled=lambda: False, visits=()):
+    """Write the PDF report of patient to file_path with the shared ReportEngine."""
+    get_report_engine().build(patient, file_path, progress, is_cancelled, visits)
@@ -0,0 +1,350 @@
+"""Clinic server: owns the patients database and serves it to the workstations.
+
+Run it on the machine that keeps patients.db:
+
+    python server.py [--host 0.0.0.0] [--port 8765] [--workers 4]
+
+then set "server": {"url": "http://<that machine>:8765"} in config.json on
+every workstation. The server also takes the scheduled backups of the
+database (see backup.py).
+
+Every request but POST /login needs the session token that a successful login
+returns, as "Authorization: Bearer <token>". Wrong passwords make the username
+and the client address wait longer and longer before their next attempt.
+
+By default the link is plain HTTP: anyone on the network can read the records
+and passwords passing over it. Set "certfile" and "keyfile" in the "server"
+section to serve HTTPS instead, and use an https:// url on the workstations
+(with "cafile" set there too if the certificate is self-signed). Requests and responses are JSON over HTTP. The database
+work runs on a pool of worker threads, each request in a session of its own,
+drawing from a pool of SQLite connections, so only this process ever writes
+the file.
+"""
+import argparse
+import asyncio
+import ipaddress
+import json
+import math
+import os
+import re
+import secrets
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from backup import backup_directory, create_backup, list_backups
+from storage import (
+    LOGIN_INVALID_CREDENTIALS, LOGIN_OK, LOGIN_TOO_MANY_ATTEMPTS, LocalPatientRepository, LoginThrottle, PatientConflict, PATIENT_FIELDS, PATIENT_FILTERS, PATIENT_SORT_KEYS, config, create_sqlite_engine,
+    ensure_admin_user, init_database, visit_record,
+)
+
+MAX_BODY = 16 * 1024 * 1024
+SESSION_IDLE_SECONDS = 12 * 3600  # a session unused this long needs a new login
+BACKUP_RETRY_SECONDS = 600
+EDITABLE_FIELDS = set(PATIENT_FIELDS) - {'id', 'version'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+
+
+class SessionTokens:
+    """Session tokens issued at login, each valid until unused for SESSION_IDLE_SECONDS.
+
+    Kept in memory only: restarting the server logs every workstation out.
+    """
+
+    def __init__(self):
+        self._expiry = {}  # token -> monotonic time it expires
+
+    def issue(self):
+        now = time.monotonic()
+        for token in [token for token, expires in self._expiry.items() if expires <= now]:
+            del self._expiry[token]
+        token = secrets.token_urlsafe(32)
+        self._expiry[token] = now + SESSION_IDLE_SECONDS
+        return token
+
+    def check(self, token):
+        """Whether token is a live session, which then stays live for another SESSION_IDLE_SECONDS."""
+        now = time.monotonic()
+        if self._expiry.get(token, 0) <= now:
+            self._expiry.pop(token, None)
+            return False
+        self._expiry[token] = now + SESSION_IDLE_SECONDS
+        return True
+
+
+class PatientService:
+    """Patient requests over HTTP, answered by LocalPatientRepository calls on worker threads."""
+
+    def __init__(self, engine, workers):
+        self.Session = sessionmaker(bind=engine)
+        self.repository = LocalPatientRepository(self.Session)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db')
+        # Both used on the event loop thread only
+        self.sessions = SessionTokens()
+        self.login_throttle = LoginThrottle()
+
+    async def call(self, method, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, getattr(self.repository, method), *args)
+
+    async def login(self, payload, client):
+        if not isinstance(payload, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "expected a JSON object")
+        username = str(payload.get('username', ''))
+        # Throttled by username against guessing one password, and by client
+        # address against trying one password on many usernames
+        keys = (('user', username), ('client', client))
+        wait = max(self.login_throttle.retry_after(key) for key in keys)
+        if wait:
+            return HTTPStatus.TOO_MANY_REQUESTS, {'status': LOGIN_TOO_MANY_ATTEMPTS, 'retry_after': math.ceil(wait)}
+        # Counted as failed until proven otherwise, so attempts sent in parallel
+        # are throttled too rather than all passing while bcrypt runs
+        for key in keys:
+            self.login_throttle.failed(key)
+        status = await self.call('verify_login', username, str(payload.get('password', '')))
+        if status != LOGIN_OK:
+            # Unknown username or wrong password: the log says which, the answer does not
+            print("Failed login for %r from %s: %s" % (username, client, status))
+            return HTTPStatus.OK, {'status': LOGIN_INVALID_CREDENTIALS}
+        for key in keys:
+            self.login_throttle.succeeded(key)
+        return HTTPStatus.OK, {'status': status, 'token': self.sessions.issue()}
+
+    def authenticate(self, headers):
+        scheme, _, token = headers.get('authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not self.sessions.check(token.strip()):
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, "log in first")
+
+    async def respond(self, method, target, body, headers, client):
+        """Return (status, JSON-serializable result) for one request."""
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query, keep_blank_values=True).items()}
+        payload = json.loads(body.decode('utf-8')) if body else None
+        path = url.path.rstrip('/')
+        match = re.fullmatch(r'/patients/(\d+)(/summary|/visits)?', path)
+
+        if path == '/login' and method == 'POST':
+            return await self.login(payload, client)
+        self.authenticate(headers)
+
+        if path == '/patients' and method == 'GET':
+            sort = query.get('sort', 'id')
+            if sort not in PATIENT_SORT_KEYS:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "unknown sort: %s" % sort)
+            after = None
+            if 'after_id' in query:
+                after = (query.get('after_value'), _int(query, 'after_id', 0))
+            return HTTPStatus.OK, await self.call(
+                'list_page', _int(query, 'limit', 200), sort, bool(_int(query, 'desc', 0)), _filters(query), after)
+        if path == '/patients' and method == 'POST':
+            return HTTPStatus.CREATED, {'id': await self.call('add', _patient_values(payload))}
+        if path == '/search' and method == 'GET':
+            return HTTPStatus.OK, await self.call(
+                'search', query.get('q', ''), _int(query, 'limit', 200), _int(query, 'offset', 0), _filters(query))
+        if path.startswith('/values/') and method == 'GET':
+            return HTTPStatus.OK, await self.call('distinct_values', unquote(path[len('/values/'):]))
+        if match and match.group(2) == '/visits' and method == 'GET':
+            before = None
+            if 'before_id' in query:
+                before = (_datetime(query, 'before_time'), _int(query, 'before_id', 0))
+            visits = await self.call('visits', int(match.group(1)), _int(query, 'limit', 10), before)
+            return HTTPStatus.OK, [visit_record(visit) for visit in visits]
+        if match and match.group(2) == '/visits' and method == 'POST':
+            if not isinstance(payload, dict):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "expected a JSON object")
+            visited_at = _datetime(payload, 'visited_at') if payload.get('visited_at') else None
+            try:
+                visit_id = await self.call('add_visit', int(match.group(1)), payload.get('notes'),
+                                           payload.get('evaluation'), visited_at)
+            except KeyError:
+                return _found(None)
+            return HTTPStatus.CREATED, {'id': visit_id}
+        if match and match.group(2) and method == 'GET':
+            return _found(await self.call('get_summary', int(match.group(1))))
+        if match and method == 'GET':
+            snapshot = await self.call('get', int(match.group(1)))
+            return _found(snapshot._asdict() if snapshot else None)
+        if match and not match.group(2) and method == 'PUT':
+            # Optimistic concurrency: ?version= is the version the client read
+            expected = _int(query, 'version', 0) if 'version' in query else None
+            try:
+                version = await self.call('update', int(match.group(1)), _patient_values(payload), expected)
+            except KeyError:
+                return _found(None)
+            except PatientConflict as conflict:
+                return HTTPStatus.CONFLICT, {'error': str(conflict), 'patient': conflict.current._asdict()}
+            return HTTPStatus.OK, {'id': int(match.group(1)), 'version': version}
+        if match and not match.group(2) and method == 'DELETE':
+            await self.call('delete', int(match.group(1)))
+            return HTTPStatus.OK, {'id': int(match.group(1))}
+        raise HTTPError(HTTPStatus.NOT_FOUND, "no route for %s %s" % (method, url.path))
+
+    async def handle_connection(self, reader, writer):
+        client = (writer.get_extra_info('peername') or ('',))[0]
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY:
+                    status, result = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': "request body too large"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    try:
+                        status, result = await self.respond(method, target, body, headers, client)
+                    except HTTPError as exc:
+                        status, result = exc.status, {'error': str(exc)}
+                    except ValueError as exc:  # bad JSON, numbers or field values
+                        status, result = HTTPStatus.BAD_REQUEST, {'error': str(exc)}
+                    except Exception as exc:
+                        status, result = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(exc)}
+                    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+                data = json.dumps(result, ensure_ascii=False).encode('utf-8')
+                head = (
+                    "HTTP/1.1 %d %s\r\n"
+                    "Content-Type: application/json; charset=utf-8\r\n"
+                    "Content-Length: %d\r\n"
+                    "Connection: %s\r\n\r\n"
+                ) % (status, status.phrase, len(data), 'keep-alive' if keep_alive else 'close')
+                writer.write(head.encode('latin-1'))
+                writer.write(data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass  # client went away or sent something that is not HTTP
+        finally:
+            writer.close()
+
+
+def _int(query, name, default):
+    try:
+        return int(query.get(name, default))
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "%s must be an integer" % name)
+
+
+def _datetime(values, name):
+    try:
+        return datetime.fromisoformat(str(values.get(name)))
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "%s must be an ISO date and time" % name)
+
+
+def _filters(query):
+    filters = {name: query[name] for name in PATIENT_FILTERS if name in query}
+    for name in ('age_min', 'age_max'):
+        if name in filters:
+            filters[name] = _int(query, name, None)
+    return filters
+
+
+def _patient_values(payload):
+    if not isinstance(payload, dict):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "expected a JSON object")
+    unknown = set(payload) - EDITABLE_FIELDS
+    if unknown:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "unknown fields: %s" % ', '.join(sorted(unknown)))
+    return payload
+
+
+def _found(result):
+    if result is None:
+        raise HTTPError(HTTPStatus.NOT_FOUND, "no such patient")
+    return HTTPStatus.OK, result
+
+
+async def backup_periodically(interval_hours):
+    """Back the database up whenever the newest backup is interval_hours old; see backup.py."""
+    database_path, directory = config['database']['path'], backup_directory(config)
+    loop = asyncio.get_running_loop()
+    while True:
+        backups = list_backups(database_path, directory)
+        due = os.path.getmtime(backups[0]) + interval_hours * 3600 if backups else 0
+        await asyncio.sleep(max(0, due - time.time()))
+        try:
+            # On a thread of its own, not one of the workers answering requests
+            path = await loop.run_in_executor(None, lambda: create_backup(
+                database_path, directory, config['backup']['keep'], notice=print))
+        except Exception as exc:
+            print("Backup failed: %s" % exc)
+            await asyncio.sleep(BACKUP_RETRY_SECONDS)
+        else:
+            print("Backed up to %s" % path)
+
+
+def _is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == 'localhost'
+
+
+async def serve(host, port, workers):
+    settings = config['server']
+    ssl_context = None
+    if settings['certfile']:
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(settings['certfile'], settings['keyfile'])
+    elif not _is_loopback(host):
+        print("Warning: serving plain HTTP on %s; patient records and passwords cross the network unencrypted. "
+              "Set certfile and keyfile in the \"server\" section of config.json to serve HTTPS." % host)
+    engine = create_sqlite_engine(
+        config['database'], poolclass=QueuePool, pool_size=workers, max_overflow=0,
+        connect_args={'check_same_thread': False},
+    )
+    init_database(engine)
+    service = PatientService(engine, workers)
+    ensure_admin_user(service.Session)
+    server = await asyncio.start_server(service.handle_connection, host, port, ssl=ssl_context)
+    print("Serving %s on %s over %s" % (config['database']['path'], ', '.join(
+        '%s:%d' % sock.getsockname()[:2] for sock in server.sockets), 'HTTPS' if ssl_context else 'HTTP'))
+    backups = None
+    if config['backup']['interval_hours'] > 0:
+        backups = asyncio.ensure_future(backup_periodically(config['backup']['interval_hours']))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if backups is not None:
+            backups.cancel()
+
+
+def main():
+    settings = config['server']
+    parser = argparse.ArgumentParser(description="Serve the patients database to the clinic workstations.")
+    parser.add_argument('--host', default=settings['host'])
+    parser.add_argument('--port', type=int, default=settings['port'])
+    parser.add_argument('--workers', type=int, default=settings['workers'])
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1376 @@
+"""Patient database: models, SQLite engine configuration, search, repository, export and import.
+
+Nothing in here depends on Qt, so it can be used from scripts and benchmarks.
+"""
+import copy
+import csv
+import json
+import math
+import os
+import re
+import ssl
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zlib
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+
+import bcrypt
+from sqlalchemy import (
+    and_, create_engine, event, func, literal_column, or_, select, table, text, union_all,
+    Column, DateTime, ForeignKey, Index, Integer, String, Text, TypeDecorator,
+)
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker, deferred, undefer_group
+from sqlalchemy.orm.exc import StaleDataError
+
+# Configuration
+# Defaults, overridden key by key by config.json in the working directory (or
+# the file named by the CLINIC_CONFIG environment variable) when it exists.
+DEFAULT_CONFIG = {
+    "database": {
+        "path": "patients.db",
+        "journal_mode": "WAL",      # readers no longer block the writer
+        "synchronous": "NORMAL",    # with WAL: durable at checkpoints, no fsync per commit
+        "mmap_size": 268435456,     # 256 MiB of the file read through memory mapping
+        "cache_size": -65536,       # negative means KiB: a 64 MiB page cache
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,       # ms to wait for another writer before failing
+        "compress_notes": False,    # zlib the long notes when saving; see CompressedText
+    },
+    # Set "url" (e.g. "http://192.168.1.10:8765") to use a clinic server
+    # started with server.py instead of the local database.
+    # Without certfile and keyfile the server speaks plain HTTP: patient records
+    # and passwords cross the network readable by anyone on it. Set them to
+    # serve HTTPS, use an https:// url, and set cafile on the workstations when
+    # the certificate is self-signed.
+    "server": {
+        "url": None,
+        "host": "127.0.0.1",
+        "port": 8765,
+        "workers": 4,
+        "certfile": None,
+        "keyfile": None,
+        "cafile": None,
+    },
+    # Unsaved input of the add-patient form, kept on this workstation; see drafts.py
+    "drafts": {
+        "path": "drafts.jsonl",
+    },
+    # Online backups of the database; see backup.py. The program (on the local
+    # database) or the clinic server takes them every interval_hours.
+    "backup": {
+        "directory": "backups",     # relative to the database's directory
+        "keep": 10,                 # older backups are deleted
+        "interval_hours": 24,       # 0 turns scheduled backups off
+    },
+}
+
+def _merge(defaults, overrides):
+    merged = copy.deepcopy(defaults)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def load_config(path=None):
+    """Return DEFAULT_CONFIG updated with the settings of the config file, if any."""
+    path = path or os.environ.get('CLINIC_CONFIG', 'config.json')
+    if not os.path.exists(path):
+        return copy.deepcopy(DEFAULT_CONFIG)
+    with open(path, encoding='utf-8') as config_file:
+        return _merge(DEFAULT_CONFIG, json.load(config_file))
+
+# Note compression
+# Long notes can be stored zlib-compressed, as a BLOB starting with a format
+# byte; shorter ones, and every note written while compression is off, stay
+# TEXT. Reading handles both, so a database can be converted row by row
+# (see compress_notes.py) and compression switched on or off at any time.
+NOTE_COMPRESSION_MIN_BYTES = 512  # below this zlib saves too little to be worth it
+_ZLIB_NOTE = b'\x01'
+
+def compress_note(value):
+    """The stored form of a note: compressed bytes if that makes it smaller, else the text itself."""
+    if value is None:
+        return None
+    data = str(value).encode('utf-8')
+    if len(data) < NOTE_COMPRESSION_MIN_BYTES:
+        return value
+    compressed = _ZLIB_NOTE + zlib.compress(data, 6)
+    return compressed if len(compressed) < len(data) else value
+
+def decompress_note(stored):
+    """The text of a note as stored by compress_note, or as plain TEXT."""
+    if not isinstance(stored, bytes):
+        return stored
+    if stored[:1] != _ZLIB_NOTE:
+        raise ValueError("Unknown note compression: %r" % stored[:1])
+    return zlib.decompress(stored[1:]).decode('utf-8')
+
+class CompressedText(TypeDecorator):
+    """Text compressed on the way in when the engine's "compress_notes" setting is on,
+    and decompressed on the way out whatever the setting."""
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if getattr(dialect, 'compress_notes', False):
+            return compress_note(value)
+        return value
+
+    def process_result_value(self, value, dialect):
+        return decompress_note(value)
+
+# SQLAlchemy setup
+Base = declarative_base()
+
+class Patient(Base):
+    __tablename__ = 'patients'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    firstname_familyname = Column(String)
+    age = Column(Integer)
+    sex = Column(String)
+    education_level = Column(String)
+    address = Column(String)
+    # The long clinical notes are deferred: they are only read from the
+    # database when a page asks for them with undefer_group('notes').
+    # They may be stored compressed; see CompressedText.
+    information = deferred(Column(CompressedText), group='notes')
+    character = deferred(Column(CompressedText), group='notes')
+    reason_visit = Column(String)
+    from_whom = Column(String)
+    history_illness = deferred(Column(CompressedText), group='notes')
+    psychiatric_history = deferred(Column(CompressedText), group='notes')
+    clinic_follow = deferred(Column(CompressedText), group='notes')
+    diagnosis_history = deferred(Column(CompressedText), group='notes')
+    propositions_directing = deferred(Column(CompressedText), group='notes')
+    diagnosis = deferred(Column(CompressedText), group='notes')
+    curing_program = deferred(Column(CompressedText), group='notes')
+    evaluation = deferred(Column(CompressedText), group='notes')
+    reporting = deferred(Column(CompressedText), group='notes')
+    photo = Column(String)  # path to the patient's photo
+    # Bumped by every UPDATE, which only applies to the version it was read at;
+    # see PatientRepository.update
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
+
+# Columns shown in the patients list, in display order
+PATIENT_SUMMARY_COLUMNS = (
+    Patient.id, Patient.firstname_familyname, Patient.age, Patient.address, Patient.reason_visit
+)
+
+class Visit(Base):
+    """One session with a patient. Sessions are added here, a row each, instead
+    of being appended to the patient's notes."""
+    __tablename__ = 'visits'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    patient_id = Column(Integer, ForeignKey('patients.id'), nullable=False)
+    visited_at = Column(DateTime, nullable=False, default=datetime.now)
+    notes = Column(Text)
+    evaluation = Column(Text)
+
+    # A patient's visits, newest first, are read in index order; see visits()
+    __table_args__ = (Index('ix_visits_patient_date', 'patient_id', 'visited_at', 'id'),)
+
+VisitSnapshot = namedtuple('VisitSnapshot', [column.name for column in Visit.__table__.columns])
+
+class User(Base):
+    __tablename__ = 'users'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    username = Column(String, unique=True, nullable=False)
+    password_hash = Column(String, nullable=False)
+
+# Full-text search
+# Searchable text is normalized in Python (see normalize_arabic) before it is
+# indexed, so the SQLite triggers below call it through a registered function.
+_ARABIC_MARKS = re.compile('[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]')  # tashkeel, Quranic marks, tatweel
+_ARABIC_LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',  # alef variants
+    'ى': 'ي',  # alef maksura
+    'ة': 'ه',  # taa marbuta
+})
+
+SEARCH_NAME_COLUMNS = ('firstname_familyname',)
+SEARCH_NOTES_COLUMNS = (
+    'address', 'reason_visit', 'from_whom', 'information', 'character', 'history_illness',
+    'psychiatric_history', 'clinic_follow', 'diagnosis_history', 'propositions_directing',
+    'diagnosis', 'curing_program', 'evaluation', 'reporting',
+)
+
+def normalize_arabic(value):
+    """Strip diacritics and unify letter variants so spelling differences still match."""
+    if not value:
+        return ''
+    return _ARABIC_MARKS.sub('', str(value)).translate(_ARABIC_LETTERS).lower()
+
+def normalize_name(value):
+    """normalize_arabic with the spacing collapsed; the sort and lookup key of a name."""
+    return ' '.join(normalize_arabic(value).split())
+
+def patient_search_text(*values):
+    """Join and normalize column values into the text stored in the search index.
+
+    The triggers pass the stored values, so compressed notes are decompressed here.
+    """
+    return normalize_arabic(' '.join(str(decompress_note(v)) for v in values if v))
+
+def fts_query(terms):
+    """Turn what the user typed into an FTS5 query: every word must match as a prefix."""
+    words = normalize_arabic(terms).split()
+    return ' '.join('"%s"*' % word.replace('"', '""') for word in words)
+
+def _search_values(row):
+    name = ', '.join('%s.%s' % (row, c) for c in SEARCH_NAME_COLUMNS)
+    notes = ', '.join('%s.%s' % (row, c) for c in SEARCH_NOTES_COLUMNS)
+    return "patient_search_text(%s), patient_search_text(%s)" % (name, notes)
+
+# Contentless FTS5 table: it only keeps the index, the text itself stays in
+# patients. Its rowid is the patient id.
+SEARCH_TABLE_DDL = "CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(name, notes, content='')"
+SEARCH_TRIGGERS = {
+    'patients_fts_insert':
+        "CREATE TRIGGER IF NOT EXISTS patients_fts_insert AFTER INSERT ON patients BEGIN "
+        "INSERT INTO patients_fts(rowid, name, notes) VALUES (new.id, %s); END" % _search_values('new'),
+    'patients_fts_delete':
+        "CREATE TRIGGER IF NOT EXISTS patients_fts_delete AFTER DELETE ON patients BEGIN "
+        "INSERT INTO patients_fts(patients_fts, rowid, name, notes) VALUES ('delete', old.id, %s); END"
+        % _search_values('old'),
+    'patients_fts_update':
+        "CREATE TRIGGER IF NOT EXISTS patients_fts_update AFTER UPDATE OF %s ON patients BEGIN "
+        "INSERT INTO patients_fts(patients_fts, rowid, name, notes) VALUES ('delete', old.id, %s); "
+        "INSERT INTO patients_fts(rowid, name, notes) VALUES (new.id, %s); END"
+        % (', '.join(SEARCH_NAME_COLUMNS + SEARCH_NOTES_COLUMNS), _search_values('old'), _search_values('new')),
+}
+
+# Visits get an index of their own, its rowid being the visit id; a match
+# there is a match for the visit's patient.
+VISIT_SEARCH_TABLE_DDL = "CREATE VIRTUAL TABLE IF NOT EXISTS visits_fts USING fts5(notes, content='')"
+VISIT_SEARCH_TRIGGERS = {
+    'visits_fts_insert':
+        "CREATE TRIGGER IF NOT EXISTS visits_fts_insert AFTER INSERT ON visits BEGIN "
+        "INSERT INTO visits_fts(rowid, notes) VALUES (new.id, patient_search_text(new.notes, new.evaluation)); END",
+    'visits_fts_delete':
+        "CREATE TRIGGER IF NOT EXISTS visits_fts_delete AFTER DELETE ON visits BEGIN "
+        "INSERT INTO visits_fts(visits_fts, rowid, notes) "
+        "VALUES ('delete', old.id, patient_search_text(old.notes, old.evaluation)); END",
+    'visits_fts_update':
+        "CREATE TRIGGER IF NOT EXISTS visits_fts_update AFTER UPDATE OF notes, evaluation ON visits BEGIN "
+        "INSERT INTO visits_fts(visits_fts, rowid, notes) "
+        "VALUES ('delete', old.id, patient_search_text(old.notes, old.evaluation)); "
+        "INSERT INTO visits_fts(rowid, notes) VALUES (new.id, patient_search_text(new.notes, new.evaluation)); END",
+}
+
+def _table_exists(conn, name):
+    return conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+    ), {"name": name}).first() is not None
+
+def _trigger_exists(conn, name):
+    return conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name"
+    ), {"name": name}).first() is not None
+
+def ensure_search_index(engine):
+    """Create the search indexes and their triggers, indexing existing rows the first time."""
+    with engine.begin() as conn:
+        exists = _table_exists(conn, 'patients_fts')
+        # Rows written while a trigger was missing were never indexed
+        complete = exists and all(_trigger_exists(conn, name) for name in SEARCH_TRIGGERS)
+        conn.execute(text(SEARCH_TABLE_DDL))
+        create_search_triggers(conn)
+        if not complete:
+            rebuild_search_index(conn)
+
+        exists = _table_exists(conn, 'visits_fts')
+        conn.execute(text(VISIT_SEARCH_TABLE_DDL))
+        for statement in VISIT_SEARCH_TRIGGERS.values():
+            conn.execute(text(statement))
+        if not exists:
+            conn.execute(text(
+                "INSERT INTO visits_fts(rowid, notes) SELECT id, patient_search_text(notes, evaluation) FROM visits"
+            ))
+
+def create_search_triggers(conn):
+    for statement in SEARCH_TRIGGERS.values():
+        conn.execute(text(statement))
+
+def begin_explicitly(conn):
+    """Start the transaction of conn now, taking the write lock.
+
+    pysqlite only begins a transaction before INSERT, UPDATE and DELETE, so
+    without this a DROP TRIGGER issued first takes effect at once and stays
+    in effect if the transaction is rolled back.
+    """
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+def drop_search_triggers(conn):
+    """Stop indexing row by row, e.g. during a bulk import; see index_patients_after.
+
+    Call begin_explicitly first, so the triggers come back on rollback.
+    """
+    for name in SEARCH_TRIGGERS:
+        conn.execute(text("DROP TRIGGER IF EXISTS %s" % name))
+
+def rebuild_search_index(conn):
+    """Re-index every patient from scratch."""
+    conn.execute(text("INSERT INTO patients_fts(patients_fts) VALUES ('delete-all')"))
+    index_patients_after(conn, 0)
+
+def index_patients_after(conn, last_id):
+    """Index, in one statement, the patients whose id is greater than last_id."""
+    conn.execute(text(
+        "INSERT INTO patients_fts(rowid, name, notes) SELECT id, %s FROM patients WHERE id > :last_id"
+        % _search_values('patients')
+    ), {"last_id": last_id})
+
+# Schema migrations
+# The schema version is kept in SQLite's user_version header field. Each
+# migration brings the schema from one version to the next and runs in its own
+# transaction at startup. Append new migrations; never change released ones.
+def _add_patient_lookup_indexes(conn):
+    """Indexes for the columns the patients list filters and sorts on."""
+    for name, expression in (
+        ('ix_patients_firstname_familyname', 'firstname_familyname'),
+        ('ix_patients_reason_visit', 'reason_visit'),
+        ('ix_patients_from_whom', 'from_whom'),
+        ('ix_patients_age', 'age'),
+        # Spelling-insensitive lookups and sorting by name; see normalize_name
+        ('ix_patients_name_normalized', 'normalize_name(firstname_familyname)'),
+    ):
+        conn.execute(text("CREATE INDEX IF NOT EXISTS %s ON patients (%s)" % (name, expression)))
+    conn.execute(text("ANALYZE patients"))
+
+def _add_address_index(conn):
+    """The address column is sortable in the patients list too."""
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_patients_address ON patients (address)"))
+    conn.execute(text("ANALYZE patients"))
+
+def _add_patient_version(conn):
+    """Row versions for optimistic concurrency; existing patients start at 1."""
+    columns = {row[1] for row in conn.execute(text("PRAGMA table_info(patients)"))}
+    if 'version' not in columns:  # create_all already made it in a new database
+        conn.execute(text("ALTER TABLE patients ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+
+# Session notes used to be appended to these columns, each entry starting
+# with its date on a line of its own. "notes" and "evaluation" are the Visit
+# columns their entries move to; in a column that takes entries from more than
+# one field, every entry is headed by the label of the field it came from.
+VISIT_NOTE_SOURCES = (
+    ('clinic_follow', 'notes', 'المتابعات الإكلينيكية'),
+    ('diagnosis_history', 'notes', 'مجريات الفحص + التاريخ'),
+    ('evaluation', 'evaluation', 'التقييم'),
+)
+_ENTRY_DATE = re.compile(r'^[ \t]*(?:(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})|(\d{4})[/.-](\d{1,2})[/.-](\d{1,2}))', re.M)
+
+def split_dated_entries(notes):
+    """Split notes at the lines starting with a date (d/m/yyyy or yyyy-m-d).
+
+    Return the text before the first date and a list of (datetime, entry);
+    every entry keeps its date line. Things that only look like dates, such
+    as 31/02/2020, do not start an entry.
+    """
+    starts = []
+    for match in _ENTRY_DATE.finditer(notes):
+        day, month, year = match.group(1, 2, 3) if match.group(3) else match.group(6, 5, 4)
+        try:
+            starts.append((match.start(), datetime(int(year), int(month), int(day))))
+        except ValueError:
+            continue
+    ends = [start for start, _ in starts[1:]] + [len(notes)]
+    entries = [(date, notes[start:end].strip()) for (start, date), end in zip(starts, ends)]
+    return notes[:starts[0][0]].strip() if starts else notes, entries
+
+def _split_visit_notes(conn):
+    """Turn the dated entries of the session notes into visits, one per date.
+
+    Text before the first date, and notes without any date, stay where they are.
+    """
+    patients = Patient.__table__
+    visits = Visit.__table__
+    visits.create(conn, checkfirst=True)
+    sources = [patients.c[field] for field, _, _ in VISIT_NOTE_SOURCES]
+    targets = [column for _, column, _ in VISIT_NOTE_SOURCES]
+    labelled = {column for column in targets if targets.count(column) > 1}
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(patients.c.id, *sources).where(patients.c.id > last_id).order_by(patients.c.id).limit(500)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for patient_id, *notes in rows:
+            by_date = {}  # datetime -> Visit column -> entries
+            remaining = {}
+            for (field, column, label), value in zip(VISIT_NOTE_SOURCES, notes):
+                preamble, entries = split_dated_entries(value) if value else (value, [])
+                if not entries:
+                    continue
+                remaining[field] = preamble or None
+                for date, entry in entries:
+                    if column in labelled:
+                        entry = "%s:\n%s" % (label, entry)
+                    by_date.setdefault(date, {}).setdefault(column, []).append(entry)
+            if not by_date:
+                continue
+            conn.execute(visits.insert(), [
+                {'patient_id': patient_id, 'visited_at': date,
+                 'notes': '\n\n'.join(columns.get('notes', [])) or None,
+                 'evaluation': '\n\n'.join(columns.get('evaluation', [])) or None}
+                for date, columns in sorted(by_date.items())
+            ])
+            conn.execute(patients.update().where(patients.c.id == patient_id)
+                         .values(version=patients.c.version + 1, **remaining))
+
+_AGE_NUMBER = re.compile(r'\d+')
+
+def _coerce_stored_ages(conn):
+    """Older versions saved the age box's text as it was: store whole numbers, and NULL for the rest.
+
+    Text such as "30 سنة" keeps its first number.
+    """
+    patients = Patient.__table__
+    rows = conn.execute(select(patients.c.id, patients.c.age)
+                        .where(patients.c.age.isnot(None), func.typeof(patients.c.age) != 'integer')).fetchall()
+    for patient_id, age in rows:
+        number = _AGE_NUMBER.search(str(age))
+        try:
+            age = coerce_age(age if isinstance(age, float) or not number else number.group())
+        except ValueError:
+            age = None
+        conn.execute(patients.update().where(patients.c.id == patient_id)
+                     .values(age=age, version=patients.c.version + 1))
+
+MIGRATIONS = [
+    _add_patient_lookup_indexes,  # version 1
+    _add_address_index,  # version 2
+    _add_patient_version,  # version 3
+    _split_visit_notes,  # version 4
+    _coerce_stored_ages,  # version 5
+]
+
+def schema_version(conn):
+    return conn.execute(text("PRAGMA user_version")).scalar()
+
+def migrate(engine):
+    """Apply the migrations this database has not had yet and return its schema version."""
+    with engine.connect() as conn:
+        version = schema_version(conn)
+    if version > len(MIGRATIONS):
+        raise RuntimeError("The database schema (version %d) is newer than this program (version %d)"
+                           % (version, len(MIGRATIONS)))
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        with engine.begin() as conn:
+            migration(conn)
+            conn.execute(text("PRAGMA user_version = %d" % number))
+    return len(MIGRATIONS)
+
+def convert_notes(engine, compress=True, batch_size=500, progress=None):
+    """Rewrite the stored notes of every patient compressed, or with compress=False as plain text.
+
+    Works in batches of batch_size patients, a transaction each, and skips
+    notes already stored as wanted, so it can be interrupted and run again.
+    The text itself does not change, so the search index stays valid: its
+    triggers are dropped meanwhile. progress, if given, receives the last
+    patient id done. Return the number of notes rewritten.
+    """
+    columns = [column.name for column in Patient.__table__.columns if isinstance(column.type, CompressedText)]
+    # Plain SQL, so the values come and go as stored, without CompressedText
+    select_batch = text("SELECT id, %s FROM patients WHERE id > :last_id ORDER BY id LIMIT :limit"
+                        % ', '.join(columns))
+    rewritten = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            begin_explicitly(conn)  # so an interrupted batch brings the triggers back with its rollback
+            rows = conn.execute(select_batch, {"last_id": last_id, "limit": batch_size}).fetchall()
+            if not rows:
+                break
+            drop_search_triggers(conn)
+            for patient_id, *stored_notes in rows:
+                changes = {}
+                for column, stored in zip(columns, stored_notes):
+                    value = decompress_note(stored)
+                    wanted = compress_note(value) if compress else value
+                    if wanted != stored:
+                        changes[column] = wanted
+                if changes:
+                    conn.execute(text("UPDATE patients SET %s WHERE id = :id"
+                                      % ', '.join('%s = :%s' % (column, column) for column in changes)),
+                                 dict(changes, id=patient_id))
+                    rewritten += len(changes)
+            create_search_triggers(conn)
+            last_id = rows[-1][0]
+        if progress is not None:
+            progress(last_id)
+    return rewritten
+
+# SQLite database setup
+def register_sql_functions(dbapi_connection):
+    """Make the search normalization callable from SQL, for the index triggers and the normalized name index.
+
+    Any sqlite3 connection writing patients, or checking the indexes, needs them.
+    """
+    dbapi_connection.create_function('patient_search_text', -1, patient_search_text, deterministic=True)
+    dbapi_connection.create_function('normalize_name', 1, normalize_name, deterministic=True)
+
+# Connection pragmas applied by create_sqlite_engine, in this order
+SQLITE_PRAGMAS = ('busy_timeout', 'journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'temp_store')
+
+def create_sqlite_engine(settings, **engine_options):
+    """Create an engine for the database described by a "database" config section.
+
+    Every new connection gets the search function registered and the
+    SQLITE_PRAGMAS from settings applied; a setting of None leaves SQLite's default.
+    Notes are compressed when saved if settings["compress_notes"] is set.
+    engine_options are passed on to create_engine (e.g. pool settings).
+    """
+    engine = create_engine('sqlite:///' + settings['path'], **engine_options)
+    # Read by CompressedText when binding values
+    engine.dialect.compress_notes = bool(settings.get('compress_notes'))
+
+    @event.listens_for(engine, "connect")
+    def configure_connection(dbapi_connection, connection_record):
+        register_sql_functions(dbapi_connection)
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            value = settings.get(pragma)
+            if value is None:
+                continue
+            if not re.fullmatch(r'-?\w+', str(value)):
+                raise ValueError("Invalid value for PRAGMA %s: %r" % (pragma, value))
+            cursor.execute("PRAGMA %s = %s" % (pragma, value))
+        cursor.close()
+
+    return engine
+
+def init_database(engine):
+    """Create missing tables, bring the schema up to date and create the search index."""
+    Base.metadata.create_all(engine)
+    migrate(engine)
+    ensure_search_index(engine)
+
+config = load_config()
+engine = create_sqlite_engine(config['database'])
+
+Session = sessionmaker(bind=engine)
+
+@contextmanager
+def session_scope(session_factory=Session):
+    """A session for one unit of work: committed if the block succeeds, rolled back
+    if it raises, closed either way.
+
+    Sessions are never kept between operations, so no identity map grows over a
+    day's work and no window can see another window's stale objects. What leaves
+    the block must be plain values or snapshots, never ORM objects.
+    """
+    session = session_factory()
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+# Immutable copy of every column of a patient, safe to hand to another thread
+PatientSnapshot = namedtuple('PatientSnapshot', [attr.key for attr in Patient.__mapper__.column_attrs])
+
+def snapshot_patient(patient):
+    """Copy a fully loaded patient into a PatientSnapshot, detached from the session."""
+    return PatientSnapshot(*(getattr(patient, field) for field in PatientSnapshot._fields))
+
+# Passwords
+MIN_BCRYPT_ROUNDS = 10
+BCRYPT_TARGET_SECONDS = 0.25
+_bcrypt_rounds = None
+
+def bcrypt_rounds():
+    """Cost factor for new hashes: about BCRYPT_TARGET_SECONDS per hash on this machine.
+
+    Measured once per process with a cheap probe hash and extrapolated, since
+    every extra round doubles the hashing time.
+    """
+    global _bcrypt_rounds
+    if _bcrypt_rounds is None:
+        probe_rounds = 6
+        started = time.perf_counter()
+        bcrypt.hashpw(b'calibration', bcrypt.gensalt(rounds=probe_rounds))
+        elapsed = max(time.perf_counter() - started, 1e-6)
+        extra_rounds = int(math.floor(math.log2(BCRYPT_TARGET_SECONDS / elapsed)))
+        _bcrypt_rounds = min(max(probe_rounds + extra_rounds, MIN_BCRYPT_ROUNDS), 31)
+    return _bcrypt_rounds
+
+def hash_password(password):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=bcrypt_rounds())).decode('utf-8')
+
+_unknown_user_password_hash = None
+
+def _unknown_user_hash():
+    global _unknown_user_password_hash
+    if _unknown_user_password_hash is None:
+        _unknown_user_password_hash = hash_password(os.urandom(16).hex())
+    return _unknown_user_password_hash
+
+def check_password(password, password_hash):
+    """Verify password against password_hash; slow by design, so run it off the GUI thread.
+
+    Returns (matches, new_hash). new_hash is set when the stored hash is weaker
+    than the current cost factor and should replace it.
+    """
+    if not bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8')):
+        return False, None
+    stored_rounds = int(password_hash.split('$')[2])
+    if stored_rounds < bcrypt_rounds():
+        return True, hash_password(password)
+    return True, None
+
+ADMIN_USERNAME = "admin"
+ADMIN_INITIAL_PASSWORD = "xxxxxxxxxxxxxxxx"
+
+def ensure_admin_user(session_factory=Session):
+    """Create the initial admin account; hashing is only paid the first time."""
+    with session_scope(session_factory) as session:
+        if session.query(User.id).filter_by(id=1).first() is None:
+            session.add(User(username=ADMIN_USERNAME, password_hash=hash_password(ADMIN_INITIAL_PASSWORD)))
+
+# Patients list sorting and filtering
+# Sort keys of the list, in the order of PATIENT_SUMMARY_COLUMNS: name -> (SQL
+# expression, function turning a summary value into a value of that expression).
+# Every expression is indexed (see MIGRATIONS) and the rows are paged by seeking
+# past the (key, id) of the last row shown, so a page deep in the list costs the
+# same as the first one.
+def _optional(convert):
+    return lambda value: None if value is None else convert(value)
+
+def _integer_or_as_is(value):
+    # Older versions stored the age box's text as it was, '' included, and
+    # SQLite keeps such text in an INTEGER column: seek past it as text
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+PATIENT_SORT_KEYS = {
+    'id': (Patient.id, int),
+    'name': (func.normalize_name(Patient.firstname_familyname), normalize_name),
+    'age': (Patient.age, _optional(_integer_or_as_is)),
+    'address': (Patient.address, _optional(str)),
+    'reason_visit': (Patient.reason_visit, _optional(str)),
+}
+
+PATIENT_FILTERS = ('age_min', 'age_max', 'sex', 'from_whom', 'reason_visit')
+# Columns filtered by exact value; their choices come from distinct_values
+PATIENT_CHOICE_FILTERS = ('sex',)
+# Free-text columns, with too many different values to choose from: filtered
+# by the start of the text, a range within the column's index
+PATIENT_PREFIX_FILTERS = ('from_whom', 'reason_visit')
+
+def _prefix_range(column, prefix):
+    # Every text starting with prefix sorts from prefix up to, not including,
+    # prefix with its last character incremented
+    return and_(column >= prefix, column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+def patient_filter_conditions(filters):
+    """SQL conditions for a dict of PATIENT_FILTERS; a missing or None value does not filter."""
+    filters = {name: value for name, value in (filters or {}).items() if value is not None}
+    unknown = set(filters) - set(PATIENT_FILTERS)
+    if unknown:
+        raise ValueError("Unknown patient filters: %s" % ', '.join(sorted(unknown)))
+    conditions = []
+    if 'age_min' in filters or 'age_max' in filters:
+        # Text sorts above every number in SQLite; see _integer_or_as_is
+        conditions.append(func.typeof(Patient.age) == 'integer')
+    if 'age_min' in filters:
+        conditions.append(Patient.age >= int(filters['age_min']))
+    if 'age_max' in filters:
+        conditions.append(Patient.age <= int(filters['age_max']))
+    for name in PATIENT_CHOICE_FILTERS:
+        if name in filters:
+            conditions.append(getattr(Patient, name) == str(filters[name]))
+    for name in PATIENT_PREFIX_FILTERS:
+        prefix = str(filters.get(name, '')).strip()
+        if prefix:
+            conditions.append(_prefix_range(getattr(Patient, name), prefix))
+    return conditions
+
+def _seek_segments(key, after, descending):
+    """Conditions selecting the rows that come after `after`, a (key value, id) pair.
+
+    SQLite sorts NULLs before every value, so rows with a NULL key form their own
+    segment; the segments are returned in list order and queried one by one.
+    The key comparison is kept apart from the id tie-break so that SQLite seeks
+    in the key's index (it does not for row values holding an expression).
+    """
+    if after is None:
+        return [None]
+    value, last_id = after
+    if descending:
+        if value is None:
+            return [and_(key.is_(None), Patient.id < last_id)]
+        return [and_(key <= value, or_(key < value, Patient.id < last_id)), key.is_(None)]
+    if value is None:
+        return [and_(key.is_(None), Patient.id > last_id), key.isnot(None)]
+    return [and_(key >= value, or_(key > value, Patient.id > last_id))]
+
+# Repository
+# Everything the GUI reads or writes about patients goes through a
+# PatientRepository: LocalPatientRepository works on the database directly,
+# RemotePatientRepository talks to the clinic server (server.py) over HTTP.
+LOGIN_OK = 'ok'
+LOGIN_UNKNOWN_USER = 'unknown_user'
+LOGIN_WRONG_PASSWORD = 'wrong_password'
+LOGIN_TOO_MANY_ATTEMPTS = 'too_many_attempts'  # from the clinic server; see LoginThrottle
+# What the clinic server answers for both of the above two, so that no one on
+# the network can find out which usernames exist
+LOGIN_INVALID_CREDENTIALS = 'invalid_credentials'
+
+class LoginThrottle:
+    """Makes a username, or any other key such as a client address, wait after
+    repeated wrong guesses, without hashing anything meanwhile."""
+
+    FREE_ATTEMPTS = 3
+    MAX_DELAY = 60  # seconds
+    MAX_TRACKED = 1000
+
+    def __init__(self):
+        self._failures = OrderedDict()  # key -> (failed attempts, monotonic time it may retry)
+
+    def retry_after(self, key):
+        """Seconds before key may try again; 0 if it may try now."""
+        _, allowed_at = self._failures.get(key, (0, 0))
+        return max(0, allowed_at - time.monotonic())
+
+    def failed(self, key):
+        count = self._failures.pop(key, (0, 0))[0] + 1
+        delay = 0 if count < self.FREE_ATTEMPTS else min(2 ** (count - self.FREE_ATTEMPTS), self.MAX_DELAY)
+        self._failures[key] = (count, time.monotonic() + delay)
+        if len(self._failures) > self.MAX_TRACKED:
+            self._failures.popitem(last=False)
+
+    def succeeded(self, key):
+        self._failures.pop(key, None)
+
+class NotAuthenticated(Exception):
+    """The clinic server refused a request: not logged in, or the session has expired."""
+
+class ServerUnavailable(Exception):
+    """The clinic server could not be reached, or failed to answer a request."""
+
+class PatientConflict(Exception):
+    """The patient was changed by someone else since it was read; current is its PatientSnapshot now."""
+
+    def __init__(self, current):
+        super(PatientConflict, self).__init__("patient %d is now at version %d" % (current.id, current.version))
+        self.current = current
+
+class PatientRepository:
+    """Patient operations needed by the GUI.
+
+    Summaries are tuples of the PATIENT_SUMMARY_COLUMNS values; full records
+    are PatientSnapshots; values are dicts of column name to value.
+    """
+
+    is_local = True
+
+    def list_page(self, limit, sort='id', descending=False, filters=None, after=None):
+        """Summaries of up to limit patients matching filters, in PATIENT_SORT_KEYS[sort] order.
+
+        after is the (sort column value, id) of the last row of the previous page.
+        """
+        raise NotImplementedError
+
+    def search(self, terms, limit=200, offset=0, filters=None):
+        """Summaries of the patients matching terms and filters, best match first."""
+        raise NotImplementedError
+
+    def distinct_values(self, field):
+        """The different values of one of PATIENT_CHOICE_FILTERS, sorted."""
+        raise NotImplementedError
+
+    def get(self, patient_id):
+        """The PatientSnapshot of a patient, or None."""
+        raise NotImplementedError
+
+    def get_summary(self, patient_id):
+        raise NotImplementedError
+
+    def add(self, values):
+        """Create a patient and return its id."""
+        raise NotImplementedError
+
+    def update(self, patient_id, values, version=None):
+        """Change the given fields of a patient and return its new version.
+
+        values should hold only the fields that were edited: nothing else is
+        written. With a version, the update only applies if the patient is still
+        at that version, and raises PatientConflict otherwise.
+        """
+        raise NotImplementedError
+
+    def delete(self, patient_id):
+        """Delete a patient and their visits."""
+        raise NotImplementedError
+
+    def visits(self, patient_id, limit, before=None):
+        """Up to limit VisitSnapshots of a patient, newest first.
+
+        before is the (visited_at, id) of the oldest visit already shown, to page further back.
+        """
+        raise NotImplementedError
+
+    def add_visit(self, patient_id, notes, evaluation, visited_at=None):
+        """Record a session with a patient, by default now, and return the visit id."""
+        raise NotImplementedError
+
+    def verify_login(self, username, password):
+        """Return LOGIN_OK, LOGIN_UNKNOWN_USER or LOGIN_WRONG_PASSWORD. Slow: bcrypt.
+        A clinic server answers LOGIN_INVALID_CREDENTIALS for either failure, or
+        LOGIN_TOO_MANY_ATTEMPTS; once it answers
+        LOGIN_OK, the session it opens authorizes every later request.
+        """
+        raise NotImplementedError
+
+
+def _coerce_patient_values(values):
+    if 'age' not in values:
+        return values
+    return dict(values, age=coerce_age(values['age']))
+
+class LocalPatientRepository(PatientRepository):
+    """Patients stored in the local database. Every call is its own session_scope,
+    so one repository can be shared by threads."""
+
+    def __init__(self, session_factory=Session):
+        self.session_factory = session_factory
+
+    def list_page(self, limit, sort='id', descending=False, filters=None, after=None):
+        key, to_key = PATIENT_SORT_KEYS[sort]
+        if after is not None:
+            after = (to_key(after[0]), int(after[1]))
+        order = (key.desc(), Patient.id.desc()) if descending else (key, Patient.id)
+        rows = []
+        with session_scope(self.session_factory) as session:
+            query = (session.query(*PATIENT_SUMMARY_COLUMNS)
+                     .filter(*patient_filter_conditions(filters)).order_by(*order))
+            for segment in _seek_segments(key, after, descending):
+                page = query if segment is None else query.filter(segment)
+                rows.extend(tuple(row) for row in page.limit(limit - len(rows)))
+                if len(rows) >= limit:
+                    break
+        return rows
+
+    def search(self, terms, limit=200, offset=0, filters=None):
+        query = fts_query(terms)
+        if not query:
+            return []
+        # Matches in the name count ten times more than matches in the notes
+        patient_hits = (select(literal_column('rowid').label('id'),
+                               literal_column('bm25(patients_fts, 10.0, 1.0)').label('rank'))
+                        .select_from(table('patients_fts'))
+                        .where(text("patients_fts MATCH :query").bindparams(query=query)))
+        visit_hits = (select(Visit.patient_id.label('id'), literal_column('bm25(visits_fts)').label('rank'))
+                      .select_from(table('visits_fts'))
+                      .join(Visit, Visit.id == literal_column('visits_fts.rowid'))
+                      .where(text("visits_fts MATCH :visit_query").bindparams(visit_query=query)))
+        # A patient found in several places ranks by their best match
+        matches = union_all(patient_hits, visit_hits).subquery('matches')
+        hits = (select(matches.c.id, func.min(matches.c.rank).label('rank'))
+                .group_by(matches.c.id)
+                .subquery('hits'))
+        with session_scope(self.session_factory) as session:
+            rows = session.execute(
+                select(*PATIENT_SUMMARY_COLUMNS).join(hits, hits.c.id == Patient.id)
+                .where(*patient_filter_conditions(filters))
+                .order_by(hits.c.rank).limit(limit).offset(offset)
+            )
+            return [tuple(row) for row in rows]
+
+    def distinct_values(self, field):
+        if field not in PATIENT_CHOICE_FILTERS:
+            raise ValueError("Not a choice filter: %r" % field)
+        column = getattr(Patient, field)
+        with session_scope(self.session_factory) as session:
+            query = session.query(column).filter(column.isnot(None), column != '').distinct().order_by(column)
+            return [value for value, in query]
+
+    def get(self, patient_id):
+        # The only query that reads the clinical notes
+        with session_scope(self.session_factory) as session:
+            patient = session.query(Patient).options(undefer_group('notes')).filter_by(id=patient_id).first()
+            return snapshot_patient(patient) if patient else None
+
+    def get_summary(self, patient_id):
+        with session_scope(self.session_factory) as session:
+            row = session.query(*PATIENT_SUMMARY_COLUMNS).filter(Patient.id == patient_id).first()
+            return tuple(row) if row else None
+
+    def add(self, values):
+        values = _coerce_patient_values(values)
+        with session_scope(self.session_factory) as session:
+            patient = Patient(**values)
+            session.add(patient)
+            session.flush()
+            return patient.id
+
+    def update(self, patient_id, values, version=None):
+        values = _coerce_patient_values(values)
+        try:
+            with session_scope(self.session_factory) as session:
+                # The notes stay unloaded: the UPDATE only sets the columns in values
+                patient = session.query(Patient).filter_by(id=patient_id).first()
+                if patient is None:
+                    raise KeyError(patient_id)
+                if version is None or patient.version == version:
+                    for field, value in values.items():
+                        setattr(patient, field, value)
+                    session.flush()
+                    return patient.version
+        except StaleDataError:
+            pass  # changed between the read and the UPDATE
+        current = self.get(patient_id)
+        if current is None:
+            raise KeyError(patient_id)
+        raise PatientConflict(current)
+
+    def delete(self, patient_id):
+        with session_scope(self.session_factory) as session:
+            patient = session.query(Patient).filter_by(id=patient_id).first()
+            if patient is not None:
+                session.query(Visit).filter_by(patient_id=patient_id).delete(synchronize_session=False)
+                session.delete(patient)
+
+    def visits(self, patient_id, limit, before=None):
+        with session_scope(self.session_factory) as session:
+            query = session.query(*Visit.__table__.columns).filter(Visit.patient_id == patient_id)
+            if before is not None:
+                # Same seek as _seek_segments, so it stays within ix_visits_patient_date
+                visited_at, last_id = before
+                query = query.filter(Visit.visited_at <= visited_at,
+                                     or_(Visit.visited_at < visited_at, Visit.id < last_id))
+            rows = query.order_by(Visit.visited_at.desc(), Visit.id.desc()).limit(limit)
+            return [VisitSnapshot(*row) for row in rows]
+
+    def add_visit(self, patient_id, notes, evaluation, visited_at=None):
+        with session_scope(self.session_factory) as session:
+            if session.query(Patient.id).filter_by(id=patient_id).first() is None:
+                raise KeyError(patient_id)
+            visit = Visit(patient_id=patient_id, notes=notes, evaluation=evaluation,
+                          visited_at=visited_at or datetime.now())
+            session.add(visit)
+            session.flush()
+            return visit.id
+
+    def verify_login(self, username, password):
+        with session_scope(self.session_factory) as session:
+            user = session.query(User).filter_by(username=username).first()
+            if user is None:
+                # Hash anyway, so an unknown username takes as long to answer as a wrong password
+                check_password(password, _unknown_user_hash())
+                return LOGIN_UNKNOWN_USER
+            matches, new_hash = check_password(password, user.password_hash)
+            if not matches:
+                return LOGIN_WRONG_PASSWORD
+            if new_hash:
+                # Upgrade the stored hash to the current cost factor
+                user.password_hash = new_hash
+            return LOGIN_OK
+
+class RemotePatientRepository(PatientRepository):
+    """Patients owned by a clinic server, reached with JSON over HTTP."""
+
+    is_local = False
+
+    def __init__(self, url, timeout=10, cafile=None):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        # Trust this certificate (e.g. the server's self-signed one) for https:// urls
+        self.ssl_context = ssl.create_default_context(cafile=cafile) if cafile else None
+        # Session token from the server, sent with every request; see verify_login
+        self.token = None
+        # Changes made here are not seen by the local ORM events, so they are
+        # announced through this callback instead: on_change(signal_name, patient_id)
+        self.on_change = None
+        # Called, from whichever thread made the request, when the server asks
+        # for a new login; NotAuthenticated is raised after it
+        self.on_unauthorized = None
+
+    def _request(self, method, path, payload=None, expected=(), **params):
+        """Send a request and return the JSON answer, or None for 404.
+
+        HTTP errors with a status in expected are raised as they are; any other
+        failure, down to the connection, raises ServerUnavailable.
+        """
+        url = self.url + path
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        data = None if payload is None else json.dumps(payload).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = 'Bearer ' + self.token
+        request = urllib.request.Request(url, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout, context=self.ssl_context) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as exc:
+            if exc.code == 404:
+                return None
+            if exc.code == 401:
+                self.token = None
+                if self.on_unauthorized is not None:
+                    self.on_unauthorized()
+                raise NotAuthenticated("the session has expired; log in again")
+            if exc.code in expected:
+                raise
+            raise ServerUnavailable("the server answered %d %s" % (exc.code, exc.reason))
+        except (OSError, ValueError) as exc:  # refused, timed out, or an answer that is not JSON
+            raise ServerUnavailable("the server could not be reached: %s" % exc)
+
+    def _changed(self, signal_name, patient_id):
+        if self.on_change is not None:
+            self.on_change(signal_name, patient_id)
+
+    def list_page(self, limit, sort='id', descending=False, filters=None, after=None):
+        params = _filter_params(filters)
+        if after is not None:
+            # A missing after_value stands for NULL
+            if after[0] is not None:
+                params['after_value'] = after[0]
+            params['after_id'] = after[1]
+        rows = self._request('GET', '/patients', limit=limit, sort=sort, desc=int(descending), **params)
+        return [tuple(row) for row in rows]
+
+    def search(self, terms, limit=200, offset=0, filters=None):
+        rows = self._request('GET', '/search', q=terms, limit=limit, offset=offset, **_filter_params(filters))
+        return [tuple(row) for row in rows]
+
+    def distinct_values(self, field):
+        return self._request('GET', '/values/%s' % urllib.parse.quote(field))
+
+    def get(self, patient_id):
+        record = self._request('GET', '/patients/%d' % patient_id)
+        return PatientSnapshot(**record) if record else None
+
+    def get_summary(self, patient_id):
+        row = self._request('GET', '/patients/%d/summary' % patient_id)
+        return tuple(row) if row else None
+
+    def add(self, values):
+        patient_id = self._request('POST', '/patients', values)['id']
+        self._changed('inserted', patient_id)
+        return patient_id
+
+    def update(self, patient_id, values, version=None):
+        params = {} if version is None else {'version': version}
+        try:
+            result = self._request('PUT', '/patients/%d' % patient_id, values, expected=(409,), **params)
+        except urllib.error.HTTPError as exc:
+            raise PatientConflict(PatientSnapshot(**json.loads(exc.read().decode('utf-8'))['patient']))
+        if result is None:
+            raise KeyError(patient_id)
+        self._changed('updated', patient_id)
+        return result['version']
+
+    def delete(self, patient_id):
+        self._request('DELETE', '/patients/%d' % patient_id)
+        self._changed('deleted', patient_id)
+
+    def visits(self, patient_id, limit, before=None):
+        params = {'limit': limit}
+        if before is not None:
+            params['before_time'] = before[0].isoformat()
+            params['before_id'] = before[1]
+        records = self._request('GET', '/patients/%d/visits' % patient_id, **params)
+        return [visit_from_record(record) for record in records or []]
+
+    def add_visit(self, patient_id, notes, evaluation, visited_at=None):
+        payload = {'notes': notes, 'evaluation': evaluation}
+        if visited_at is not None:
+            payload['visited_at'] = visited_at.isoformat()
+        result = self._request('POST', '/patients/%d/visits' % patient_id, payload)
+        if result is None:
+            raise KeyError(patient_id)
+        return result['id']
+
+    def verify_login(self, username, password):
+        try:
+            result = self._request('POST', '/login', {'username': username, 'password': password}, expected=(429,))
+        except urllib.error.HTTPError:
+            return LOGIN_TOO_MANY_ATTEMPTS
+        if result['status'] == LOGIN_OK:
+            self.token = result['token']
+        return result['status']
+
+
+def visit_record(visit):
+    """A VisitSnapshot as a JSON-serializable dict."""
+    return dict(visit._asdict(), visited_at=visit.visited_at.isoformat())
+
+def visit_from_record(record):
+    return VisitSnapshot(**dict(record, visited_at=datetime.fromisoformat(record['visited_at'])))
+
+def _filter_params(filters):
+    return {name: value for name, value in (filters or {}).items() if value is not None}
+
+def make_repository(config):
+    """The repository selected by config: the clinic server if a url is set, else the local database."""
+    if config['server']['url']:
+        return RemotePatientRepository(config['server']['url'], cafile=config['server']['cafile'])
+    return LocalPatientRepository()
+
+# Export
+PATIENT_FIELDS = [column.name for column in Patient.__table__.columns]
+# A patient's visits go with its record under this key, as a list of dicts of
+# VISIT_RECORD_FIELDS (JSON text in a CSV cell), oldest first
+VISITS_FIELD = 'visits'
+VISIT_RECORD_FIELDS = ('visited_at', 'notes', 'evaluation')
+EXPORT_FIELDS = PATIENT_FIELDS + [VISITS_FIELD]
+
+def iter_patient_records(fields=None, chunk_size=1000):
+    """Yield every patient as a dict of fields, reading chunk_size rows at a time.
+
+    Uses a plain connection rather than the ORM, so no Patient objects are created
+    and memory stays constant however many patients there are. The visits of a
+    chunk of patients are read with one query.
+    """
+    fields = list(fields or EXPORT_FIELDS)
+    columns = [field for field in fields if field != VISITS_FIELD]
+    table = Patient.__table__
+    visits = Visit.__table__
+    query = select(table.c.id, *[table.c[field] for field in columns]).order_by(table.c.id)
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(query)
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            by_patient = {}
+            if VISITS_FIELD in fields:
+                # Within ix_visits_patient_date, as the chunk's ids are in order
+                visit_rows = conn.execute(
+                    select(visits.c.patient_id, *[visits.c[field] for field in VISIT_RECORD_FIELDS])
+                    .where(visits.c.patient_id.between(rows[0][0], rows[-1][0]))
+                    .order_by(visits.c.patient_id, visits.c.visited_at, visits.c.id))
+                for patient_id, visited_at, notes, evaluation in visit_rows:
+                    by_patient.setdefault(patient_id, []).append(
+                        {'visited_at': visited_at.isoformat(), 'notes': notes, 'evaluation': evaluation})
+            for patient_id, *values in rows:
+                record = dict(zip(columns, values))
+                if VISITS_FIELD in fields:
+                    record[VISITS_FIELD] = by_patient.get(patient_id, [])
+                yield record
+
+def write_csv(records, fields, out):
+    writer = csv.DictWriter(out, fieldnames=fields)
+    writer.writeheader()
+    for record in records:
+        if record.get(VISITS_FIELD):
+            record[VISITS_FIELD] = json.dumps(record[VISITS_FIELD], ensure_ascii=False)
+        elif VISITS_FIELD in record:
+            record[VISITS_FIELD] = None
+        writer.writerow(record)
+
+def write_jsonl(records, fields, out):
+    for record in records:
+        out.write(json.dumps(record, ensure_ascii=False))
+        out.write('\n')
+
+# format name -> (writer, file encoding). utf-8-sig lets Excel detect the Arabic text.
+EXPORT_FORMATS = {
+    'csv': (write_csv, 'utf-8-sig'),
+    'jsonl': (write_jsonl, 'utf-8'),
+}
+
+def export_patients(path, fmt=None, fields=None, chunk_size=1000):
+    """Stream all patients to path as CSV or JSON Lines and return how many were written.
+
+    fmt defaults to the file extension; fields defaults to every column and the visits.
+    """
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError("Unsupported export format: %r" % fmt)
+    fields = list(fields or EXPORT_FIELDS)
+    unknown = set(fields) - set(EXPORT_FIELDS)
+    if unknown:
+        raise ValueError("Unknown patient fields: %s" % ', '.join(sorted(unknown)))
+
+    writer, encoding = EXPORT_FORMATS[fmt]
+    count = 0
+
+    def counted(records):
+        nonlocal count
+        for count, record in enumerate(records, 1):
+            yield record
+
+    with open(path, 'w', newline='', encoding=encoding, buffering=1024 * 1024) as out:
+        writer(counted(iter_patient_records(fields, chunk_size)), fields, out)
+    return count
+
+# Import
+ImportResult = namedtuple('ImportResult', ['imported', 'visits', 'errors'])  # errors: list of (line, message)
+
+def read_csv_records(path):
+    """Yield (line number, record dict) for every data row of a CSV file.
+
+    The line number is where the row starts; a quoted value may span several lines.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as source:
+        # csv.reader rather than DictReader, which skips blank lines unseen
+        reader = csv.reader(source)
+        fields = next(reader, None)
+        while fields is not None:
+            line_number = reader.line_num + 1
+            row = next(reader, None)
+            if row is None:
+                break
+            if row:
+                yield line_number, dict(zip(fields, row))
+
+def read_jsonl_records(path):
+    """Yield (line number, record) for every non-empty line; record is None if it is not valid JSON."""
+    with open(path, encoding='utf-8-sig') as source:
+        for line_number, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, None
+
+IMPORT_FORMATS = {
+    'csv': read_csv_records,
+    'jsonl': read_jsonl_records,
+}
+
+def coerce_age(value):
+    """The age to store for value: a whole number of years from 0 to 150, or None when blank.
+
+    Raises ValueError for anything else.
+    """
+    if isinstance(value, str):
+        value = value.strip()
+    if value is None or value == '':
+        return None
+    try:
+        age = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("age is not a number: %r" % value)
+    if not age.is_integer() or not 0 <= age <= 150:
+        raise ValueError("age is out of range: %r" % value)
+    return int(age)
+
+def coerce_patient_record(record):
+    """Return the column values to insert for one imported record.
+
+    Every column is present (None when missing) so a whole batch shares one
+    INSERT statement. Imported ids and versions are ignored (a new patient
+    starts at version 1); unknown keys are skipped.
+    Raises ValueError when the record cannot be imported.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("not a JSON object")
+    values = {'version': 1}
+    for field in PATIENT_FIELDS:
+        if field in ('id', 'version'):
+            continue
+        value = record.get(field)
+        if isinstance(value, str):
+            value = value.strip()
+        values[field] = None if value == '' else value
+    if not values['firstname_familyname']:
+        raise ValueError("firstname_familyname is required")
+    values['age'] = coerce_age(values['age'])
+    for field, value in values.items():
+        if value is not None and field != 'age':
+            values[field] = str(value)
+    return values
+
+def coerce_visit_records(value):
+    """Return the column values to insert for the visits of one imported record.
+
+    value is the record's VISITS_FIELD: a list of visit dicts, the JSON text of
+    one, or None or '' for no visits. Raises ValueError when it cannot be imported.
+    """
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            raise ValueError("visits is not valid JSON")
+    if not isinstance(value, list) or not all(isinstance(visit, dict) for visit in value):
+        raise ValueError("visits is not a list of JSON objects")
+    rows = []
+    for visit in value:
+        try:
+            visited_at = datetime.fromisoformat(visit.get('visited_at'))
+        except (TypeError, ValueError):
+            raise ValueError("visited_at is not an ISO date and time: %r" % visit.get('visited_at'))
+        row = {'visited_at': visited_at}
+        for field in ('notes', 'evaluation'):
+            text_value = visit.get(field)
+            row[field] = None if text_value is None or text_value == '' else str(text_value)
+        rows.append(row)
+    return rows
+
+def import_patients(path, fmt=None, batch_size=5000):
+    """Insert the patients of a CSV or JSON Lines file, with their visits, and return an ImportResult.
+
+    Everything is inserted in one transaction with executemany batches. Invalid
+    rows are reported in the result and skipped rather than aborting the import.
+    The search triggers are dropped meanwhile and the new rows indexed once at the end.
+    """
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError("Unsupported import format: %r" % fmt)
+
+    table = Patient.__table__
+    imported = 0
+    imported_visits = 0
+    errors = []
+    batch = []
+    visit_batch = []
+
+    def insert_batch():
+        nonlocal imported, imported_visits, batch, visit_batch
+        conn.execute(table.insert(), batch)
+        if visit_batch:
+            conn.execute(Visit.__table__.insert(), visit_batch)
+        imported += len(batch)
+        imported_visits += len(visit_batch)
+        batch, visit_batch = [], []
+
+    with engine.begin() as conn:
+        begin_explicitly(conn)  # so a failed import brings the triggers back with its rollback
+        last_id = conn.execute(text("SELECT coalesce(max(id), 0) FROM patients")).scalar()
+        # The write lock is held from here on, so the ids after last_id are free
+        # to give out; the visits need them before their patients are inserted
+        next_id = last_id + 1
+        drop_search_triggers(conn)
+        for line_number, record in IMPORT_FORMATS[fmt](path):
+            try:
+                values = coerce_patient_record(record)
+                visits = coerce_visit_records(record.get(VISITS_FIELD))
+            except ValueError as exc:
+                errors.append((line_number, str(exc)))
+                continue
+            values['id'] = next_id
+            for visit in visits:
+                visit['patient_id'] = next_id
+            next_id += 1
+            batch.append(values)
+            visit_batch.extend(visits)
+            if len(batch) >= batch_size:
+                insert_batch()
+        if batch:
+            insert_batch()
+        index_patients_after(conn, last_id)
+        create_search_triggers(conn)
+    return ImportResult(imported, imported_visits, errors)